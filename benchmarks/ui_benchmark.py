@@ -0,0 +1,292 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+# Benchmark of the UI operations growing with the number of pins.
+#
+# Every pin count runs the real app in a separate process with a synthetic pins database.
+# Tiles are not downloaded and the tile cache is kept in the run's temporary directory.
+# Results are saved as JSON and can be compared against a saved baseline:
+#
+#   python benchmarks/ui_benchmark.py --output results.json
+#   python benchmarks/ui_benchmark.py --baseline results.json --output new_results.json
+#
+# Without a display run it under xvfb-run or with the mock GL backend (--gl-backend mock).
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+# Directory of the app's modules, kv files and assets
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'travelAlarm')
+DEFAULT_PIN_COUNTS = (100, 1000, 10000)
+# Center of the synthetic pins, the default map position of the app
+CENTER = (50.053756, 19.940927)
+# Tile server refusing connections, so the benchmarks never wait for the network
+DUMMY_TILE_URL = 'http://127.0.0.1:9/{z}/{x}/{y}.png'
+
+
+def create_database(filename, pin_count, seed=0):
+    """Create pins database with synthetic pins scattered around the center."""
+    random.seed(seed)
+    connection = sqlite3.connect(filename)
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS pins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            is_active BOOLEAN,
+            address TEXT,
+            latitude REAL,
+            longitude REAL,
+            buffer_size REAL,
+            buffer_unit TEXT CHECK (buffer_unit IN ('m', 'km')),
+            insert_datetime DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    connection.executemany(
+        'INSERT INTO pins (is_active, address, latitude, longitude, buffer_size, buffer_unit) VALUES (?, ?, ?, ?, ?, ?);',
+        [
+            (
+                random.random() < .3,
+                f'Synthetic street {index}, Cracow',
+                CENTER[0] + random.uniform(-.5, .5),
+                CENTER[1] + random.uniform(-.8, .8),
+                random.choice((100, 300, 500, 1, 2)),
+                random.choice(('m', 'km')),
+            )
+            for index in range(pin_count)
+        ]
+    )
+    connection.commit()
+    connection.close()
+
+
+def summarize(samples):
+    """Return statistics of the timing samples in milliseconds."""
+    samples = sorted(sample * 1000 for sample in samples)
+    return {
+        'median_ms': statistics.median(samples),
+        'p95_ms': samples[min(int(len(samples) * .95), len(samples) - 1)],
+        'min_ms': samples[0],
+        'runs': len(samples),
+    }
+
+
+def measure(function, runs):
+    """Return timing samples of the function calls in seconds."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def rss_bytes():
+    """Return resident memory of the process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # Maximal resident memory in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_single(pin_count, output, runs):
+    """Run the app with synthetic pins and save benchmark results of its UI operations."""
+    directory = tempfile.mkdtemp(prefix='travelalarm-benchmark-')
+    db_filename = os.path.join(directory, 'pins.db')
+    create_database(db_filename, pin_count)
+
+    # App loads its kv files and assets from its directory
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+
+    from kivy.clock import Clock
+    from main import TravelAlarmApp
+    from mapwidget import MapWidget
+    from startup import profile as startup_profile
+    from settingsscreen import PrimaryPaletteToolbar
+
+    # Keep the tile cache in the temporary directory and do not download any tiles
+    MapWidget.tile_cache_filename = os.path.join(directory, 'tiles.mbtiles')
+    MapWidget.tile_url = DUMMY_TILE_URL
+
+    metrics = {}
+
+    class BenchmarkApp(TravelAlarmApp):
+        """App measuring its UI operations once all markers are created."""
+
+        def build(self):
+            start = time.perf_counter()
+            root = super().build()
+            metrics['build'] = summarize([time.perf_counter() - start])
+            # Prefetcher threads would compete with the measured operations
+            self.tile_prefetcher.max_pending = 0
+            return root
+
+        def on_first_frame(self, *args):
+            super().on_first_frame(*args)
+            metrics['first_frame_since_process_start_ms'] = startup_profile.phases[-1][1] * 1000
+            self.ready_start = time.perf_counter()
+            # Memory of the markers is measured from the first frame, after the app and its framework are loaded
+            self.rss_start = rss_bytes()
+            self.markers_start = len(self.markers)
+            Clock.schedule_interval(self.wait_for_markers, 0)
+
+        def wait_for_markers(self, dt):
+            """Start benchmarks when all pins are loaded and their markers are created."""
+            if not self.pins_loader.finished or self.map_widget.marker_layer._pending_markers:
+                return True
+            metrics['markers_ready'] = summarize([time.perf_counter() - self.ready_start])
+            metrics['markers'] = len(self.markers)
+            metrics['memory_per_marker_bytes'] = (
+                (rss_bytes() - self.rss_start) / max(len(self.markers) - self.markers_start, 1)
+            )
+            self.run_benchmarks()
+            self.stop()
+            return False
+
+        def run_benchmarks(self):
+            """Measure UI operations of the running app."""
+            map_widget = self.map_widget
+            marker_layer = map_widget.marker_layer
+            screen_manager = self.root.ids.screen_manager
+
+            # Pins are read from the database by the pins loader
+            metrics['database_iter_pins'] = summarize(measure(lambda: list(self.database.iter_pins(*CENTER)), runs))
+
+            # Pan by a fraction of the screen per frame
+            map_widget.center_on(*CENTER)
+            map_widget.zoom = 12
+            pan_samples = []
+            for frame in range(runs * 6):
+                map_widget.center_on(CENTER[0] + frame * .0005, CENTER[1] + frame * .0005)
+                pan_samples.extend(measure(marker_layer.reposition, 1))
+            metrics['markers_reposition_per_pan_frame'] = summarize(pan_samples)
+
+            def zoom_step(zoom):
+                map_widget.set_zoom_at(zoom, *map_widget.center)
+                marker_layer.reposition()
+            zoom_samples = []
+            for _ in range(runs):
+                for zoom in list(range(8, 16)) + list(range(16, 8, -1)):
+                    zoom_samples.extend(measure(lambda: zoom_step(zoom), 1))
+            metrics['zoom_step'] = summarize(zoom_samples)
+
+            list_screen = screen_manager.get_screen('ListScreen')
+            metrics['list_set_list_data'] = summarize(measure(list_screen.set_list_data, runs))
+
+            settings_screen = screen_manager.get_screen('SettingsScreen')
+            toolbar = next(widget for widget in settings_screen.walk() if isinstance(widget, PrimaryPaletteToolbar))
+            palettes = iter(['Cyan', 'Light Green'] * runs)
+            metrics['palette_switch'] = summarize(
+                measure(lambda: toolbar.update_primary_palette(next(palettes)), runs * 2)
+            )
+
+    app = BenchmarkApp()
+    app.db_filename = db_filename
+    app.snapshot_filename = os.path.join(directory, 'pins.snapshot')
+    app.run()
+
+    with open(output, 'w') as output_file:
+        json.dump({'pins': pin_count, 'metrics': metrics}, output_file, indent=2)
+
+
+def run_suite(pin_counts, runs, gl_backend):
+    """Run benchmarks for every pin count in a separate process and return their results."""
+    environment = dict(os.environ, KIVY_NO_ARGS='1', KIVY_NO_FILELOG='1')
+    # Use dummy video driver without a display
+    if sys.platform.startswith('linux') and not environment.get('DISPLAY'):
+        environment.setdefault('SDL_VIDEODRIVER', 'dummy')
+    if gl_backend:
+        environment['KIVY_GL_BACKEND'] = gl_backend
+
+    results = []
+    for pin_count in pin_counts:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as result_file:
+            result_filename = result_file.name
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            '--single', str(pin_count), '--output', result_filename, '--runs', str(runs),
+        ]
+        completed = subprocess.run(command, env=environment)
+        if completed.returncode != 0:
+            results.append({'pins': pin_count, 'error': f'exit code {completed.returncode}'})
+            continue
+        with open(result_filename) as result_file:
+            results.append(json.load(result_file))
+        os.remove(result_filename)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+
+
+def compare(suite, baseline, threshold):
+    """Return lines comparing median timings with the baseline and number of regressions above the threshold."""
+    baseline_results = {result['pins']: result.get('metrics', {}) for result in baseline.get('results', [])}
+    lines = []
+    regressions = 0
+    for result in suite['results']:
+        baseline_metrics = baseline_results.get(result['pins'])
+        if baseline_metrics is None:
+            continue
+        for name, value in result.get('metrics', {}).items():
+            previous = baseline_metrics.get(name)
+            if not isinstance(value, dict) or not isinstance(previous, dict) or not previous['median_ms']:
+                continue
+            change = value['median_ms'] / previous['median_ms'] - 1
+            regressed = change > threshold
+            regressions += regressed
+            lines.append(
+                f"{result['pins']:>6} pins  {name:<36} {previous['median_ms']:9.3f} -> {value['median_ms']:9.3f} ms "
+                f"({change * 100:+.0f}%){'  REGRESSION' if regressed else ''}"
+            )
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark UI operations of travelAlarm with synthetic pins.')
+    parser.add_argument('--pins', type=int, nargs='+', default=DEFAULT_PIN_COUNTS, help='numbers of synthetic pins')
+    parser.add_argument('--runs', type=int, default=10, help='repetitions of every measured operation')
+    parser.add_argument('--output', default='ui_benchmark.json', help='file of the results')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=.2, help='relative slowdown reported as a regression')
+    parser.add_argument('--gl-backend', help='Kivy GL backend, e.g. mock for machines without GPU')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        run_single(args.single, os.path.abspath(args.output), args.runs)
+        return 0
+
+    output = os.path.abspath(args.output)
+    suite = run_suite(args.pins, args.runs, args.gl_backend)
+    with open(output, 'w') as output_file:
+        json.dump(suite, output_file, indent=2)
+    print(f'Results saved to {output}')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            lines, regressions = compare(suite, json.load(baseline_file), args.threshold)
+        print('\n'.join(lines))
+        print(f'{regressions} regressions above {args.threshold * 100:.0f}%')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,7 @@ from kivy.uix.screenmanager import Screen
 from kivy.properties import ObjectProperty
 from kivy.clock import Clock
 
-from geocode import geocode_by_address
+from geocode import geocode_by_address, geocode_in_background
 
 
 class AddressesList(Screen):
@@ -26,19 +26,21 @@ class AddressesList(Screen):
         if len(text) == 0:
             return False
 
-        try:
-            # Get list of proposed addresses and locations
-            addresses, latitudes, longitudes = geocode_by_address(text, exactly_one=False, limit=5)
-
-            # Add proposed addresses to the list
-            for address, latitude, longitude in zip(addresses, latitudes, longitudes):
-                self.ids.addresses_list.data.insert(
-                    0,
-                    {'text': address, 'on_release': lambda args=(address, latitude, longitude): self.add_pin(*args)}
-                )
-            return True
-        except:
-            return False
+        # Get list of proposed addresses and locations in the background, the newer text supersedes this one
+        geocode_in_background(
+            'autocomplete', geocode_by_address, (text, False, 5),
+            self.show_proposed_addresses, lambda error: None,
+        )
+        return True
+
+    def show_proposed_addresses(self, locations):
+        """Add proposed addresses to the list."""
+        addresses, latitudes, longitudes = locations
+        for address, latitude, longitude in zip(addresses, latitudes, longitudes):
+            self.ids.addresses_list.data.insert(
+                0,
+                {'text': address, 'on_release': lambda args=(address, latitude, longitude): self.add_pin(*args)}
+            )
 
     def add_pin(self, address, latitude, longitude):
         """Add new marker to the list and database."""
@@ -46,8 +48,5 @@ class AddressesList(Screen):
         # Add marker to the database
         list_screen.database.add_marker_by_address_lat_lon(address, latitude, longitude)
 
-        # Refresh pins list
-        list_screen.set_list_data()
-
         # Switch back to list view mode
         list_screen.hide_search_view()
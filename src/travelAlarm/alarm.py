@@ -4,72 +4,163 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
+import time
 from kivymd.app import MDApp
 from kivymd.uix.button import MDFlatButton
 from kivymd.uix.dialog import MDDialog
-from kivy.core.audio import SoundLoader
 from kivy.clock import Clock
-from plyer import vibrator
 
+from tracing import tracer, TRIGGER_DECIDED, DIALOG_OPENED, SOUND_STARTED
+from triplog import ALARM_FIRED, ALARM_DISMISSED
 
-class Alarm:
-    def __init__(self, marker):
-        self.app = MDApp.get_running_app()
 
-        # Marker's pin reference
-        self.pin = marker.pin
+class AlarmDispatcher:
+    """
+    Single dispatcher of the alarms triggered by the pins.
 
-        # Deactivate buffer with UI update
-        self.pin.on_checkbox_click(False)
-        # Refresh UI on ListScreen
-        self.refresh_list_screen()
-        # Build button to close dialog window
-        self.alarm_button = MDFlatButton(
-            text='OK',
-            theme_text_color='Custom',
-            text_color=self.app.theme_cls.primary_color,
-        )
-        # Build dialog window
-        self.alarm_dialog = MDDialog(
-            title='Wake up!',
-            text=f'You are within {self.pin.buffer_size} {self.pin.buffer_unit} from {self.pin.address}',
-            buttons=[self.alarm_button]
-        )
-        # Bind button event to close dialog window
-        self.alarm_button.bind(on_release=lambda x: self.stop_alarm())
+    The selected alarm sound is loaded in advance and cached, so triggering the alarm only starts
+    its playback. No matter how many pins, corridors and polygons trigger, there is one sound playback, one vibration
+    schedule and one dialog window listing all of them.
+    """
 
-        # Load alarm file sound
-        self.alarm_sound = SoundLoader.load(self.app.alarm_file)
-        # Open dialog window
-        self.alarm_dialog.open()
+    def __init__(self):
+        self.app = MDApp.get_running_app()
 
-        # Trigger vibrations if device has a vibrator
+        # Loaded sounds by alarm file
+        self._sounds = {}
+        self.alarm_sound = None
         self.vibration_event = None
-        if vibrator.exists():
-            self.vibration_event = Clock.schedule_interval(lambda dt: vibrator.vibrate(1), 2.5)
+        # Dialog window listing messages of triggered geofences
+        self.alarm_dialog = None
+        self.alarm_messages = []
+        # Latency trace of the fix which triggered the alarm
+        self.trace_id = None
+        self._dialog_trigger = Clock.create_trigger(lambda dt: self.open_alarm_dialog())
+        # Time from the GPS fix to the alarm sound start in seconds
+        self.latency = None
+
+        # Reload the alarm sound when the alarm file is changed
+        self.app.bind(alarm_file=lambda app, alarm_file: self.preload())
+
+    @property
+    def is_ringing(self):
+        """Check if the alarm is ringing."""
+        return bool(self.alarm_messages)
+
+    def get_sound(self, alarm_file):
+        """Return the alarm sound, load it on first use."""
+        if alarm_file not in self._sounds:
+            from kivy.core.audio import SoundLoader
+            self._sounds[alarm_file] = SoundLoader.load(alarm_file)
+        return self._sounds[alarm_file]
+
+    def preload(self):
+        """Load the selected alarm sound before the alarm is triggered."""
+        # Do not change the sound while the alarm is ringing
+        if self.is_ringing:
+            return False
+        self.alarm_sound = self.get_sound(self.app.alarm_file)
+        return self.alarm_sound is not None
+
+    def trigger(self, pin, fix_time=None, trace_id=None):
+        """Trigger the alarm for the pin within the buffer."""
+        tracer.record(TRIGGER_DECIDED, trace_id)
+        # Deactivate pin's buffer in the pin store
+        self.app.pins.update(pin.pin_id, is_active=False)
+        self.ring(f'You are within {pin.buffer_size} {pin.buffer_unit} from {pin.address}', fix_time, trace_id)
+
+    def trigger_corridor(self, corridor, fix_time=None, trace_id=None):
+        """Trigger the alarm for the corridor left or reached by the user."""
+        tracer.record(TRIGGER_DECIDED, trace_id)
+        # Corridor's alarm stays active and is armed again when the user crosses its edge back
+        self.ring(corridor.alarm_message, fix_time, trace_id)
 
-        self.sound_alarm()
+    def trigger_polygon(self, polygon, fix_time=None, trace_id=None):
+        """Trigger the alarm for the polygon entered by the user."""
+        tracer.record(TRIGGER_DECIDED, trace_id)
+        # Polygon's alarm stays active and is armed again when the user leaves the polygon
+        self.ring(polygon.alarm_message, fix_time, trace_id)
 
-    def refresh_list_screen(self):
-        """Refresh UI on ListScreen."""
-        list_screen = self.app.root.ids.screen_manager.get_screen('ListScreen')
-        list_screen.clear_list_data()
-        list_screen.set_list_data()
+    def ring(self, message, fix_time=None, trace_id=None):
+        """Start the alarm or add the message to the ringing one."""
+        is_ringing = self.is_ringing
+        self.alarm_messages.append(message)
+        if not is_ringing:
+            self.trace_id = trace_id
+            self.app.trip_log.record(ALARM_FIRED, detail=message)
+            if self.sound_alarm():
+                tracer.record(SOUND_STARTED, trace_id)
+            self.vibrate()
+            if fix_time is not None:
+                self.latency = time.perf_counter() - fix_time
+        # Open or update the dialog window once for all pins triggered within the frame
+        self._dialog_trigger()
 
     def sound_alarm(self):
         """Turn on the alarm sound."""
+        if self.alarm_sound is None:
+            self.preload()
         if self.alarm_sound:
             self.alarm_sound.loop = True
             self.alarm_sound.play()
             return True
         return False
 
+    def vibrate(self):
+        """Trigger vibrations if device has a vibrator."""
+        from plyer import vibrator
+        if self.vibration_event is None and vibrator.exists():
+            self.vibration_event = Clock.schedule_interval(lambda dt: vibrator.vibrate(1), 2.5)
+            return True
+        return False
+
+    def build_alarm_text(self):
+        """Build text of the dialog window listing triggered geofences."""
+        return '\n'.join(self.alarm_messages)
+
+    def open_alarm_dialog(self):
+        """Open dialog window or update the opened one with triggered geofences."""
+        if not self.alarm_messages:
+            return False
+        if self.alarm_dialog:
+            self.alarm_dialog.text = self.build_alarm_text()
+            return True
+
+        # Build button to close dialog window
+        alarm_button = MDFlatButton(
+            text='OK',
+            theme_text_color='Custom',
+            text_color=self.app.theme_cls.primary_color,
+        )
+        # Build dialog window
+        self.alarm_dialog = MDDialog(
+            title='Wake up!',
+            text=self.build_alarm_text(),
+            buttons=[alarm_button],
+            auto_dismiss=False,
+        )
+        # Bind button event to close dialog window
+        alarm_button.bind(on_release=lambda x: self.stop_alarm())
+        # Open dialog window
+        self.alarm_dialog.open()
+        tracer.record(DIALOG_OPENED, self.trace_id)
+        return True
+
     def stop_alarm(self, *args):
         """Turn off the alarm and vibrations."""
+        if self.alarm_messages:
+            self.app.trip_log.record(ALARM_DISMISSED, detail='\n'.join(self.alarm_messages))
         if self.alarm_sound:
             self.alarm_sound.stop()
 
         if self.vibration_event:
-            Clock.unschedule(self.vibration_event)
+            self.vibration_event.cancel()
+            self.vibration_event = None
 
-        self.alarm_dialog.dismiss()
+        if self.alarm_dialog:
+            self.alarm_dialog.dismiss()
+            self.alarm_dialog = None
+        self.alarm_messages = []
+        # Load newly selected alarm sound
+        if self.alarm_sound is not self._sounds.get(self.app.alarm_file):
+            self.preload()
@@ -0,0 +1,275 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from array import array
+from math import radians, cos, sqrt, floor, log2, inf
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+from fixfilter import capped_margin
+
+# Approximate length of one degree of latitude in meters
+METERS_PER_DEGREE = 111320
+# Corridor alarm modes, triggered when the user leaves the route or reaches it
+CORRIDOR_MODES = ('leave', 'reach')
+
+
+def pack_points(points):
+    """Pack route points into bytes of latitude and longitude doubles."""
+    return array('d', [coordinate for point in points for coordinate in point]).tobytes()
+
+
+def unpack_points(data):
+    """Unpack route points from bytes of latitude and longitude doubles."""
+    coordinates = array('d')
+    coordinates.frombytes(data)
+    return list(zip(coordinates[0::2], coordinates[1::2]))
+
+
+def read_gpx(filename):
+    """Return name and points of the first track segment or route in the GPX file."""
+    name = None
+    points = []
+    for event, element in ElementTree.iterparse(filename):
+        # Strip GPX namespace from the tag
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag in ('trkpt', 'rtept'):
+            points.append((float(element.get('lat')), float(element.get('lon'))))
+            element.clear()
+        elif tag == 'name' and name is None and element.text:
+            name = element.text.strip()
+        # Following segments, tracks and routes are not joined to the first one
+        elif tag in ('trkseg', 'rte') and points:
+            break
+    return name, points
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    """Return distance from the point to the segment in the plane."""
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    if length == 0:
+        return sqrt((px - ax) ** 2 + (py - ay) ** 2)
+    # Project point onto the segment
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length))
+    return sqrt((px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2)
+
+
+def simplification_tolerances(points):
+    """
+    Return the largest Douglas-Peucker tolerance in meters at which each point of the route is still kept.
+
+    Route simplified with any tolerance consists of the points whose tolerance is greater than it,
+    so all simplification levels are computed by one pass of the algorithm.
+    """
+    if len(points) < 3:
+        return [inf] * len(points)
+    meters_per_degree_lon = METERS_PER_DEGREE * cos(radians(points[0][0]))
+    xy = [(lon * meters_per_degree_lon, lat * METERS_PER_DEGREE) for lat, lon in points]
+
+    tolerances = [0.0] * len(points)
+    tolerances[0] = tolerances[-1] = inf
+    # Point is kept only if the point splitting its segment is kept as well
+    stack = [(0, len(points) - 1, inf)]
+    while stack:
+        first, last, bound = stack.pop()
+        farthest, max_distance = None, 0.0
+        for index in range(first + 1, last):
+            distance = segment_distance(*xy[index], *xy[first], *xy[last])
+            if distance > max_distance:
+                farthest, max_distance = index, distance
+        if farthest is not None:
+            tolerance = min(max_distance, bound)
+            tolerances[farthest] = tolerance
+            stack.append((first, farthest, tolerance))
+            stack.append((farthest, last, tolerance))
+    return tolerances
+
+
+def simplify(points, tolerance):
+    """Simplify route with Douglas-Peucker algorithm, tolerance is provided in meters."""
+    return [point for point, needed in zip(points, simplification_tolerances(points)) if needed > tolerance]
+
+
+class Corridor:
+    """
+    Route geofence, a polyline with a width.
+
+    Segments are indexed in a grid of cells as large as the corridor's width, so checking a position
+    computes distances only to the segments in the cells around it. Route is simplified for drawing
+    at levels of tolerance doubling from one meter, they are built once outside of the UI thread.
+    """
+
+    __slots__ = ('corridor_id', 'name', 'is_active', 'mode', 'width', 'points', 'inside', '_grid', '_cell', '_levels')
+
+    # Minimal size of the grid cell in meters
+    min_cell_size = 200
+    # Number of simplification levels, tolerance of the last one is 2 ** (levels - 1) meters
+    levels = 14
+    # Maximal number of points drawn until the simplification levels are built
+    preview_points = 1000
+
+    def __init__(self, corridor_id, name, is_active, mode, width, points):
+        self.corridor_id = corridor_id
+        self.name = name
+        self.is_active = is_active
+        self.mode = mode
+        self.width = width
+        self.points = points
+        # Whether the user has been within the corridor at the last check
+        self.inside = False
+        self._grid = None
+        self._cell = None
+        # Simplified points by the level of tolerance
+        self._levels = None
+
+    def _build_grid(self):
+        """Index segments in the cells covered by their bounding boxes."""
+        mean_latitude = sum(lat for lat, lon in self.points) / len(self.points)
+        cell_lat = max(self.width, self.min_cell_size) / METERS_PER_DEGREE
+        cell_lon = cell_lat / max(cos(radians(mean_latitude)), .01)
+        self._cell = (cell_lat, cell_lon)
+
+        grid = {}
+        for index in range(len(self.points) - 1):
+            (lat_a, lon_a), (lat_b, lon_b) = self.points[index], self.points[index + 1]
+            for row in range(floor(min(lat_a, lat_b) / cell_lat), floor(max(lat_a, lat_b) / cell_lat) + 1):
+                for column in range(floor(min(lon_a, lon_b) / cell_lon), floor(max(lon_a, lon_b) / cell_lon) + 1):
+                    grid.setdefault((row, column), []).append(index)
+        self._grid = grid
+
+    def distance(self, latitude, longitude, limit):
+        """Return distance from the position to the route in meters, or None if it is farther than the limit."""
+        if len(self.points) < 2:
+            return None
+        if self._grid is None:
+            self._build_grid()
+        cell_lat, cell_lon = self._cell
+        meters_per_degree_lon = METERS_PER_DEGREE * cos(radians(latitude))
+        limit_lat = limit / METERS_PER_DEGREE
+        limit_lon = limit / max(meters_per_degree_lon, 1)
+
+        # Collect segments from the cells within the limit
+        segments = set()
+        for row in range(floor((latitude - limit_lat) / cell_lat), floor((latitude + limit_lat) / cell_lat) + 1):
+            for column in range(floor((longitude - limit_lon) / cell_lon), floor((longitude + limit_lon) / cell_lon) + 1):
+                segments.update(self._grid.get((row, column), ()))
+
+        nearest = None
+        for index in segments:
+            (lat_a, lon_a), (lat_b, lon_b) = self.points[index], self.points[index + 1]
+            # Segment in meters relative to the position
+            distance = segment_distance(
+                0, 0,
+                (lon_a - longitude) * meters_per_degree_lon, (lat_a - latitude) * METERS_PER_DEGREE,
+                (lon_b - longitude) * meters_per_degree_lon, (lat_b - latitude) * METERS_PER_DEGREE,
+            )
+            if distance <= limit and (nearest is None or distance < nearest):
+                nearest = distance
+        return nearest
+
+    def contains(self, latitude, longitude):
+        """Check if the position is within the corridor."""
+        return self.distance(latitude, longitude, self.width) is not None
+
+    def build_levels(self):
+        """Simplify the route at all levels of tolerance."""
+        tolerances = simplification_tolerances(self.points)
+        self._levels = [
+            [point for point, needed in zip(self.points, tolerances) if needed > 2 ** level]
+            for level in range(self.levels)
+        ]
+
+    def simplified(self, meters_per_pixel):
+        """Return route simplified to at most one pixel of provided length in meters."""
+        levels = self._levels
+        if levels is None:
+            # Every few points are drawn until the levels are built
+            step = max(len(self.points) // self.preview_points, 1)
+            return self.points if step == 1 else self.points[::step] + self.points[-1:]
+        level = int(log2(meters_per_pixel)) if meters_per_pixel >= 1 else 0
+        return levels[min(level, len(levels) - 1)]
+
+    @property
+    def alarm_message(self):
+        """Return alarm message of the corridor."""
+        if self.mode == 'leave':
+            return f'You have left the route {self.name}'
+        return f'You have reached the route {self.name}'
+
+
+class CorridorIndex:
+    """Corridor geofences checked against the user's position."""
+
+    # Default width of imported corridors in meters
+    default_width = 100
+
+    def __init__(self, database):
+        self.database = database
+        # Corridor records by corridor's identifier
+        self.corridors = {}
+        # Thread building simplification levels of the routes
+        self._executor = None
+
+    def __len__(self):
+        return len(self.corridors)
+
+    def values(self):
+        """Return corridor records."""
+        return self.corridors.values()
+
+    def load(self, corridors):
+        """Replace corridors with provided records."""
+        self.corridors = {corridor.corridor_id: corridor for corridor in corridors}
+        for corridor in self.corridors.values():
+            self._build_levels(corridor)
+
+    def _build_levels(self, corridor):
+        """Build simplification levels of the corridor in the background."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='corridors')
+        return self._executor.submit(corridor.build_levels)
+
+    def import_gpx(self, filename, mode='leave', width=None):
+        """Add corridor read from the GPX file."""
+        name, points = read_gpx(filename)
+        if len(points) < 2:
+            raise ValueError('GPX file contains no route')
+        corridor = self.database.add_corridor(name or 'route', points, width or self.default_width, mode)
+        self.corridors[corridor.corridor_id] = corridor
+        self._build_levels(corridor)
+        return corridor
+
+    def set_active(self, corridor_id, is_active):
+        """Switch corridor's alarm on or off."""
+        corridor = self.corridors[corridor_id]
+        corridor.is_active = is_active
+        corridor.inside = False
+        self.database.update_corridor_is_active(corridor_id, is_active)
+
+    def remove(self, corridor_id):
+        """Delete corridor."""
+        self.corridors.pop(corridor_id, None)
+        self.database.delete_corridor(corridor_id)
+
+    def check(self, latitude, longitude, margin=0):
+        """Return active corridors whose alarm is triggered at the position extended by the margin in meters."""
+        triggered = []
+        for corridor in self.corridors.values():
+            if not corridor.is_active:
+                continue
+            # Reaching requires the margin within the corridor and leaving requires it outside of the corridor
+            corridor_margin = capped_margin(margin, corridor.width)
+            limit = corridor.width - corridor_margin if corridor.mode == 'reach' else corridor.width + corridor_margin
+            inside = limit >= 0 and corridor.distance(latitude, longitude, limit) is not None
+            # Alarm is armed again once the user is back on the other side of the corridor's edge
+            if corridor.mode == 'reach' and inside and not corridor.inside:
+                triggered.append(corridor)
+            # Leaving is detected only after the user has been within the corridor
+            elif corridor.mode == 'leave' and corridor.inside and not inside:
+                triggered.append(corridor)
+            corridor.inside = inside
+        return triggered
@@ -0,0 +1,99 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from math import radians, cos
+from kivymd.app import MDApp
+from kivy.graphics import Color, Line
+from kivy.metrics import dp
+from kivy_garden.mapview import MapLayer
+
+from profiling import profiled
+
+
+class CorridorsLayer(MapLayer):
+    """
+    Layer drawing corridor routes.
+
+    Routes are simplified to about one pixel at the current scale and only their sections within
+    the map view are drawn, one Line per section. Line instructions are reused between frames.
+    """
+
+    line_width = dp(2)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self.app = MDApp.get_running_app()
+        # Color and Line instructions of the drawn sections
+        self._sections = []
+
+    @staticmethod
+    def visible_sections(points, bbox):
+        """Split points into runs of consecutive points with segments crossing the bounding box."""
+        lat_min, lon_min, lat_max, lon_max = bbox
+        sections = []
+        section = []
+        for index in range(len(points) - 1):
+            (lat_a, lon_a), (lat_b, lon_b) = points[index], points[index + 1]
+            # Check if bounding box of the segment overlaps the view
+            visible = (
+                min(lat_a, lat_b) <= lat_max and max(lat_a, lat_b) >= lat_min
+                and min(lon_a, lon_b) <= lon_max and max(lon_a, lon_b) >= lon_min
+            )
+            if visible:
+                if not section:
+                    section.append(points[index])
+                section.append(points[index + 1])
+            elif section:
+                sections.append(section)
+                section = []
+        if section:
+            sections.append(section)
+        return sections
+
+    def meters_per_pixel(self, latitude):
+        """Return length of the screen pixel at the latitude in meters."""
+        map_widget = self.parent
+        return 40075017 * cos(radians(latitude)) / (map_widget.map_source.dp_tile_size * 2 ** map_widget.zoom) / map_widget.scale
+
+    @profiled()
+    def reposition(self):
+        """Redraw visible sections of the routes while map is repositioning."""
+        map_widget = self.parent
+        corridors = self.app.corridors
+        if map_widget is None or corridors is None:
+            return False
+
+        zoom = map_widget.zoom
+        bbox = map_widget.get_bbox()
+        meters_per_pixel = self.meters_per_pixel(map_widget.lat)
+        primary_rgb = self.app.theme_cls.primary_color[:3]
+
+        drawn = 0
+        for corridor in corridors.values():
+            rgba = (*primary_rgb, .6) if corridor.is_active else (.5, .5, .5, .6)
+            for section in self.visible_sections(corridor.simplified(meters_per_pixel), bbox):
+                points = []
+                for latitude, longitude in section:
+                    points.extend(map_widget.get_window_xy_from(lat=latitude, lon=longitude, zoom=zoom))
+                # Reuse instructions of the previous frame
+                if drawn < len(self._sections):
+                    color, line = self._sections[drawn]
+                    color.rgba = rgba
+                    line.points = points
+                else:
+                    with self.canvas:
+                        color = Color(*rgba)
+                        line = Line(points=points, width=self.line_width)
+                    self._sections.append((color, line))
+                drawn += 1
+
+        # Remove instructions of the sections no longer visible
+        for color, line in self._sections[drawn:]:
+            self.canvas.remove(color)
+            self.canvas.remove(line)
+        del self._sections[drawn:]
+        return True
@@ -6,30 +6,76 @@
 
 from kivymd.app import MDApp
 import sqlite3
+import re
+import threading
+from math import cos, radians
 
-from markers import Marker
+from pinstore import Pin
+from corridors import Corridor, pack_points, unpack_points
+from polygons import Polygon
+from schedules import Schedule
+from pinevents import PIN_ADDED
+from profiling import profiled
 
 
 class Database:
-    def __init__(self, db_filename):
-        # Initialize connection to database
-        self.db_filename = db_filename
-        self.connection = sqlite3.connect(self.db_filename)
-        self.cursor = self.connection.cursor()
+    # Maximal number of pins returned by the search
+    search_limit = 500
 
-        # Initialize database tables
-        self._init_pins_table()
-        self._init_customizations_table()
+    def __init__(self, db_filename, customizations=None):
+        self.db_filename = db_filename
+        # Event set when the connection is opened and tables are initialized
+        self._ready = threading.Event()
+        # Whether full-text search is available, it is known once the tables are initialized
+        self.search_available = False
+
+        if customizations is None:
+            self._open()
+            # Get customizations from the database
+            self.customizations = self._load_customizations()
+        else:
+            # Customizations are provided by the startup snapshot, so the connection is opened in the background
+            self.customizations = dict(customizations)
+            threading.Thread(target=self._open, name='database-open', daemon=True).start()
 
         # Get map_widget instance
         self.app = MDApp.get_running_app()
         self.map_widget = self.app.map_widget
         self._set_mapview_initial_state()
 
+    def _open(self):
+        """Connect to the database and initialize its tables."""
+        try:
+            # Initialize connection to database
+            self._connection = sqlite3.connect(self.db_filename, check_same_thread=False)
+            self._cursor = self._connection.cursor()
+
+            # Initialize database tables
+            self._init_pins_table()
+            self._init_pins_search_table()
+            self._init_customizations_table()
+            self._init_corridors_table()
+            self._init_polygons_table()
+            self._init_schedules_tables()
+        finally:
+            self._ready.set()
+
+    @property
+    def connection(self):
+        """Return database connection, wait until it is opened."""
+        self._ready.wait()
+        return self._connection
+
+    @property
+    def cursor(self):
+        """Return database cursor, wait until the connection is opened."""
+        self._ready.wait()
+        return self._cursor
+
     # Initialize database
     def _init_pins_table(self):
         """Create pins table if it does not exist yet."""
-        self.cursor.execute('''
+        self._cursor.execute('''
             CREATE TABLE IF NOT EXISTS pins (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 is_active BOOLEAN,
@@ -41,34 +87,139 @@ class Database:
                 insert_datetime DATETIME DEFAULT CURRENT_TIMESTAMP
             );
         ''')
-        self.connection.commit()
+        self._connection.commit()
+
+    def _init_pins_search_table(self):
+        """Create full-text search table mirroring pins addresses if it does not exist yet."""
+        self._cursor.execute('SELECT name FROM sqlite_master WHERE type="table" AND name="pins_search";')
+        table_exists = self._cursor.fetchone() is not None
+
+        try:
+            self._cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS pins_search USING fts5(
+                    address,
+                    content='pins',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                );
+            ''')
+        except sqlite3.OperationalError:
+            # SQLite compiled without FTS5 extension
+            self.search_available = False
+            return
+        self.search_available = True
+
+        # Keep search table in sync with pins table
+        self._cursor.executescript('''
+            CREATE TRIGGER IF NOT EXISTS pins_search_insert AFTER INSERT ON pins BEGIN
+                INSERT INTO pins_search (rowid, address) VALUES (new.id, new.address);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pins_search_delete AFTER DELETE ON pins BEGIN
+                INSERT INTO pins_search (pins_search, rowid, address) VALUES ('delete', old.id, old.address);
+            END;
+        ''')
+        # Reindex only changed addresses, updates always set the address with other attributes,
+        # the trigger created without the condition is replaced once
+        self._cursor.execute('SELECT sql FROM sqlite_master WHERE type="trigger" AND name="pins_search_update";')
+        update_trigger = self._cursor.fetchone()
+        if update_trigger is None or 'WHEN old.address IS NOT new.address' not in update_trigger[0]:
+            self._cursor.executescript('''
+                DROP TRIGGER IF EXISTS pins_search_update;
+                CREATE TRIGGER pins_search_update AFTER UPDATE OF address ON pins WHEN old.address IS NOT new.address BEGIN
+                    INSERT INTO pins_search (pins_search, rowid, address) VALUES ('delete', old.id, old.address);
+                    INSERT INTO pins_search (rowid, address) VALUES (new.id, new.address);
+                END;
+            ''')
+        # Index pins added before the search table was created
+        if not table_exists:
+            self._cursor.execute('INSERT INTO pins_search (pins_search) VALUES ("rebuild");')
+        self._connection.commit()
 
     def _init_customizations_table(self):
         """Create customizations table if it does not exist yet."""
-        self.cursor.execute('''
+        self._cursor.execute('''
             CREATE TABLE IF NOT EXISTS customizations (
                 key TEXT PRIMARY KEY,
                 value TEXT);
         ''')
-        self.connection.commit()
+        self._connection.commit()
+
+    def _init_corridors_table(self):
+        """Create corridors table if it does not exist yet."""
+        self._cursor.execute('''
+            CREATE TABLE IF NOT EXISTS corridors (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                is_active BOOLEAN,
+                mode TEXT CHECK (mode IN ('leave', 'reach')),
+                width REAL,
+                points BLOB,
+                insert_datetime DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        self._connection.commit()
+
+    def _init_schedules_tables(self):
+        """Create schedules and pin_schedules tables if they do not exist yet."""
+        self._cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS schedules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                days INTEGER,
+                start_minute INTEGER,
+                end_minute INTEGER,
+                applied_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS pin_schedules (
+                schedule_id INTEGER,
+                pin_id INTEGER,
+                PRIMARY KEY (schedule_id, pin_id)
+            );
+        ''')
+        # Add instant of the last applied transition to the schedules created without it
+        self._cursor.execute('PRAGMA table_info(schedules);')
+        if 'applied_at' not in {row[1] for row in self._cursor.fetchall()}:
+            self._cursor.execute('ALTER TABLE schedules ADD COLUMN applied_at REAL;')
+        self._connection.commit()
+
+    def _init_polygons_table(self):
+        """Create polygons table if it does not exist yet."""
+        self._cursor.execute('''
+            CREATE TABLE IF NOT EXISTS polygons (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                is_active BOOLEAN,
+                points BLOB,
+                insert_datetime DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        self._connection.commit()
 
     # Manage customizations table
+    @profiled()
+    def _load_customizations(self):
+        """Read all customizations from the database with a single query."""
+        self.cursor.execute('SELECT key, value FROM customizations;')
+        return dict(self.cursor.fetchall())
+
+    @profiled()
+    def _update_customization(self, key, value):
+        """Update customization in the database and in the memory."""
+        self.cursor.execute('REPLACE INTO customizations (key,value) VALUES (?, ?);', (key, value))
+        self.connection.commit()
+        self.customizations[key] = value
+
     def save_mapview_state(self):
         """Save current map_widget state to the database."""
-        self.cursor.execute(
-            'REPLACE INTO customizations (key,value) VALUES ("mapstate", ?);',
-            (f'{self.map_widget.lat} {self.map_widget.lon} {self.map_widget.zoom}',)
-        )
-        self.connection.commit()
+        self._update_customization('mapstate', f'{self.map_widget.lat} {self.map_widget.lon} {self.map_widget.zoom}')
 
     def _set_mapview_initial_state(self):
         """Set the map_widget center and zoom."""
-        self.cursor.execute('SELECT value FROM customizations WHERE key="mapstate";')
-        map_state = self.cursor.fetchall()
+        map_state = self.customizations.get('mapstate')
 
-        if len(map_state) > 0:
+        if map_state:
             # Values from previous end of session
-            latitude, longitude, zoom = map_state[0][0].split(' ')
+            latitude, longitude, zoom = map_state.split(' ')
         else:
             # Default value while open first time - Cracow coordinates
             latitude, longitude, zoom = 50.053756, 19.940927, 10
@@ -78,117 +229,125 @@ class Database:
 
     def update_list_order(self, new_order_by):
         """Update list order in the database."""
-        self.cursor.execute('REPLACE INTO customizations (key,value) VALUES ("listorder", ?);', (new_order_by,))
-        self.connection.commit()
-
-        # Update pins dictionary
-        self.update_markers()
+        self._update_customization('listorder', new_order_by)
 
     @property
     def list_order(self):
         """Return pins list order from the database."""
-        self.cursor.execute('SELECT value FROM customizations WHERE key="listorder";')
-        list_order = self.cursor.fetchall()
-
-        if len(list_order) > 0:
-            # Value from previous end of session
-            order_by = list_order[0][0]
-        else:
-            # Default value while open first time
-            order_by = 'insert_datetime'
-
-        return order_by
+        # Default value while open first time
+        return self.customizations.get('listorder', 'insert_datetime')
 
     def update_app_theme_style(self, new_theme_style):
         """Update app theme style in the database."""
-        self.cursor.execute('REPLACE INTO customizations (key,value) VALUES ("themestyle", ?);', (new_theme_style,))
-        self.connection.commit()
+        self._update_customization('themestyle', new_theme_style)
 
     @property
     def theme_style(self):
         """Return app theme style from the database."""
-        self.cursor.execute('SELECT value FROM customizations WHERE key="themestyle";')
-        theme_style = self.cursor.fetchall()
-
-        if len(theme_style) > 0:
-            # Value from previous end of session
-            theme_style = theme_style[0][0]
-        else:
-            # Default value while open first time
-            theme_style = 'Light'
-
-        return theme_style
+        # Default value while open first time
+        return self.customizations.get('themestyle', 'Light')
 
     def update_app_primary_palette(self, new_primary_palette):
         """Update app primary palette in the database."""
-        self.cursor.execute('REPLACE INTO customizations (key,value) VALUES ("primarypalette", ?);', (new_primary_palette,))
-        self.connection.commit()
+        self._update_customization('primarypalette', new_primary_palette)
 
     @property
     def primary_palette(self):
         """Return app primary palette from the database."""
-        self.cursor.execute('SELECT value FROM customizations WHERE key="primarypalette";')
-        theme_style = self.cursor.fetchall()
-
-        if len(theme_style) > 0:
-            # Value from previous end of session
-            theme_style = theme_style[0][0]
-        else:
-            # Default value while open first time
-            theme_style = 'LightGreen'
-
-        return theme_style
+        # Default value while open first time
+        return self.customizations.get('primarypalette', 'LightGreen')
 
     def update_alarm_file(self, new_alarm_sound):
         """Update alarm sound file in the database."""
-        self.cursor.execute('REPLACE INTO customizations (key,value) VALUES ("alarmsound", ?);', (new_alarm_sound,))
-        self.connection.commit()
+        self._update_customization('alarmsound', new_alarm_sound)
 
     @property
     def alarm_file(self):
         """Return alarm sound from the database."""
-        self.cursor.execute('SELECT value FROM customizations WHERE key="alarmsound";')
-        alarm_file = self.cursor.fetchall()
+        # Default value while open first time
+        alarm_file = self.customizations.get('alarmsound', 'alarm_1.mp3')
+        return f'sounds/{alarm_file}'
 
-        if len(alarm_file) > 0:
-            # Value from previous end of session
-            alarm_file = alarm_file[0][0]
-        else:
-            # Default value while open first time
-            alarm_file = 'alarm_1.mp3'
+    def update_strict_accuracy(self, strict_accuracy):
+        """Update GPS accuracy mode in the database."""
+        self._update_customization('strictaccuracy', str(int(strict_accuracy)))
 
-        return f'sounds/{alarm_file}'
+    @property
+    def strict_accuracy(self):
+        """Return GPS accuracy mode from the database."""
+        # Default value while open first time
+        return self.customizations.get('strictaccuracy', '0') == '1'
 
     # Manage pins table
-    def get_markers(self):
-        """Get all pins from the database ordered by provided attribute."""
-        order_by = self.list_order
-
-        if order_by in ['is_active', 'address']:
-            query = f'SELECT * FROM pins ORDER BY {order_by} {"ASC" if order_by == "address" else "DESC"};'
+    @profiled()
+    def count_pins(self):
+        """Return number of pins in the database."""
+        self.cursor.execute('SELECT COUNT(*) FROM pins;')
+        return self.cursor.fetchone()[0]
+
+    @profiled()
+    def iter_pins(self, latitude, longitude):
+        """Return cursor over all pins, active ones first and then nearest to provided location."""
+        # Scale longitude difference to keep distances comparable with latitude difference
+        longitude_scale = cos(radians(latitude))
+        cursor = self.connection.cursor()
+        cursor.execute('''
+            SELECT * FROM pins
+            ORDER BY is_active DESC,
+                (latitude - ?) * (latitude - ?) + (longitude - ?) * (longitude - ?) * ? * ? ASC;
+            ''', (latitude, latitude, longitude, longitude, longitude_scale, longitude_scale)
+        )
+        return cursor
+
+    @profiled()
+    def search_pin_ids(self, text, is_active=None):
+        """Return identifiers of pins matching provided text ordered by relevance."""
+        # Match every word of the text as a prefix
+        words = re.findall(r'\w+', text)
+        if not words:
+            return self.filter_pin_ids(is_active)
+
+        # Search table is initialized with the connection
+        self._ready.wait()
+        if not self.search_available:
+            # Fall back to substring matching of every word
+            query = 'SELECT id FROM pins WHERE ' + ' AND '.join('address LIKE ?' for _ in words)
+            parameters = [f'%{word}%' for word in words]
+            if is_active is not None:
+                query += ' AND is_active = ?'
+                parameters.append(is_active)
+            self.cursor.execute(query + ' LIMIT ?;', (*parameters, self.search_limit))
+            return [pin_id for pin_id, in self.cursor.fetchall()]
+
+        match = ' '.join(f'"{word}"*' for word in words)
+        query = '''
+            SELECT pins.id FROM pins_search JOIN pins ON pins.id = pins_search.rowid
+            WHERE pins_search MATCH ?
+        '''
+        parameters = [match]
+        if is_active is not None:
+            query += ' AND pins.is_active = ?'
+            parameters.append(is_active)
+        self.cursor.execute(query + ' ORDER BY rank LIMIT ?;', (*parameters, self.search_limit))
+        return [pin_id for pin_id, in self.cursor.fetchall()]
+
+    @profiled()
+    def filter_pin_ids(self, is_active=None):
+        """Return identifiers of pins with provided is_active attribute."""
+        if is_active is None:
+            self.cursor.execute('SELECT id FROM pins;')
         else:
-            query = f'SELECT * FROM pins ORDER BY insert_datetime DESC;'
-        self.cursor.execute(query)
-        return {
-            pin_id: Marker(pin_id, is_active, address, buffer_size, buffer_unit, lat=latitude, lon=longitude)
-            for pin_id, is_active, address, latitude, longitude, buffer_size, buffer_unit, _ in
-            self.cursor.fetchall()
-        }
-
-    def update_markers(self):
-        """Update pins dictionary and map_widget."""
-        # Clear the map_widget before initialization new markers
-        for marker in self.app.markers.values():
-            marker.erase_from_map_widget()
-
-        self.app.markers = self.get_markers()
-
-    def delete_marker_by_id(self, pin_id):
-        """Delete pin from the database by provided identifier."""
-        # Update database
-        self.cursor.execute('DELETE FROM pins WHERE id = ?', (pin_id,))
-        self.connection.commit()
+            self.cursor.execute('SELECT id FROM pins WHERE is_active = ?;', (is_active,))
+        return [pin_id for pin_id, in self.cursor.fetchall()]
 
+    @profiled()
+    def get_pin_by_id(self, pin_id):
+        """Get pin record from the database by provided identifier."""
+        self.cursor.execute('SELECT * FROM pins WHERE id = ?;', (pin_id,))
+        row = self.cursor.fetchone()
+        return Pin(*row) if row else None
+
+    @profiled()
     def add_marker_by_address_lat_lon(self, address, latitude, longitude):
         """Add pin to the database by geocoded address."""
         # Add pin to database
@@ -198,41 +357,141 @@ class Database:
             ''', (address, latitude, longitude))
         self.connection.commit()
 
-        self.update_markers()
+        # Add pin record to the app's pin store
+        return self.app.pins.add(self.get_pin_by_id(self.cursor.lastrowid))
+
+    @profiled()
+    def apply_pin_events(self, events):
+        """Write pins changed within the frame to the database in a single transaction."""
+        for pin_id, event_types in events.items():
+            pin = self.app.pins.get(pin_id)
+            if pin is None:
+                # Pin has been deleted
+                self.cursor.execute('DELETE FROM pins WHERE id = ?', (pin_id,))
+                self.cursor.execute('DELETE FROM pin_schedules WHERE pin_id = ?', (pin_id,))
+            elif event_types != {PIN_ADDED}:
+                # Pin's attributes have been changed, also right after its row was inserted
+                self.cursor.execute('''
+                    UPDATE pins
+                    SET is_active = ?, address = ?, latitude = ?, longitude = ?,
+                        buffer_size = ?, buffer_unit = ?, insert_datetime = ?
+                    WHERE id = ?
+                    ''', (pin.is_active, pin.address, pin.latitude, pin.longitude,
+                          pin.buffer_size, pin.buffer_unit, pin.insert_datetime, pin_id)
+                )
+        self.connection.commit()
+
+    # Manage corridors table
+    @profiled()
+    def get_corridors(self):
+        """Get all corridor records from the database."""
+        self.cursor.execute('SELECT id, name, is_active, mode, width, points FROM corridors;')
+        return [Corridor(corridor_id, name, is_active, mode, width, unpack_points(points))
+                for corridor_id, name, is_active, mode, width, points in self.cursor.fetchall()]
+
+    @profiled()
+    def add_corridor(self, name, points, width, mode):
+        """Add corridor to the database and return its record."""
+        self.cursor.execute(
+            'INSERT INTO corridors (name, is_active, mode, width, points) VALUES (?, TRUE, ?, ?, ?);',
+            (name, mode, width, pack_points(points))
+        )
+        self.connection.commit()
+        return Corridor(self.cursor.lastrowid, name, True, mode, width, points)
 
-    def update_is_active(self, pin_id, new_is_active):
-        """Update pin's is active attribute."""
-        self.cursor.execute('UPDATE pins SET is_active = ? WHERE id = ?', (new_is_active, pin_id))
+    @profiled()
+    def update_corridor_is_active(self, corridor_id, is_active):
+        """Update corridor's is_active attribute."""
+        self.cursor.execute('UPDATE corridors SET is_active = ? WHERE id = ?;', (is_active, corridor_id))
         self.connection.commit()
 
-    def update_address(self, pin_id, new_address, new_latitude, new_longitude):
-        """Update pin's address attribute."""
-        self.cursor.execute('''
-            UPDATE pins
-            SET address = ?, latitude = ?, longitude = ?, insert_datetime = CURRENT_TIMESTAMP
-            WHERE id = ?
-            ''', (new_address, new_latitude, new_longitude, pin_id)
+    @profiled()
+    def delete_corridor(self, corridor_id):
+        """Delete corridor from the database."""
+        self.cursor.execute('DELETE FROM corridors WHERE id = ?;', (corridor_id,))
+        self.connection.commit()
+
+    # Manage polygons table
+    @profiled()
+    def get_polygons(self):
+        """Get all polygon records from the database."""
+        self.cursor.execute('SELECT id, name, is_active, points FROM polygons;')
+        return [Polygon(polygon_id, name, is_active, unpack_points(points))
+                for polygon_id, name, is_active, points in self.cursor.fetchall()]
+
+    @profiled()
+    def add_polygon(self, name, points):
+        """Add polygon to the database and return its record."""
+        self.cursor.execute(
+            'INSERT INTO polygons (name, is_active, points) VALUES (?, TRUE, ?);',
+            (name, pack_points(points))
         )
         self.connection.commit()
+        return Polygon(self.cursor.lastrowid, name, True, points)
 
-    def update_buffer_size(self, pin_id, new_buffer_size):
-        """Update pin's buffer_size attribute."""
-        self.cursor.execute('UPDATE pins SET buffer_size = ? WHERE id = ?', (new_buffer_size, pin_id))
+    @profiled()
+    def update_polygon_is_active(self, polygon_id, is_active):
+        """Update polygon's is_active attribute."""
+        self.cursor.execute('UPDATE polygons SET is_active = ? WHERE id = ?;', (is_active, polygon_id))
         self.connection.commit()
 
-    def update_buffer_unit(self, pin_id, new_buffer_unit):
-        """Update pin's buffer_unit attribute."""
-        self.cursor.execute('UPDATE pins SET buffer_unit = ? WHERE id = ?', (new_buffer_unit, pin_id))
+    @profiled()
+    def delete_polygon(self, polygon_id):
+        """Delete polygon from the database."""
+        self.cursor.execute('DELETE FROM polygons WHERE id = ?;', (polygon_id,))
         self.connection.commit()
 
     # Manage database connection
     def connect(self):
-        """Close the database connection."""
+        """Open the database connection."""
         # Initialize connection to database and cursor
-        self.connection = sqlite3.connect(self.db_filename)
-        self.cursor = self.connection.cursor()
+        self._connection = sqlite3.connect(self.db_filename, check_same_thread=False)
+        self._cursor = self._connection.cursor()
+        self._ready.set()
 
     def disconnect(self):
         """Close the database connection."""
         self.cursor.close()
         self.connection.close()
+
+    # Manage schedules tables
+    @profiled()
+    def get_schedules(self):
+        """Get all schedule records with their pins from the database."""
+        self.cursor.execute('SELECT schedule_id, pin_id FROM pin_schedules;')
+        pin_ids = {}
+        for schedule_id, pin_id in self.cursor.fetchall():
+            pin_ids.setdefault(schedule_id, []).append(pin_id)
+        self.cursor.execute('SELECT id, days, start_minute, end_minute, applied_at FROM schedules;')
+        return [Schedule(schedule_id, days, start, end, pin_ids.get(schedule_id, ()), applied_at)
+                for schedule_id, days, start, end, applied_at in self.cursor.fetchall()]
+
+    @profiled()
+    def add_schedule(self, days, start, end, pin_ids, applied_at=None):
+        """Add schedule of provided pins to the database and return its record."""
+        self.cursor.execute(
+            'INSERT INTO schedules (days, start_minute, end_minute, applied_at) VALUES (?, ?, ?, ?);',
+            (days, start, end, applied_at)
+        )
+        schedule_id = self.cursor.lastrowid
+        self.cursor.executemany(
+            'INSERT INTO pin_schedules (schedule_id, pin_id) VALUES (?, ?);',
+            [(schedule_id, pin_id) for pin_id in pin_ids]
+        )
+        self.connection.commit()
+        return Schedule(schedule_id, days, start, end, pin_ids, applied_at)
+
+    @profiled()
+    def update_schedules_applied(self, schedule_ids, applied_at):
+        """Save instant of the last transition applied to the pins of provided schedules."""
+        self.cursor.executemany(
+            'UPDATE schedules SET applied_at = ? WHERE id = ?;', [(applied_at, schedule_id) for schedule_id in schedule_ids]
+        )
+        self.connection.commit()
+
+    @profiled()
+    def delete_schedule(self, schedule_id):
+        """Delete schedule and its pins from the database."""
+        self.cursor.execute('DELETE FROM pin_schedules WHERE schedule_id = ?;', (schedule_id,))
+        self.cursor.execute('DELETE FROM schedules WHERE id = ?;', (schedule_id,))
+        self.connection.commit()
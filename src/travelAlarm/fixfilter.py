@@ -0,0 +1,143 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from math import radians, cos, sqrt
+
+# Approximate length of one degree of latitude in meters
+METERS_PER_DEGREE = 111320
+# Maximal share of the geofence's radius taken by the accuracy margin
+MAX_MARGIN_SHARE = .5
+
+
+def capped_margin(margin, radius):
+    """Return accuracy margin limited by the geofence's radius, so geofences smaller than the accuracy still trigger."""
+    return min(margin, radius * MAX_MARGIN_SHARE)
+
+
+class FixFilter:
+    """
+    Processing stage of the GPS fixes between the location provider and the rest of the app.
+
+    Fixes implying impossible speed are dropped. Fixes with poor reported accuracy are kept, so the position
+    is updated indoors or on a train, and their accuracy is taken into account by the geofence margin and
+    the jump check. Accepted positions are smoothed by an alpha-beta filter in meters relative to the first
+    accepted fix.
+    """
+
+    # Reported accuracy above which the fix is counted as coarse in meters
+    coarse_accuracy = 50
+    # Speed between the fixes above the filtered speed accepted without a jump in meters per second,
+    # well above the fastest trains
+    max_speed = 170
+    # Number of consecutive jumps accepted as the new position
+    max_rejected_jumps = 3
+    # Time between fixes after which the filter starts again in seconds
+    max_fix_gap = 30
+    # Gains of the position and velocity corrections
+    alpha = .6
+    beta = .1
+    # Distance the smoothing has to move the position to be counted as an adjustment in meters
+    adjustment_distance = 1
+
+    def __init__(self):
+        # Trigger only when the whole accuracy disc is within the geofence, limited by capped_margin
+        self.strict_accuracy = False
+        # Counters of the processed fixes
+        self.accepted = 0
+        self.coarse = 0
+        self.dropped_jumps = 0
+        self.adjusted = 0
+        self.reset()
+
+    def reset(self):
+        """Forget filter state, the next fix is accepted as it is."""
+        self.origin = None
+        # Filtered position and velocity in meters east and north of the origin
+        self.x = self.y = 0.0
+        self.vx = self.vy = 0.0
+        self.fix_time = None
+        self.rejected_jumps = 0
+
+    def to_meters(self, latitude, longitude):
+        """Return position in meters east and north of the origin."""
+        origin_lat, origin_lon = self.origin
+        return (
+            (longitude - origin_lon) * METERS_PER_DEGREE * cos(radians(origin_lat)),
+            (latitude - origin_lat) * METERS_PER_DEGREE,
+        )
+
+    def to_degrees(self, x, y):
+        """Return position in degrees from meters east and north of the origin."""
+        origin_lat, origin_lon = self.origin
+        return (
+            origin_lat + y / METERS_PER_DEGREE,
+            origin_lon + x / (METERS_PER_DEGREE * max(cos(radians(origin_lat)), .01)),
+        )
+
+    def process(self, latitude, longitude, accuracy, fix_time):
+        """Return filtered latitude, longitude and accuracy of the fix or None if the fix is dropped."""
+        if accuracy is not None and accuracy > self.coarse_accuracy:
+            self.coarse += 1
+
+        if self.origin is None or fix_time - self.fix_time > self.max_fix_gap:
+            self.reset()
+            self.origin = (latitude, longitude)
+            self.fix_time = fix_time
+            self.accepted += 1
+            return latitude, longitude, accuracy
+
+        dt = max(fix_time - self.fix_time, 1e-3)
+        measured_x, measured_y = self.to_meters(latitude, longitude)
+        # Reject jump from the position predicted by the filtered velocity unless it repeats
+        jump = sqrt((measured_x - self.x - self.vx * dt) ** 2 + (measured_y - self.y - self.vy * dt) ** 2)
+        if jump > self.max_speed * dt + (accuracy or 0):
+            self.rejected_jumps += 1
+            if self.rejected_jumps < self.max_rejected_jumps:
+                self.dropped_jumps += 1
+                return None
+            # Position has really changed, start filtering again from it
+            self.reset()
+            self.origin = (latitude, longitude)
+            self.fix_time = fix_time
+            self.accepted += 1
+            return latitude, longitude, accuracy
+        self.rejected_jumps = 0
+
+        # Predict position and correct it with the measurement
+        predicted_x, predicted_y = self.x + self.vx * dt, self.y + self.vy * dt
+        residual_x, residual_y = measured_x - predicted_x, measured_y - predicted_y
+        self.x = predicted_x + self.alpha * residual_x
+        self.y = predicted_y + self.alpha * residual_y
+        self.vx += self.beta * residual_x / dt
+        self.vy += self.beta * residual_y / dt
+        self.fix_time = fix_time
+
+        self.accepted += 1
+        if sqrt((measured_x - self.x) ** 2 + (measured_y - self.y) ** 2) > self.adjustment_distance:
+            self.adjusted += 1
+        return (*self.to_degrees(self.x, self.y), accuracy)
+
+    def margin(self, accuracy):
+        """Return distance the geofence has to extend beyond the position to contain the fix."""
+        if not self.strict_accuracy or accuracy is None:
+            return 0
+        return accuracy
+
+    def stats(self):
+        """Return counters of the processed fixes."""
+        return {
+            'accepted': self.accepted,
+            'coarse': self.coarse,
+            'dropped_jumps': self.dropped_jumps,
+            'adjusted': self.adjusted,
+        }
+
+    def report(self):
+        """Return counters of the processed fixes as text."""
+        return (
+            f'Fixes: {self.accepted} accepted ({self.adjusted} smoothed, {self.coarse} coarse), '
+            f'{self.dropped_jumps} jumps dropped'
+        )
@@ -4,20 +4,98 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
-import ssl, certifi
-from geopy.geocoders import Nominatim
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.clock import mainthread
+
+from profiling import profiled
+
+# Geolocator instance created on first use
+_geolocator = None
+_geolocator_lock = threading.Lock()
+# Worker thread of the geocoding requests created on first use and number of the latest request by its kind
+_executor = None
+_latest_requests = {}
+_requests_lock = threading.Lock()
+
+
+def get_geolocator():
+    """Return geolocator instance, create it on first use."""
+    global _geolocator
+    with _geolocator_lock:
+        if _geolocator is None:
+            from geopy.geocoders import Nominatim
+            from geotransport import PooledAdapter, get_ssl_context
+            # Geocoding service can be replaced, e.g. by a local stand-in like 'http://127.0.0.1:8080'
+            scheme, _, domain = os.environ.get('TRAVELALARM_GEOCODER_URL', 'https://nominatim.openstreetmap.org').partition('://')
+            # Get geolocator instance using the pooled transport
+            _geolocator = Nominatim(
+                user_agent='travelAlarm',
+                domain=domain,
+                scheme=scheme,
+                timeout=PooledAdapter.deadline,
+                ssl_context=get_ssl_context(),
+                adapter_factory=lambda proxies, ssl_context: PooledAdapter(proxies=proxies, ssl_context=ssl_context),
+            )
+    return _geolocator
+
+
+def geocoding_report():
+    """Return metrics of the geocoding requests as text."""
+    if _geolocator is None:
+        return 'Geocoding: no requests yet'
+    return _geolocator.adapter.report()
+
+
+def geocode_in_background(kind, function, args, on_success, on_failure):
+    """
+    Run geocoding function in the worker thread and call back with its result or error in the main thread.
+
+    Requests wait for the rate limit of the geocoding service in the worker thread, so the UI never waits for them.
+    Request superseded by a newer one of the same kind, e.g. the previous autocomplete query, is skipped
+    if it has not started yet and its callbacks are not called.
+    """
+    global _executor
+    with _requests_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geocoding')
+        number = _latest_requests.get(kind, 0) + 1
+        _latest_requests[kind] = number
+    return _executor.submit(_run_request, kind, number, function, args, on_success, on_failure)
+
+
+def _is_latest(kind, number):
+    """Check if the request has not been superseded."""
+    with _requests_lock:
+        return _latest_requests.get(kind) == number
+
+
+def _run_request(kind, number, function, args, on_success, on_failure):
+    """Run geocoding function in the worker thread unless the request has been superseded."""
+    if not _is_latest(kind, number):
+        return
+    try:
+        result = function(*args)
+    except ValueError as error:
+        _deliver(kind, number, on_failure, error)
+        return
+    _deliver(kind, number, on_success, result)
 
 
-# Create ssl context
-ssl_context = ssl.create_default_context(cafile=certifi.where())
-# Get geolocator instance
-geolocator = Nominatim(user_agent='travelAlarm', ssl_context=ssl_context)
+@mainthread
+def _deliver(kind, number, callback, value):
+    """Call back with the request's result in the main thread unless the request has been superseded."""
+    if _is_latest(kind, number):
+        callback(value)
 
 
+@profiled()
 def geocode_by_address(address_to_geocoding, exactly_one=True, limit=1):
     """Geocode location by address."""
     try:
-        location = geolocator.geocode(address_to_geocoding, exactly_one=exactly_one, limit=limit, timeout=10)
+        location = get_geolocator().geocode(address_to_geocoding, exactly_one=exactly_one, limit=limit)
 
         if exactly_one:
             return return_one_location(location)
@@ -28,10 +106,11 @@ def geocode_by_address(address_to_geocoding, exactly_one=True, limit=1):
         raise ValueError(f'Geocoding failed: {err}')
 
 
+@profiled()
 def geocode_by_lat_lon(latitude, longitude):
     """Geocode location by latitude and longitude."""
     try:
-        location = geolocator.reverse(f'{latitude}, {longitude}', timeout=10)
+        location = get_geolocator().reverse(f'{latitude}, {longitude}')
         return return_one_location(location)
 
     except Exception as err:
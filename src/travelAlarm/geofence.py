@@ -0,0 +1,101 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import heapq
+
+from fixfilter import capped_margin
+
+
+class GeofenceIndex:
+    """
+    Index of active pins checked against the user's position.
+
+    Every computed distance leaves a slack, the distance the user has to travel before the pin's buffer
+    can be reached. Pins are kept in a heap by the travelled distance at which their slack is exhausted,
+    so a check computes distances only for the pins the user might have reached since their last check.
+    """
+
+    # Margin subtracted from the slack to stay safe against rounding in meters
+    slack_margin = 1
+
+    def __init__(self, pins):
+        # App's pin store
+        self.pins = pins
+        # Active pin records by pin's identifier
+        self.active = {}
+        # Distance travelled by the user since the first check in meters
+        self.travelled = 0.0
+        self.last_position = None
+        # Travelled distance at which pin has to be checked by pin's identifier and the heap of them
+        self._deadlines = {}
+        self._heap = []
+        # Number of distances computed by the last check and the distances by pin's identifier
+        self.evaluated = 0
+        self.distances = {}
+
+    def schedule(self, pin_id, deadline):
+        """Schedule the pin's check when the travelled distance reaches the deadline."""
+        self._deadlines[pin_id] = deadline
+        heapq.heappush(self._heap, (deadline, pin_id))
+
+    def apply_pin_events(self, events):
+        """Update index regarding coalesced pin events."""
+        for pin_id in events:
+            pin = self.pins.get(pin_id)
+            if pin is not None and pin.is_active:
+                self.active[pin_id] = pin
+                # Check new or edited pin on the next check
+                self.schedule(pin_id, self.travelled)
+            else:
+                self.active.pop(pin_id, None)
+                self._deadlines.pop(pin_id, None)
+
+        # Drop outdated heap entries if they outnumber the active pins
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, pin_id) for pin_id, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def pins_within_buffer(self, latitude, longitude, margin=0):
+        """Return active pins whose buffer contains provided position extended by the margin in meters."""
+        # Import geodesic distance on first check
+        from geopy.distance import geodesic
+        # Create user position tuple
+        user_pos = (latitude, longitude)
+
+        # Distance travelled since the last check bounds the user's displacement
+        if self.last_position is not None:
+            self.travelled += geodesic(self.last_position, user_pos).meters
+        self.last_position = user_pos
+
+        triggered = []
+        due = []
+        heap = self._heap
+        # Take pins whose slack has been exhausted
+        while heap and heap[0][0] <= self.travelled:
+            deadline, pin_id = heapq.heappop(heap)
+            # Skip outdated entry of rescheduled or removed pin
+            if self._deadlines.get(pin_id) != deadline:
+                continue
+            self._deadlines[pin_id] = None
+            due.append(pin_id)
+
+        self.evaluated = len(due)
+        self.distances = {}
+        for pin_id in due:
+            pin = self.active[pin_id]
+            # Calculate distance from user to pin
+            distance = geodesic(user_pos, (pin.latitude, pin.longitude)).meters
+            self.distances[pin_id] = distance
+            slack = distance - pin.buffer_meters
+            # Check if user is within buffer size
+            if slack + capped_margin(margin, pin.buffer_meters) <= 0:
+                # Skip pin deactivated within the current frame
+                if pin.is_active:
+                    triggered.append(pin)
+            # Check the pin on every position until its buffer contains the margin
+            slack = max(slack, 0)
+            self.schedule(pin_id, self.travelled + max(slack - self.slack_margin, 0))
+        return triggered
@@ -0,0 +1,158 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import ssl
+import time
+import random
+import threading
+from collections import deque
+
+import certifi
+from geopy.adapters import RequestsAdapter, AdapterHTTPError
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+
+from tracing import percentile
+
+# HTTP status codes of the transient failures worth retrying
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# SSL context shared by the geocoding connections
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def get_ssl_context():
+    """Return SSL context with certifi's CA bundle, create it on first use."""
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return _ssl_context
+
+
+class PooledAdapter(RequestsAdapter):
+    """
+    Geocoding transport keeping alive a small pool of connections to the geocoding service.
+
+    Transient failures are retried with jittered exponential backoff within the request's deadline.
+    Requests are spaced by the service's rate limit and its Retry-After header is respected.
+    """
+
+    # Maximal number of attempts of the request
+    max_attempts = 3
+    # Base and maximal delay of the backoff in seconds
+    backoff_base = .25
+    backoff_cap = 2
+    # Time of the whole request with its retries and timeout of one attempt in seconds
+    deadline = 6
+    attempt_timeout = 3
+    # Minimal time between requests in seconds, Nominatim allows one request per second
+    min_interval = 1
+    # Number of the latest latencies kept for the percentiles
+    latency_samples = 256
+
+    def __init__(self, *, proxies=None, ssl_context=None, pool_maxsize=4):
+        super().__init__(
+            proxies=proxies,
+            ssl_context=ssl_context or get_ssl_context(),
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+            # Retries are made by the adapter itself
+            max_retries=0,
+        )
+        self._lock = threading.Lock()
+        # Earliest time of the next request
+        self._next_request = 0.0
+        # Metrics of the requests
+        self.requests = 0
+        self.retries = 0
+        self.errors = {}
+        self.latencies = deque(maxlen=self.latency_samples)
+
+    def _wait_for_slot(self, deadline):
+        """Wait until the rate limit allows the next request, return False if it would miss the deadline."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_request)
+            if start >= deadline:
+                return False
+            self._next_request = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+        return True
+
+    def _postpone(self, delay):
+        """Delay following requests, e.g. by the service's Retry-After header."""
+        with self._lock:
+            self._next_request = max(self._next_request, time.monotonic() + delay)
+
+    def _backoff(self, attempt):
+        """Return jittered delay before the retry."""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _is_transient(error):
+        """Check if the request can succeed when it is repeated."""
+        if isinstance(error, AdapterHTTPError):
+            return error.status_code in RETRY_STATUS_CODES
+        return isinstance(error, (GeocoderTimedOut, GeocoderUnavailable))
+
+    def _count_error(self, error):
+        """Count error by its type or HTTP status code."""
+        name = f'HTTP {error.status_code}' if isinstance(error, AdapterHTTPError) else type(error).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def _request(self, url, *, timeout, headers):
+        """Request the url with retries of the transient failures within the deadline."""
+        start = time.monotonic()
+        deadline = start + min(timeout or self.deadline, self.deadline)
+        self.requests += 1
+
+        attempt = 0
+        while True:
+            if not self._wait_for_slot(deadline):
+                self._count_error(GeocoderTimedOut())
+                raise GeocoderTimedOut('Geocoding deadline exceeded while waiting for the rate limit')
+            try:
+                response = super()._request(
+                    url, timeout=min(self.attempt_timeout, deadline - time.monotonic()), headers=headers
+                )
+                self.latencies.append(time.monotonic() - start)
+                return response
+            except Exception as error:
+                self._count_error(error)
+                attempt += 1
+                if not self._is_transient(error) or attempt >= self.max_attempts:
+                    raise
+                delay = self._backoff(attempt)
+                # Respect the delay requested by the service
+                retry_after = getattr(error, 'headers', None) and error.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                self._postpone(delay)
+                self.retries += 1
+
+    def stats(self):
+        """Return metrics of the requests."""
+        latencies = sorted(self.latencies)
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': dict(self.errors),
+            'p50_ms': percentile(latencies, .5) * 1000 if latencies else None,
+            'p95_ms': percentile(latencies, .95) * 1000 if latencies else None,
+        }
+
+    def report(self):
+        """Return metrics of the requests as text."""
+        stats = self.stats()
+        errors = ', '.join(f'{name}: {count}' for name, count in stats['errors'].items()) or 'no errors'
+        latency = (
+            f"p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms" if stats['p50_ms'] is not None else 'no latency yet'
+        )
+        return f"Geocoding: {stats['requests']} requests, {stats['retries']} retries, {latency}, {errors}"
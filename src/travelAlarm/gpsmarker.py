@@ -4,20 +4,21 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
+import time
 from kivymd.app import MDApp
 from kivy import platform
-from kivy.properties import ObjectProperty, NumericProperty, StringProperty
+from kivy.properties import ObjectProperty, NumericProperty, StringProperty, BooleanProperty
 from kivy_garden.mapview import MapLayer
 from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDFlatButton
 from kivy.graphics import Color, Ellipse
-from kivy.animation import Animation
 from kivy.clock import Clock, mainthread
 from kivy.metrics import dp
-from geopy.distance import geodesic
 
-from markerslayer import MarkersLayer
-from alarm import Alarm
+from motion import MotionModel
+from triplog import FIX, ENTER, EXIT
+from tracing import tracer, EVALUATION_START, EVALUATION_END
+from profiling import profiled
 
 
 def request_location_permission():
@@ -44,6 +45,8 @@ class GpsMarker(MapLayer):
     # User's geographic position
     latitude = NumericProperty(None)
     longitude = NumericProperty(None)
+    # Reported accuracy of the position in meters
+    accuracy = None
     # Marker's position on the screen
     marker_center = ()
     # Marker geometry attributes
@@ -53,8 +56,15 @@ class GpsMarker(MapLayer):
     inner_marker_color = ObjectProperty()
     blinker_color = ObjectProperty()
     blinker = ObjectProperty()
+    # Duration of the blinker pulse in seconds
+    pulse_duration = 1
+    # Low-power mode stops the pulse while the app is in the background
+    low_power = BooleanProperty(False)
     # Localization provider status
     provider_status = StringProperty('provider-enabled')
+    # Time of receiving the last GPS fix and its latency trace
+    fix_time = None
+    trace_id = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -63,6 +73,11 @@ class GpsMarker(MapLayer):
         self.map_widget = self.app.map_widget
 
         self.layer = self.app.map_widget.marker_layer
+        # Clock event of the blinker pulse and time elapsed within the pulse
+        self.pulse_event = None
+        self.pulse_time = 0
+        # Motion model interpolating the rendered position between fixes
+        self.motion = MotionModel()
 
         self.build_gps_dialog()
 
@@ -110,6 +125,8 @@ class GpsMarker(MapLayer):
             self.provider_status = stype
             # Open dialog window
             self.enable_gps()
+            # Stop blinking of the GPS marker
+            Clock.schedule_once(lambda dt: self.update_marker(), 0)
             return True
 
         # Check if provider status value was changed
@@ -130,55 +147,93 @@ class GpsMarker(MapLayer):
 
     def update_localization(self, **kwargs):
         """Update marker localization attributes."""
-        self.latitude = kwargs['lat']
-        self.longitude = kwargs['lon']
+        fix_time = time.perf_counter()
+        # Drop jumps, smooth the other fixes
+        fix = self.app.fix_filter.process(kwargs['lat'], kwargs['lon'], kwargs.get('accuracy'), fix_time)
+        if fix is None:
+            return False
+        self.fix_time = fix_time
+        self.trace_id = tracer.start_trace()
+        self.latitude, self.longitude, self.accuracy = fix
+        self.motion.add_fix(self.latitude, self.longitude, self.fix_time)
+        # Accepted fix is logged with its margin, so the trip can be replayed
+        self.app.trip_log.record(
+            FIX, latitude=self.latitude, longitude=self.longitude, distance=self.app.fix_filter.margin(self.accuracy)
+        )
 
         # Draw marker if not in map widget yet
         if self.blinker is None:
             Clock.schedule_once(lambda dt: self.update_marker(), 0)
+        # Check buffers on every fix while the pulse is stopped
+        elif self.pulse_event is None:
+            Clock.schedule_once(lambda dt: self.is_within_buffer(), 0)
+        # Show distance to the nearest active pin
+        Clock.schedule_once(lambda dt: self.app.root.ids.screen_manager.get_screen('MapScreen').update_readout(
+            self.latitude, self.longitude, self.motion.speed), 0)
+        # Sort pins list by the distance from the user
+        Clock.schedule_once(lambda dt: self.app.root.ids.screen_manager.get_screen('ListScreen').on_fix(
+            self.latitude, self.longitude), 0)
+        # Prefetch map tiles along the path to the nearest active pin
+        Clock.schedule_once(lambda dt: self.app.tile_prefetcher.prefetch_path(
+            self.latitude, self.longitude, self.app.geofence.active.values()), 0)
 
     def update_marker_center(self):
         """Update marker center in screen coordinates."""
-        self.marker_center = self.map_widget.get_window_xy_from(lat=self.latitude, lon=self.longitude, zoom=self.map_widget.zoom)
+        # Render position estimated by the motion model
+        latitude, longitude = self.motion.position() if self.motion.fix else (self.latitude, self.longitude)
+        self.marker_center = self.map_widget.get_window_xy_from(lat=latitude, lon=longitude, zoom=self.map_widget.zoom)
 
     def draw_marker(self):
-        """Draw marker on map widget."""
+        """Draw marker on map widget, its instructions are created only once."""
         # Check if GPS marker has the localization attributes
         if self.latitude is None or self.longitude is None:
             return False  # Marker hasn't been drawn
 
-        self.update_marker_center()
-
-        marker_pos = (self.marker_center[0] - self.marker_size[0] / 2, self.marker_center[1] - self.marker_size[1] / 2)
-        with self.layer.canvas.before:
-            self.inner_marker_color = Color(*self.app.theme_cls.primary_dark)
-            self.inner_marker = Ellipse(size=self.marker_size, pos=marker_pos)
-
-        if self.provider_status == 'provider-disabled':
-            return True  # Marker has been drawn without blink
-
-        with self.layer.canvas.before:
-            self.blinker_color = Color(*self.app.theme_cls.primary_dark)
-            self.blinker = Ellipse(size=self.marker_size, pos=marker_pos)
-
-        self.blink()  # Run blinking animation
-        return True  # Marker has been drawn with blink
-
-    def blink(self):
-        """Run blinking animation on GPS marker."""
-        # Animation for blinker transparency
-        anim_color = Animation(a=0)
-        # Animation for size change to create a pulsing effect
-        anim_size = Animation(size=(self.base_size * 3, self.base_size * 3))
+        if self.inner_marker is None:
+            with self.layer.canvas.before:
+                self.inner_marker_color = Color(*self.app.theme_cls.primary_dark)
+                self.inner_marker = Ellipse(size=self.marker_size)
+                # Blinker is transparent until the pulse starts
+                self.blinker_color = Color(*self.app.theme_cls.primary_dark[:3], 0)
+                self.blinker = Ellipse(size=self.marker_size)
+        return True  # Marker has been drawn
+
+    def start_pulse(self):
+        """Start blinking of the GPS marker."""
+        if self.pulse_event is not None:
+            return False
+        self.pulse_time = 0
+        self.is_within_buffer()
+        # Single clock event updates the pulse every frame
+        self.pulse_event = Clock.schedule_interval(self.update_pulse, 0)
+        return True
 
-        anim_size.bind(
-            on_start=self.is_within_buffer,
-            on_progress=self.update_blinker_position,
-            on_complete=self.update_marker
-        )
-        # Start animations
-        anim_color.start(self.blinker_color)
-        anim_size.start(self.blinker)
+    def stop_pulse(self):
+        """Stop blinking of the GPS marker and hide the blinker."""
+        if self.pulse_event is not None:
+            self.pulse_event.cancel()
+            self.pulse_event = None
+        if self.blinker_color:
+            self.blinker_color.a = 0
+
+    def update_pulse(self, dt):
+        """Update blinker size, position and transparency within the pulse."""
+        self.pulse_time += dt
+        if self.pulse_time >= self.pulse_duration:
+            self.pulse_time %= self.pulse_duration
+            # Check buffers at the start of every pulse
+            self.is_within_buffer()
+
+        progress = self.pulse_time / self.pulse_duration
+        # Increase blinker size up to three times of the marker size while fading it out
+        size = self.base_size * (1 + 2 * progress)
+        self.blinker.size = (size, size)
+        self.blinker_color.a = 1 - progress
+        # Move whole marker only while the rendered position is changing
+        if self.motion.is_moving():
+            self.reposition()
+        else:
+            self.update_blinker_position()
 
     def update_blinker_position(self, *args):
         """Update blinker position while its size is increasing."""
@@ -191,21 +246,29 @@ class GpsMarker(MapLayer):
         """Update marker position."""
         self.inner_marker.pos = (self.marker_center[0] - self.marker_size[0] / 2, self.marker_center[1] - self.marker_size[1] / 2)
 
-    def cancel_animations(self):
-        """Cancel blinker animation and clear marker geometry."""
-        Animation.cancel_all(self.blinker_color)
-        Animation.cancel_all(self.blinker)
-        # Clear marker drawings
-        if self.inner_marker: self.layer.canvas.before.remove(self.inner_marker)
-        if self.inner_marker_color: self.layer.canvas.before.remove(self.inner_marker_color)
-        if self.blinker: self.layer.canvas.before.remove(self.blinker)
-        if self.blinker_color: self.layer.canvas.before.remove(self.blinker_color)
+    def on_low_power(self, *args):
+        """Stop or restart the pulse when the low-power mode is switched."""
+        self.update_marker()
 
+    @profiled()
     def update_marker(self, *args):
-        """Update GPS marker on map_widget."""
-        self.cancel_animations()
-        self.draw_marker()
+        """Update GPS marker colors, position and pulse on map_widget."""
+        if not self.draw_marker():
+            return False
+
+        # Update marker color to the app's palette
+        self.inner_marker_color.rgb = self.app.theme_cls.primary_dark[:3]
+        self.blinker_color.rgb = self.app.theme_cls.primary_dark[:3]
+        self.reposition()
+
+        # Blink only if the localization is provided and the app is displayed
+        if self.provider_status == 'provider-disabled' or self.low_power:
+            self.stop_pulse()
+        else:
+            self.start_pulse()
+        return True
 
+    @profiled()
     def reposition(self, *args):
         """Update marker position while map is moving."""
         if self.inner_marker is None or self.blinker is None:
@@ -215,26 +278,26 @@ class GpsMarker(MapLayer):
         self.update_blinker_position()
         return True
 
+    @profiled()
     def is_within_buffer(self, *args):
-        """Check if user is within active buffer and trigger alarm if so."""
-        # Get unit multiplier
-        unit_mult = MarkersLayer.unit_mult
-        # Create user position tuple
-        user_pos = (self.latitude, self.longitude)
-
-        for marker in self.app.markers.values():
-            # Skip buffer if pin is not active
-            if not marker.pin.is_active:
-                continue
-            # Create pin position tuple
-            pin_pos = (marker.lat, marker.lon)
-            # Get pin's buffer size
-            buffer_size = marker.pin.buffer_size
-            buffer_unit = marker.pin.buffer_unit
-            buffer_size_meters = buffer_size * unit_mult.get(buffer_unit, 0)
-            # Calculate distance from user to pin
-            distance = geodesic(user_pos, pin_pos).meters
-            # Check if user is within buffer size
-            if distance <= buffer_size_meters:
-                # Trigger alarm
-                Alarm(marker)
+        """Check if user is within active geofences and trigger alarm if so."""
+        tracer.record(EVALUATION_START, self.trace_id)
+        # Whole accuracy disc has to be within the geofence unless it is relaxed
+        margin = self.app.fix_filter.margin(self.accuracy)
+        triggered = self.app.geofence.pins_within_buffer(self.latitude, self.longitude, margin)
+        triggered_corridors = self.app.corridors.check(self.latitude, self.longitude, margin)
+        triggered_polygons = self.app.polygons.check(self.latitude, self.longitude, margin)
+        tracer.record(EVALUATION_END, self.trace_id)
+        trip_log = self.app.trip_log
+        for pin in triggered:
+            trip_log.record_pin(ENTER, pin, self.app.geofence.distances.get(pin.pin_id))
+            # Trigger alarm
+            self.app.alarm_dispatcher.trigger(pin, self.fix_time, self.trace_id)
+        for corridor in triggered_corridors:
+            trip_log.record(
+                EXIT if corridor.mode == 'leave' else ENTER, 'corridor', corridor.corridor_id, self.latitude, self.longitude
+            )
+            self.app.alarm_dispatcher.trigger_corridor(corridor, self.fix_time, self.trace_id)
+        for polygon in triggered_polygons:
+            trip_log.record(ENTER, 'polygon', polygon.polygon_id, self.latitude, self.longitude)
+            self.app.alarm_dispatcher.trigger_polygon(polygon, self.fix_time, self.trace_id)
@@ -7,48 +7,91 @@
 from kivymd.app import MDApp
 from kivy.uix.screenmanager import Screen
 from kivymd.uix.menu import MDDropdownMenu
-from kivy.properties import ObjectProperty, BooleanProperty
+from kivy.properties import ObjectProperty, BooleanProperty, StringProperty
 from kivy.clock import Clock
 from kivy.animation import Animation
+from math import radians, cos, sqrt
 
 from addresseslist import AddressesList
+from pinslistdata import PinsListData
+
+# Approximate length of one degree of latitude in meters
+METERS_PER_DEGREE = 111320
 
 
 class ListScreen(Screen):
 
     app = MDApp.get_running_app()
-    clock = ObjectProperty()
+    search_clock = ObjectProperty()
+    pins_list_data = ObjectProperty()
+    filter_menu = ObjectProperty()
     list_order_menu = ObjectProperty()
     addresses_list = ObjectProperty()
     add_marker_mode = BooleanProperty(False)
+    list_order = StringProperty()
+    search_text = StringProperty()
+    active_filter = StringProperty('all')
+    # Identifier of the pin waiting for magic animation
+    magic_pin_id = ObjectProperty(None, allownone=True)
+    # User's position the distance order is sorted by
+    position = None
+    # Distance the user has to move to sort the list by the distance again in meters
+    resort_distance = 25
+
+    # Keys sorting pins records in the same order as the database attributes
+    list_order_keys = {
+        'insert_datetime': (lambda pin: (pin.insert_datetime or '', pin.pin_id), True),
+        'is_active': (lambda pin: pin.is_active, True),
+        'address': (lambda pin: pin.address, False),
+    }
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self.database = self.app.database
+        self.list_order = self.database.list_order
 
     def on_kv_post(self, base_widget):
-        """Set list order menu button text and build dropdown menu."""
+        """Set list order menu button text, build dropdown menu and markers list data source."""
         # Build dropdown menu
         self.list_order_menu = self.build_list_order_menu()
+        self.filter_menu = self.build_filter_menu()
         self.set_sort_menu_button_text()
+        self.set_filter_menu_button_text()
+        # Build markers list data source updated by the pin events
+        self.pins_list_data = PinsListData(self.ids.pins_list, *self.get_list_order_key())
+        self.set_list_data()
+        self.app.pin_events.subscribe(self.apply_pin_events)
+        # Build the whole list once when all pins are loaded
+        self.app.pins_loader.bind(on_loaded=lambda *args: self.set_list_data())
 
     def build_list_order_menu(self):
         """Build list order dropdown menu."""
         order_items = [
             {'text': item, 'viewclass': 'OneLineListItem', 'on_release': lambda x=item: self.on_list_order_menu_item(x)}
-            for item in ['time', 'active', 'address']
+            for item in ['time', 'active', 'address', 'distance']
         ]
         return MDDropdownMenu(
             caller=self.ids.sort_menu_button,
             items=order_items,
         )
 
+    def build_filter_menu(self):
+        """Build active filter dropdown menu."""
+        filter_items = [
+            {'text': item, 'viewclass': 'OneLineListItem', 'on_release': lambda x=item: self.on_filter_menu_item(x)}
+            for item in ['all', 'active', 'inactive']
+        ]
+        return MDDropdownMenu(
+            caller=self.ids.filter_menu_button,
+            items=filter_items,
+        )
+
     def set_sort_menu_button_text(self, db_attribute=None):
         """Set text of list order menu button."""
-        # Get markers list order attribute from database and assign it to the button text
-        if not db_attribute: db_attribute = self.database.list_order
-        map_db_attribute = {'insert_datetime': 'time', 'is_active': 'active', 'address': 'address'}
+        # Get markers list order attribute and assign it to the button text
+        if not db_attribute: db_attribute = self.list_order
+        map_db_attribute = {'insert_datetime': 'time', 'is_active': 'active', 'address': 'address', 'distance': 'distance'}
         button_text = map_db_attribute[db_attribute]
         # Set the button text
         self.ids.sort_menu_button.text = 'Sort by: ' + button_text
@@ -56,52 +99,183 @@ class ListScreen(Screen):
     def on_list_order_menu_item(self, new_order_by):
         """Sort list by new attribute."""
         # Assign the value of the button text to the database attribute
-        map_button_text = {'time': 'insert_datetime', 'active': 'is_active', 'address': 'address'}
+        map_button_text = {'time': 'insert_datetime', 'active': 'is_active', 'address': 'address', 'distance': 'distance'}
         db_attribute = map_button_text[new_order_by]
         # Set text on the list order menu button and update database
         self.set_sort_menu_button_text(db_attribute=db_attribute)
         self.database.update_list_order(db_attribute)
-        # Refresh recycle view markers list
+        self.list_order = db_attribute
+        # Sort recycle view markers list in memory
+        self.pins_list_data.set_order(*self.get_list_order_key())
         self.set_list_data()
         # Close dropdown menu
         self.list_order_menu.dismiss()
 
-    def on_pre_enter(self, *args):
-        """Set markers list data before entering to the screen."""
+    def set_filter_menu_button_text(self):
+        """Set text of active filter menu button."""
+        self.ids.filter_menu_button.text = 'Show: ' + self.active_filter
+
+    def on_filter_menu_item(self, new_active_filter):
+        """Filter list by pin's is_active attribute."""
+        self.active_filter = new_active_filter
+        self.set_filter_menu_button_text()
+        # Refresh recycle view markers list
         self.set_list_data()
+        # Close dropdown menu
+        self.filter_menu.dismiss()
+
+    def on_search_typing(self, text):
+        """Wait a moment and filter markers list by typed text."""
+        if self.search_clock: self.search_clock.cancel()
+        self.search_clock = Clock.schedule_once(lambda dt: self.search(text), .2)
+
+    def search(self, text):
+        """Filter markers list by provided text."""
+        self.search_text = text.strip()
+        self.set_list_data()
+
+    def clear_search(self):
+        """Remove search text and active filter from markers list."""
+        if self.search_clock: self.search_clock.cancel()
+        self.ids.search_text_field.text = ''
+        self.search_text = ''
+        self.active_filter = 'all'
+        self.set_filter_menu_button_text()
+        self.set_list_data()
+
+    @property
+    def is_filtered(self):
+        """Check if markers list is filtered by search text or active filter."""
+        return bool(self.search_text) or self.active_filter != 'all'
 
-    def clear_list_data(self):
-        """Remove all data from markers list."""
-        self.ids.pins_list.data = []
+    def get_list_order_key(self):
+        """Return sort key and direction of the current list order."""
+        if self.list_order == 'distance':
+            return self.distance_key, False
+        return self.list_order_keys.get(self.list_order, self.list_order_keys['insert_datetime'])
+
+    def distance_key(self, pin):
+        """Return key sorting pins by the distance from the user's position."""
+        if self.position is None:
+            return float('inf'), pin.pin_id
+        latitude, longitude = self.position
+        dx = (pin.longitude - longitude) * METERS_PER_DEGREE * cos(radians(latitude))
+        dy = (pin.latitude - latitude) * METERS_PER_DEGREE
+        return sqrt(dx * dx + dy * dy), pin.pin_id
+
+    def on_fix(self, latitude, longitude):
+        """Sort list by the distance from the user's new position if the user has moved enough."""
+        if self.position is not None:
+            previous_latitude, previous_longitude = self.position
+            dx = (longitude - previous_longitude) * METERS_PER_DEGREE * cos(radians(latitude))
+            dy = (latitude - previous_latitude) * METERS_PER_DEGREE
+            if sqrt(dx * dx + dy * dy) < self.resort_distance:
+                return False
+        self.position = (latitude, longitude)
+        # Sort the list when it is displayed
+        if self.list_order != 'distance' or self.search_text or (self.manager and self.manager.current != self.name):
+            return False
+        self.pins_list_data.rerank(self.app.pins)
+        return True
 
     def set_list_data(self):
-        """Refresh markers list on the screen."""
-        self.ids.pins_list.data = [
-            {
-                'pin_id': marker.pin.pin_id,
-                'is_active': marker.pin.is_active,
-                'address': marker.pin.address,
-                'buffer_size': marker.pin.buffer_size,
-                'buffer_unit': marker.pin.buffer_unit,
-            }
-            for marker in self.app.markers.values()
-        ]
+        """Rebuild markers list on the screen."""
+        if not self.is_filtered:
+            self.pins_list_data.reset(self.app.pins.values())
+            return
+
+        # Get identifiers of matching pins from the database search
+        is_active = {'active': True, 'inactive': False}.get(self.active_filter)
+        pin_ids = self.database.search_pin_ids(self.search_text, is_active)
+        pins = [self.app.pins[pin_id] for pin_id in pin_ids if pin_id in self.app.pins]
+        # Keep relevance order of the text search results
+        self.pins_list_data.reset(pins, ranked=bool(self.search_text))
 
-    def remove_marker(self, pin_id):
-        """Remove item from the markers list."""
-        self.ids.pins_list.data = [item for item in self.ids.pins_list.data if item.get('pin_id') != pin_id]
+    def apply_pin_events(self, events):
+        """Update changed items of markers list regarding coalesced pin events."""
+        # Chunks of the loaded pins would rebuild the list every frame, it is built once they are all loaded
+        if not self.app.pins_loader.finished:
+            return
+        pins_list_data = self.pins_list_data
+        # Rebuild the whole list after bulk changes or if the list is filtered
+        if len(events) > pins_list_data.bulk_threshold or self.is_filtered:
+            self.set_list_data()
+            return
+
+        for pin_id in events:
+            pin = self.app.pins.get(pin_id)
+            if pin is None:
+                pins_list_data.remove(pin_id)
+            elif pin_id in pins_list_data:
+                pins_list_data.update(pin)
+            else:
+                pins_list_data.insert(pin)
 
     def on_marker_popup(self, pin_id):
-        """Perform magic animation on markers list item."""
-        if self.clock: self.clock.cancel()
-        self.clock = Clock.schedule_once(lambda dt: self.magic_grow_item_by_id(pin_id), 1)
+        """Scroll markers list to the item and perform magic animation on it."""
+        self.magic_pin_id = pin_id
+        # Wait for the end of the screen transition
+        if self.manager and self.manager.transition.is_active:
+            return False
+        return self.scroll_to_pin(pin_id)
+
+    def on_pre_enter(self, *args):
+        """Sort list by the distance from the user's position reached while the screen was hidden."""
+        if self.list_order == 'distance' and not self.search_text:
+            self.pins_list_data.rerank(self.app.pins)
+
+    def on_enter(self, *args):
+        """Scroll markers list to the item waiting for magic animation after the screen transition."""
+        if self.magic_pin_id is not None:
+            self.scroll_to_pin(self.magic_pin_id)
+
+    def scroll_to_pin(self, pin_id):
+        """Scroll markers list to the pin's item."""
+        # Show pin filtered out from the list
+        if pin_id not in self.pins_list_data:
+            self.clear_search()
+
+        index = self.pins_list_data.index.get(pin_id)
+        if index is None:
+            self.magic_pin_id = None
+            return False
+
+        self.scroll_to_index(index)
+        # Perform magic animation at once if the item's view is already bound
+        view = self.ids.pins_list.view_adapter.get_visible_view(index)
+        if view is not None:
+            self.magic_grow_item(view)
+        return True
+
+    def scroll_to_index(self, index):
+        """Scroll markers list to center the item with provided data index."""
+        pins_list = self.ids.pins_list
+        layout = pins_list.layout_manager
+        # Items have fixed height, so the layout height is calculated from the data length
+        item_height = layout.default_size[1]
+        spacing = layout.spacing
+        padding_top, padding_bottom = layout.padding[1], layout.padding[3]
+        items_count = len(self.pins_list_data)
+        layout_height = padding_top + padding_bottom + items_count * item_height + max(items_count - 1, 0) * spacing
+
+        scrollable_height = layout_height - pins_list.height
+        if scrollable_height <= 0:
+            return False
+        # Distance from the layout top to the item placed in the middle of the view
+        item_top = padding_top + index * (item_height + spacing)
+        offset = item_top - (pins_list.height - item_height) / 2
+        pins_list.scroll_y = 1 - min(max(offset / scrollable_height, 0), 1)
+        return True
+
+    def on_item_bound(self, item):
+        """Perform magic animation on the item waiting for it when its view is bound."""
+        if self.magic_pin_id is not None and item.pin_id == self.magic_pin_id:
+            self.magic_grow_item(item)
 
-    def magic_grow_item_by_id(self, pin_id):
+    def magic_grow_item(self, item):
         """Perform magic animation."""
-        # Retrieve pin instance from pin list
-        pin = next((pin for pin in self.ids.pins_list.view_adapter.views.values() if pin.pin_id == pin_id), None)
-        # Perform magic animation
-        if pin: pin.magic_grow()
+        self.magic_pin_id = None
+        item.magic_grow()
 
     # Manage to prepare and hide add marker mode
     def prepare_search_view(self):
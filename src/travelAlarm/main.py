@@ -4,13 +4,35 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
+import os
+
+from startup import profile as startup_profile, warm_up
 from kivymd.app import MDApp
 from kivy.lang import Builder
+from kivy.core.window import Window
+from kivy.logger import Logger
+from kivy.clock import Clock
 from kivy.properties import ObjectProperty, StringProperty, DictProperty
 
 from database import Database
+from pinstore import PinStore
+from pinevents import PinEventBus
+from geofence import GeofenceIndex
+from corridors import CorridorIndex
+from polygons import PolygonIndex
+from triplog import TripLog
+from fixfilter import FixFilter
+from schedules import ActivationScheduler
+from nearest import NearestPins
+from pinsloader import PinsLoader
+from alarm import AlarmDispatcher
+from tileprefetcher import TilePrefetcher
+from snapshot import PinSnapshot, write_snapshot, read_change_counter
 from mapwidget import MapWidget
 from gpsmarker import GpsMarker, check_gps_permission, request_location_permission
+from geocode import get_geolocator
+
+startup_profile.mark('imports')
 
 
 class TravelAlarmApp(MDApp):
@@ -29,44 +51,166 @@ class TravelAlarmApp(MDApp):
     alarm_file = StringProperty()
     gps_marker = ObjectProperty()
     markers = DictProperty()
+    pins = ObjectProperty()
+    pin_events = ObjectProperty()
+    geofence = ObjectProperty()
+    corridors = ObjectProperty()
+    polygons = ObjectProperty()
+    pins_loader = ObjectProperty()
+    alarm_dispatcher = ObjectProperty()
+    tile_prefetcher = ObjectProperty()
+    trip_log = ObjectProperty()
+    fix_filter = ObjectProperty()
+    scheduler = ObjectProperty()
+    nearest = ObjectProperty()
+    # Files of the database and its startup snapshot
+    db_filename = 'pins.db'
+    snapshot_filename = 'pins.snapshot'
+    # Interval of writing trip events to the database in seconds
+    trip_log_flush_interval = 10
 
     def build(self):
         """Build the app."""
         self.map_widget = MapWidget()
-        self.database = Database('pins.db')
+        self.pin_events = PinEventBus()
+        self.pins = PinStore(self.pin_events)
+        self.geofence = GeofenceIndex(self.pins)
+        self.nearest = NearestPins(self.pins)
+        self.pins_loader = PinsLoader()
+        self.tile_prefetcher = TilePrefetcher(self.map_widget.map_source, self.pins)
+        self.trip_log = TripLog(self.db_filename, self.pins)
+
+        # Use startup snapshot of settings and pins if it is up to date with the database
+        snapshot = PinSnapshot.open(self.snapshot_filename, self.db_filename)
+        self.pins_loader.snapshot = snapshot
+        self.database = Database(self.db_filename, customizations=snapshot.settings if snapshot else None)
+        self.corridors = CorridorIndex(self.database)
+        self.polygons = PolygonIndex(self.database)
+        self.scheduler = ActivationScheduler(self.pins, self.database)
+        startup_profile.mark('database' if snapshot is None else 'snapshot')
+
+        # Subscribe views of the pin store to the pin events
+        self.pin_events.subscribe(self.database.apply_pin_events)
+        self.pin_events.subscribe(self.map_widget.marker_layer.apply_pin_events)
+        self.pin_events.subscribe(self.geofence.apply_pin_events)
+        self.pin_events.subscribe(self.nearest.apply_pin_events)
+        self.pin_events.subscribe(self.tile_prefetcher.apply_pin_events)
+        self.pin_events.subscribe(self.trip_log.apply_pin_events)
+        # Write trip events in the background
+        Clock.schedule_interval(self.trip_log.flush_async, self.trip_log_flush_interval)
 
         # Get data from database
         self.theme_cls.theme_style = self.database.theme_style
         self.theme_cls.primary_palette = self.database.primary_palette
         self.alarm_file = self.database.alarm_file
-        self.markers = self.database.get_markers()
+        self.fix_filter = FixFilter()
+        self.fix_filter.strict_accuracy = self.database.strict_accuracy
+        self.alarm_dispatcher = AlarmDispatcher()
 
         # Request location permissions for android devices
         request_location_permission()
         # Build the application
-        return Builder.load_file('main.kv')
+        root = Builder.load_file('main.kv')
+        startup_profile.mark('kv loaded')
+        return root
 
     def on_start(self):
-        """Add GPS marker at user's location when the app is started."""
+        """Add GPS marker at user's location and start loading pins when the app is started."""
         self.add_gps_marker()
+        self.pins_loader.bind(on_loaded=self.on_pins_loaded)
+        self.pins_loader.start()
+        # Finish startup profile when the first frame is displayed
+        Window.bind(on_flip=self.on_first_frame)
         return True
 
+    def on_first_frame(self, *args):
+        """Report startup profile and warm up modules unnecessary for the first frame."""
+        Window.unbind(on_flip=self.on_first_frame)
+        startup_profile.mark('first frame')
+
+        for line in startup_profile.report():
+            Logger.info(f'Startup: {line}')
+        # Save startup profile if its file is provided
+        profile_filename = os.environ.get('TRAVELALARM_STARTUP_PROFILE')
+        if profile_filename:
+            startup_profile.save(profile_filename)
+
+        # Load modules and geocoding client in the background
+        warm_up(['geopy.distance', 'plyer'], initializers=[get_geolocator])
+        # Load alarm sound before any pin is checked
+        self.alarm_dispatcher.preload()
+        # Load corridors and polygons once the database is opened
+        self.corridors.load(self.database.get_corridors())
+        self.map_widget.corridors_layer.reposition()
+        self.polygons.load(self.database.get_polygons())
+        self.map_widget.marker_layer.draw_polygons()
+
+    def on_pins_loaded(self, *args):
+        """Report time of loading all pins."""
+        startup_profile.mark('pins loaded')
+        Logger.info(f'Startup: {self.pins_loader.loaded} pins loaded ({startup_profile.phases[-1][1] * 1000:.1f} ms)')
+        # Deliver pending events of the loaded pins before the scheduler changes them
+        self.pin_events.flush()
+        # Switch scheduled pins once all of them are in the store
+        self.scheduler.load(self.database.get_schedules())
+        # Deliver the scheduled changes, so the trip log records only the later ones
+        self.pin_events.flush()
+        self.trip_log.record_armed()
+        self.tile_prefetcher.pins_loaded = True
+
     def on_pause(self):
         """Prepare the app to close when it is moving to the background."""
+        # Stop GPS marker blinking in the background
+        if self.gps_marker:
+            self.gps_marker.low_power = True
         self.on_stop()
         return True
 
     def on_resume(self):
         """Reconnect to the database when the app is returning from the background."""
         self.database.connect()
+        # Restart GPS marker blinking
+        if self.gps_marker:
+            self.gps_marker.low_power = False
+        # Resume pins loading interrupted by the pause
+        if not self.pins_loader.finished:
+            self.pins_loader.start()
+        else:
+            self.scheduler.resume()
         return True
 
     def on_stop(self):
         """Save map_widget state and disconnect with the database when the app is closing."""
+        # Deliver pending pin changes before the database is disconnected
+        self.pins_loader.stop()
+        self.pin_events.flush()
+        self.tile_prefetcher.stop()
+        # Write uses of the cached tiles kept in memory
+        if self.map_widget:
+            self.map_widget.tile_store.flush()
+        self.trip_log.close()
+        self.scheduler.stop()
         self.database.save_mapview_state()
         self.database.disconnect()
+        self.save_snapshot()
         return True
 
+    def save_snapshot(self):
+        """Save snapshot of settings and pins used for the next startup."""
+        # Snapshot of partially loaded pins would be incomplete
+        if not self.pins_loader.finished:
+            return False
+        try:
+            write_snapshot(
+                self.snapshot_filename,
+                read_change_counter(self.db_filename),
+                self.database.customizations,
+                self.pins.values(),
+            )
+            return True
+        except (OSError, TypeError, ValueError):
+            return False
+
     def add_gps_marker(self):
         """Add gps marker to the map_widget."""
         if check_gps_permission() and self.gps_marker is None:
@@ -6,10 +6,27 @@
 
 from kivymd.app import MDApp
 from kivy.uix.screenmanager import Screen
+from kivy.properties import StringProperty
+
+from nearest import NearestTracker
+
+
+def format_distance(meters):
+    """Return distance as text in meters or kilometers."""
+    if meters < 1000:
+        return f'{meters:.0f} m'
+    return f'{meters / 1000:.1f} km'
 
 
 class MapScreen(Screen):
 
+    # Distance and ETA to the nearest active pin
+    readout = StringProperty()
+    # Weight of the newest speed in the smoothed speed
+    speed_smoothing = .3
+    # Slowest speed the ETA is estimated for in meters per second
+    min_eta_speed = .5
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -17,6 +34,26 @@ class MapScreen(Screen):
         self.database = self.app.database
         self.map_widget = self.app.map_widget
         self.add_widget(self.map_widget)
+        self.nearest_tracker = NearestTracker(self.app.nearest)
+        self.speed = None
+
+    def update_readout(self, latitude, longitude, speed):
+        """Show distance to the buffer edge of the nearest active pin and the ETA at the recent speed."""
+        nearest = self.nearest_tracker.update(latitude, longitude)
+        if not nearest:
+            self.readout = ''
+            return False
+        distance, pin = nearest[0]
+        self.speed = speed if self.speed is None else self.speed + self.speed_smoothing * (speed - self.speed)
+
+        if distance <= 0:
+            self.readout = f'{pin.address}: within the buffer'
+        elif self.speed < self.min_eta_speed:
+            self.readout = f'{pin.address}: {format_distance(distance)}'
+        else:
+            minutes = distance / self.speed / 60
+            self.readout = f'{pin.address}: {format_distance(distance)}, ETA {minutes:.0f} min'
+        return True
 
     def center_map_widget_on_user_location(self):
         """Center the map widget on user's GPS position."""
@@ -4,19 +4,32 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
-from kivy_garden.mapview import MapView, MapSource
+import os
+
+from kivy_garden.mapview import MapView
 from kivy.clock import Clock
 
 from markers import MarkerAdder
 from markerslayer import MarkersLayer
+from corridorslayer import CorridorsLayer
+from tilestore import TileStore
+from tilecache import CachedMapSource
 
 
 class MapWidget(MapView):
+    # File of the tiles cache and its size cap in bytes
+    tile_cache_filename = 'tiles.mbtiles'
+    tile_cache_max_bytes = 100 * 1024 * 1024
+    # Url of the tile server, it can be replaced with the environment variable, tiles are prefetched only from
+    # the servers allowing bulk downloading
+    tile_url = os.environ.get('TRAVELALARM_TILE_URL', 'http://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png')
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-        # Set minimum zoom value as 3
-        self.map_source = MapSource(min_zoom=3)
+        # Load tiles through the offline cache and set minimum zoom value as 3
+        self.tile_store = TileStore(self.tile_cache_filename, self.tile_cache_max_bytes)
+        self.map_source = CachedMapSource(self.tile_store, url=self.tile_url, min_zoom=3)
         # Enable smooth zooming
         self.snap_to_zoom = False
 
@@ -24,6 +37,10 @@ class MapWidget(MapView):
         self._is_screen_held = False
         self._hold_duration_clock = None
 
+        # Draw corridors below the markers
+        self._corridors_layer = CorridorsLayer()
+        self.add_layer(self._corridors_layer)
+
         self._default_marker_layer = MarkersLayer()
         self.add_layer(self._default_marker_layer)
 
@@ -32,6 +49,11 @@ class MapWidget(MapView):
         """Property to get default marker layer."""
         return self._default_marker_layer
 
+    @property
+    def corridors_layer(self):
+        """Property to get corridors layer."""
+        return self._corridors_layer
+
     def on_touch_down(self, touch):
         """Update the _is_screen_held flag and start the clock for on_hold event."""
         self._is_screen_held = True
@@ -11,32 +11,66 @@ from kivymd.uix.menu import MDDropdownMenu
 from kivy.metrics import dp
 from kivymd.uix.button import MDRaisedButton
 from kivy.uix.boxlayout import BoxLayout
-from geocode import geocode_by_lat_lon
+from geocode import geocode_by_lat_lon, geocode_in_background
 from kivymd.toast import toast
 from kivy.properties import ObjectProperty
 
 from pinitem import PinItem
+from pinevents import ACTIVE_CHANGED, BUFFER_CHANGED, PIN_MOVED
+
+# Atlas of the pin icons named by the palette colors
+PIN_ICONS_ATLAS = 'icons/pins.atlas'
+# Atlas loaded on first use and shared by all markers
+_pin_icons = None
+
+
+def get_pin_icon(color):
+    """Return shared texture region of the pin icon, load the atlas on first use."""
+    global _pin_icons
+    if _pin_icons is None:
+        from kivy.atlas import Atlas
+        _pin_icons = Atlas(PIN_ICONS_ATLAS)
+    return _pin_icons[color]
 
 
 class Marker(MapMarkerPopup):
 
-    pin = ObjectProperty()
+    pin = ObjectProperty(allownone=True)
 
-    def __init__(self, pin_id, is_active, address, buffer_size, buffer_unit, **kwargs):
-        super().__init__(**kwargs)
+    def __init__(self, record, **kwargs):
+        # Icon texture is set from the atlas instead of the image source
+        super().__init__(lat=record.latitude, lon=record.longitude, source='', **kwargs)
 
         self.app = MDApp.get_running_app()
+        # Pin's record from the app's pin store
+        self.record = record
+        # Dictionary contains buffer geometry
+        self.buffer = {'ellipse': None, 'outline': None}
+
+        self.set_pin_icon()
+
+        # Add marker to the map_widget
+        self.app.map_widget.add_marker(self)
+
+    def on_is_open(self, *args):
+        """Build popup widget the first time the marker is opened."""
+        if self.is_open and self.pin is None:
+            self.build_popup()
+        return super().on_is_open(*args)
+
+    def build_popup(self):
+        """Build PinItem widget displayed as the marker's popup."""
         # Determine popup widget size
         self.popup_size = Window.width * .9, Window.height * .1
 
         # Create instance of popup widget
         self.pin = PinItem(
             y=dp(10),
-            pin_id=pin_id,
-            is_active=is_active,
-            address=address,
-            buffer_size=buffer_size,
-            buffer_unit=buffer_unit,
+            pin_id=self.record.pin_id,
+            is_active=self.record.is_active,
+            address=self.record.address,
+            buffer_size=self.record.buffer_size,
+            buffer_unit=self.record.buffer_unit,
         )
         # Override three dots menu options for the widget displayed on the map
         self.pin.three_dots_menu = self.build_three_dots_menu()
@@ -44,13 +78,6 @@ class Marker(MapMarkerPopup):
         self.add_widget(
             self.pin
         )
-        # Dictionary contains buffer geometry
-        self.buffer = {'ellipse': None, 'outline': None}
-
-        self.set_pin_icon()
-
-        # Add marker to the map_widget
-        self.app.map_widget.add_marker(self)
 
     def build_three_dots_menu(self):
         """Builds drop down menu for delete and show on list screen."""
@@ -67,9 +94,31 @@ class Marker(MapMarkerPopup):
     def set_pin_icon(self):
         """Set the pin icon displayed on the map."""
         # Determine pin marker color
-        marker_color = self.app.theme_cls.primary_palette if self.pin.is_active else 'Red'
-
-        self.source = f'icons/{marker_color}.png'
+        marker_color = self.app.theme_cls.primary_palette if self.record.is_active else 'Red'
+
+        self.texture = get_pin_icon(marker_color)
+
+    def refresh(self, event_types=(ACTIVE_CHANGED, BUFFER_CHANGED, PIN_MOVED)):
+        """Synchronize marker's widgets with its pin record regarding types of pin events."""
+        record = self.record
+        # Update popup widget if it has been built
+        if self.pin is not None:
+            self.pin.is_active = record.is_active
+            self.pin.address = record.address
+            self.pin.buffer_size = record.buffer_size
+            self.pin.buffer_unit = record.buffer_unit
+        # Update marker position if pin has been moved
+        if PIN_MOVED in event_types:
+            self.lat, self.lon = record.latitude, record.longitude
+            self.set_marker_position()
+        # Redraw buffer geometry only if its position or size has been changed
+        if PIN_MOVED in event_types or BUFFER_CHANGED in event_types:
+            self.update_buffer()
+        elif ACTIVE_CHANGED in event_types:
+            self._layer.set_buffer_colors(self)
+        # Update marker icon if pin has been (de)activated
+        if ACTIVE_CHANGED in event_types:
+            self.set_pin_icon()
 
     def update_buffer(self):
         """Update marker's buffer geometry."""
@@ -79,7 +128,7 @@ class Marker(MapMarkerPopup):
     def set_marker_position(self):
         """Set marker's icon position on the map."""
         layer = self._layer
-        map_widget = self.parent.parent
+        map_widget = layer.parent
         layer.set_marker_position(map_widget, self)
 
     def erase_from_map_widget(self):
@@ -98,7 +147,7 @@ class Marker(MapMarkerPopup):
         # Close popup widget
         self.close_marker_popup()
         # Call function to perform magic behavior
-        list_screen.on_marker_popup(self.pin.pin_id)
+        list_screen.on_marker_popup(self.record.pin_id)
 
     def close_marker_popup(self):
         """Close popup widget."""
@@ -108,12 +157,12 @@ class Marker(MapMarkerPopup):
 class MarkerAdder(MapMarkerPopup):
 
     def __init__(self, **kwargs):
-        super().__init__(**kwargs)
+        super().__init__(source='', **kwargs)
 
         self.app = MDApp.get_running_app()
 
         marker_color = self.app.theme_cls.primary_palette
-        self.source = f'icons/{marker_color}.png'
+        self.texture = get_pin_icon(marker_color)
 
         # Open popup while initialization
         self.is_open = True
@@ -153,23 +202,29 @@ class MarkerAdder(MapMarkerPopup):
 
     def add_pin(self, *args):
         """Add pin by reverse geocoding."""
-        try:
-            # Geocode address and location
-            address, latitude, longitude = geocode_by_lat_lon(self.lat, self.lon)
-            # Add new marker to the database
-            self.app.database.add_marker_by_address_lat_lon(address, latitude, longitude)
-            # Refresh pins list on the screen
-            list_screen = self.app.root.ids.screen_manager.get_screen('ListScreen')
-            list_screen.set_list_data()
-            # Remove MarkerAdder
+        # Geocode address and location in the background, repeated tap supersedes the previous request
+        geocode_in_background(
+            ('marker adder', id(self)), geocode_by_lat_lon, (self.lat, self.lon),
+            self.on_geocoded, self.on_geocoding_failed,
+        )
+        return True
+
+    def on_geocoded(self, location):
+        """Add pin of the geocoded address and location."""
+        address, latitude, longitude = location
+        # Add new marker to the database
+        self.app.database.add_marker_by_address_lat_lon(address, latitude, longitude)
+        # Remove MarkerAdder if it is still on the map
+        if self.parent is not None:
             self.remove_marker()
-            # Show information on the screen
-            toast(text='Pin Added')
-            return True
-        except:
-            # Show information on the screen
-            toast(text='Geocoding Failed')
-            return False
+        # Show information on the screen
+        toast(text='Pin Added')
+        return True
+
+    def on_geocoding_failed(self, error):
+        """Show information about failed geocoding."""
+        toast(text='Geocoding Failed')
+        return False
 
     def remove_marker(self, *args):
         """Remove add pin marker from map widget."""
@@ -4,22 +4,34 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
+import time
 from math import radians, cos
 from kivymd.app import MDApp
-from kivy.graphics import Color, Ellipse, Line
+from kivy.graphics import Color, Ellipse, Line, Mesh, InstructionGroup, PushMatrix, PopMatrix, Translate, Scale
+from kivy.clock import Clock
 from kivy_garden.mapview import MarkerMapLayer
 
-from markers import MarkerAdder
+from markers import Marker, MarkerAdder, get_pin_icon
+from pinevents import PIN_ADDED, PIN_DELETED
+from pinstore import UNIT_MULT
+from profiling import profiled
 
 
 class MarkersLayer(MarkerMapLayer):
     # Values to convert buffer size to meter
-    unit_mult = {'m': 1, 'km': 1000}
+    unit_mult = UNIT_MULT
+    # Maximal time of creating markers within a frame in seconds
+    frame_budget = .008
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self.app = MDApp.get_running_app()
+        # Identifiers of pins waiting for their markers
+        self._pending_markers = {}
+        self._create_markers_trigger = Clock.create_trigger(self.create_pending_markers)
+        # Graphics of the polygons by polygon's identifier
+        self.polygon_graphics = {}
 
     def add_widget(self, marker):
         """Draw marker's buffer while adding marker to the map."""
@@ -37,6 +49,7 @@ class MarkersLayer(MarkerMapLayer):
         self.remove_buffer(marker)
         return True
 
+    @profiled()
     def draw_buffer(self, marker):
         """Draw buffer on map_widget."""
         # Buffer center in screen pixels coordinates
@@ -47,18 +60,39 @@ class MarkersLayer(MarkerMapLayer):
         pos_x = center_x - buffer_size_dp
         pos_y = center_y - buffer_size_dp
 
-        # Determine colors of buffer fill and outline
-        theme_rgb = self.app.theme_cls.primary_color[:3]
-        ellipse_color = theme_rgb + [.2]
-        outline_color = theme_rgb + [.4]
-
         with self.canvas.before:
             # Draw the buffer circle
-            marker.buffer['ellipse_color'] = Color(*ellipse_color) if marker.pin.is_active else Color(1, 0, 0, 0.1)
+            marker.buffer['ellipse_color'] = Color()
             marker.buffer['ellipse'] = Ellipse(pos=(pos_x, pos_y), size=(buffer_size_dp * 2, buffer_size_dp * 2))
             # Draw the buffer outline
-            marker.buffer['outline_color'] = Color(*outline_color) if marker.pin.is_active else Color(1, 0, 0, 0.2)
+            marker.buffer['outline_color'] = Color()
             marker.buffer['outline'] = Line(width=1.5, circle=(center_x, center_y, buffer_size_dp))
+        self.set_buffer_colors(marker)
+
+    def set_buffer_colors(self, marker, theme_rgb=None):
+        """Set colors of buffer fill and outline regarding pin's state."""
+        if marker.buffer.get('ellipse_color') is None:
+            return False
+        if marker.record.is_active:
+            theme_rgb = theme_rgb or self.app.theme_cls.primary_color[:3]
+            marker.buffer['ellipse_color'].rgba = (*theme_rgb, .2)
+            marker.buffer['outline_color'].rgba = (*theme_rgb, .4)
+        else:
+            marker.buffer['ellipse_color'].rgba = (1, 0, 0, .1)
+            marker.buffer['outline_color'].rgba = (1, 0, 0, .2)
+        return True
+
+    def update_palette(self):
+        """Swap icons and buffer colors of active markers to the app's palette without redrawing geometry."""
+        icon = get_pin_icon(self.app.theme_cls.primary_palette)
+        theme_rgb = self.app.theme_cls.primary_color[:3]
+        for marker in self.children:
+            if isinstance(marker, MarkerAdder):
+                marker.texture = icon
+            elif marker.record.is_active:
+                marker.texture = icon
+                self.set_buffer_colors(marker, theme_rgb)
+        self.reposition_polygons()
 
     def calculate_buffer_radius(self, marker):
         """Calculate the buffer radius in pixels based on the buffer size, buffer unit, and current zoom level."""
@@ -73,7 +107,7 @@ class MarkersLayer(MarkerMapLayer):
         earth_circumference = 40075017
         # Calculate factor to calculate the buffer size
         meters_per_pixel = (earth_circumference * cos(lat_radian)) / (dp_tile_size * 2**zoom_level)
-        buffer_size = marker.pin.buffer_size * self.unit_mult.get(marker.pin.buffer_unit, 0)
+        buffer_size = marker.record.buffer_meters
 
         return (buffer_size / meters_per_pixel) * map_scale
 
@@ -94,8 +128,109 @@ class MarkersLayer(MarkerMapLayer):
         self.remove_buffer(marker)
         self.draw_buffer(marker)
 
+    def apply_pin_events(self, events):
+        """Update markers on the map_widget regarding coalesced pin events."""
+        markers = self.app.markers
+        for pin_id, event_types in events.items():
+            # Remove marker of deleted pin
+            if PIN_DELETED in event_types:
+                self._pending_markers.pop(pin_id, None)
+                if pin_id in markers:
+                    markers.pop(pin_id).erase_from_map_widget()
+
+            pin = self.app.pins.get(pin_id)
+            if pin is None:
+                continue
+            # Queue marker of new pin or refresh marker of edited one
+            if PIN_ADDED in event_types or pin_id not in markers:
+                self._pending_markers[pin_id] = None
+            else:
+                markers[pin_id].refresh(event_types)
+
+        if self._pending_markers:
+            self._create_markers_trigger()
+
+    def create_pending_markers(self, *args):
+        """Create queued markers within the frame time budget."""
+        markers = self.app.markers
+        start = time.perf_counter()
+        while self._pending_markers and time.perf_counter() - start < self.frame_budget:
+            pin_id = next(iter(self._pending_markers))
+            del self._pending_markers[pin_id]
+            pin = self.app.pins.get(pin_id)
+            if pin is None:
+                continue
+            # Replace marker if pin record has been replaced
+            if pin_id in markers:
+                markers.pop(pin_id).erase_from_map_widget()
+            markers[pin_id] = Marker(pin)
+        # Continue on the next frame
+        if self._pending_markers:
+            self._create_markers_trigger()
+
+    def draw_polygons(self):
+        """Draw all polygons of the app on map_widget."""
+        for polygon_id in list(self.polygon_graphics):
+            self.remove_polygon(polygon_id)
+        for polygon in self.app.polygons.values():
+            self.draw_polygon(polygon)
+        self.reposition_polygons()
+
+    def draw_polygon(self, polygon):
+        """Tessellate polygon into meshes drawn with the transform of the map position."""
+        from kivy.graphics.tesselator import Tesselator, WINDING_ODD, TYPE_POLYGONS
+        map_source = self.parent.map_source
+        # Vertices are stored at zoom 0 relative to the first point of the polygon
+        origin_lat, origin_lon = polygon.points[0]
+        origin_x, origin_y = map_source.get_x(0, origin_lon), map_source.get_y(0, origin_lat)
+        tesselator = Tesselator()
+        tesselator.add_contour([
+            coordinate for lat, lon in polygon.points
+            for coordinate in (map_source.get_x(0, lon) - origin_x, map_source.get_y(0, lat) - origin_y)
+        ])
+        if not tesselator.tesselate(WINDING_ODD, TYPE_POLYGONS):
+            return False
+
+        group = InstructionGroup()
+        translate = Translate()
+        scale = Scale(1, 1, 1)
+        color = Color()
+        group.add(PushMatrix())
+        group.add(translate)
+        group.add(scale)
+        group.add(color)
+        for vertices, indices in tesselator.meshes:
+            group.add(Mesh(vertices=list(vertices), indices=list(indices), mode='triangle_fan'))
+        group.add(PopMatrix())
+        # Draw polygons below the buffers
+        self.canvas.before.insert(0, group)
+        self.polygon_graphics[polygon.polygon_id] = (polygon, group, translate, scale, color)
+        return True
+
+    def remove_polygon(self, polygon_id):
+        """Remove polygon from the map widget."""
+        graphics = self.polygon_graphics.pop(polygon_id, None)
+        if graphics:
+            self.canvas.before.remove(graphics[1])
+
+    def reposition_polygons(self):
+        """Update transforms and colors of the polygons without rebuilding their meshes."""
+        map_widget = self.parent
+        if map_widget is None or not self.polygon_graphics:
+            return False
+        zoom = map_widget.zoom
+        size_factor = 2 ** zoom * map_widget.scale
+        theme_rgb = self.app.theme_cls.primary_color[:3]
+        for polygon, group, translate, scale, color in self.polygon_graphics.values():
+            translate.xy = map_widget.get_window_xy_from(lat=polygon.points[0][0], lon=polygon.points[0][1], zoom=zoom)
+            scale.xyz = (size_factor, size_factor, 1)
+            color.rgba = (*theme_rgb, .2) if polygon.is_active else (.5, .5, .5, .2)
+        return True
+
+    @profiled()
     def reposition(self):
         """Update markers position while map is repositioning."""
+        self.reposition_polygons()
         if not self.markers:
             return False
         map_widget = self.parent
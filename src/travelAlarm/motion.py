@@ -0,0 +1,116 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import time
+from math import radians, cos, sqrt, atan2, degrees
+
+# Approximate length of one degree of latitude in meters
+METERS_PER_DEGREE = 111320
+
+
+class MotionModel:
+    """
+    Dead-reckoning model of the user's motion used only for rendering the GPS marker.
+
+    Velocity is estimated from the recent fixes and the rendered position is extrapolated from the
+    last fix for a limited time. When a new fix arrives, the difference between the rendered and the
+    real position is smoothly corrected, or snapped at once if it is too large.
+    """
+
+    # Weight of the newest velocity estimate
+    smoothing = .5
+    # Maximal time of the extrapolation from the last fix in seconds
+    max_extrapolation = 2
+    # Time without fixes after which the user is considered stopped in seconds
+    max_fix_gap = 10
+    # Maximal speed taken into account in meters per second
+    max_speed = 70
+    # Duration of the correction towards the new fix in seconds
+    correction_duration = .3
+    # Error of the rendered position snapped at once in meters
+    snap_distance = 50
+
+    def __init__(self):
+        # Last fix as (time, latitude, longitude)
+        self.fix = None
+        # Velocity towards east and north in meters per second
+        self.velocity = (0.0, 0.0)
+        # Difference between the rendered position and the last fix in degrees
+        self.correction = (0.0, 0.0)
+
+    @property
+    def speed(self):
+        """Return estimated speed in meters per second."""
+        return sqrt(self.velocity[0] ** 2 + self.velocity[1] ** 2)
+
+    @property
+    def heading(self):
+        """Return estimated heading in degrees clockwise from north."""
+        return degrees(atan2(self.velocity[0], self.velocity[1])) % 360
+
+    def is_moving(self, now=None):
+        """Check if the rendered position changes in time."""
+        if self.fix is None:
+            return False
+        elapsed = (now or time.perf_counter()) - self.fix[0]
+        has_velocity = self.velocity != (0.0, 0.0) and elapsed < self.max_extrapolation
+        return has_velocity or (self.correction != (0.0, 0.0) and elapsed < self.correction_duration)
+
+    def add_fix(self, latitude, longitude, fix_time=None):
+        """Update velocity estimate and rendered position correction with the new fix."""
+        fix_time = fix_time or time.perf_counter()
+        if self.fix is None:
+            self.fix = (fix_time, latitude, longitude)
+            return
+
+        rendered = self.position(fix_time)
+        previous_time, previous_latitude, previous_longitude = self.fix
+        elapsed = fix_time - previous_time
+        meters_per_degree_lon = METERS_PER_DEGREE * cos(radians(latitude))
+
+        if 0 < elapsed <= self.max_fix_gap:
+            # Velocity between the last two fixes
+            east = (longitude - previous_longitude) * meters_per_degree_lon / elapsed
+            north = (latitude - previous_latitude) * METERS_PER_DEGREE / elapsed
+            speed = sqrt(east ** 2 + north ** 2)
+            if speed > self.max_speed:
+                east, north = east * self.max_speed / speed, north * self.max_speed / speed
+            # Smooth velocity estimate
+            self.velocity = (
+                self.velocity[0] + self.smoothing * (east - self.velocity[0]),
+                self.velocity[1] + self.smoothing * (north - self.velocity[1]),
+            )
+        else:
+            self.velocity = (0.0, 0.0)
+
+        # Correct rendered position smoothly unless the error is too large
+        correction = (rendered[0] - latitude, rendered[1] - longitude)
+        error = sqrt((correction[0] * METERS_PER_DEGREE) ** 2 + (correction[1] * meters_per_degree_lon) ** 2)
+        self.correction = correction if error <= self.snap_distance else (0.0, 0.0)
+        self.fix = (fix_time, latitude, longitude)
+
+    def position(self, now=None):
+        """Return rendered position as (latitude, longitude) tuple."""
+        fix_time, latitude, longitude = self.fix
+        elapsed = max((now or time.perf_counter()) - fix_time, 0)
+
+        # Extrapolate position along the velocity for a limited time
+        extrapolation = min(elapsed, self.max_extrapolation)
+        latitude_rendered = latitude + self.velocity[1] * extrapolation / METERS_PER_DEGREE
+        longitude_rendered = longitude + self.velocity[0] * extrapolation / (METERS_PER_DEGREE * cos(radians(latitude)))
+
+        # Fade out the correction of the previous rendered position
+        remaining = 1 - elapsed / self.correction_duration
+        if remaining > 0:
+            latitude_rendered += self.correction[0] * remaining
+            longitude_rendered += self.correction[1] * remaining
+        return latitude_rendered, longitude_rendered
+
+    def reset(self):
+        """Forget fixes and estimated velocity."""
+        self.fix = None
+        self.velocity = (0.0, 0.0)
+        self.correction = (0.0, 0.0)
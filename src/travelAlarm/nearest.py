@@ -0,0 +1,173 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import heapq
+from math import radians, cos, sqrt, floor
+
+# Approximate length of one degree of latitude in meters
+METERS_PER_DEGREE = 111320
+
+
+class NearestPins:
+    """
+    Grid index of active pins answering k-nearest queries by the distance to the pin's buffer edge.
+
+    Pins are kept in square cells of latitude and longitude. A query scans rings of cells around
+    the position until no pin beyond the scanned rings can be nearer than the k-th found one.
+    Once a ring would have more cells than are occupied, the remaining occupied cells are scanned directly,
+    so a query far from all pins costs at most one pass over the occupied cells.
+    """
+
+    # Size of the grid cell along the meridian in meters
+    cell_size = 2000
+
+    def __init__(self, pins):
+        # App's pin store
+        self.pins = pins
+        self.cell_degrees = self.cell_size / METERS_PER_DEGREE
+        # Active pin records by cell and cell of the pin by pin's identifier
+        self._cells = {}
+        self._cell_of = {}
+        # Largest buffer of the active pins, recomputed on the next query after its pin is removed
+        self._max_buffer = 0
+        self._max_buffer_dirty = False
+        # Number of the index updates, so the trackers know when their candidates are outdated
+        self.version = 0
+
+    def __len__(self):
+        return len(self._cell_of)
+
+    def cell(self, latitude, longitude):
+        """Return key of the cell containing the position."""
+        return floor(latitude / self.cell_degrees), floor(longitude / self.cell_degrees)
+
+    def add(self, pin):
+        """Add active pin to the index."""
+        key = self.cell(pin.latitude, pin.longitude)
+        self._cells.setdefault(key, {})[pin.pin_id] = pin
+        self._cell_of[pin.pin_id] = key
+        self._max_buffer = max(self._max_buffer, pin.buffer_meters)
+
+    def remove(self, pin_id):
+        """Remove pin from the index."""
+        key = self._cell_of.pop(pin_id, None)
+        if key is None:
+            return
+        cell = self._cells[key]
+        pin = cell.pop(pin_id)
+        if not cell:
+            del self._cells[key]
+        if pin.buffer_meters >= self._max_buffer:
+            self._max_buffer_dirty = True
+
+    def apply_pin_events(self, events):
+        """Update index regarding coalesced pin events."""
+        for pin_id in events:
+            self.remove(pin_id)
+            pin = self.pins.get(pin_id)
+            if pin is not None and pin.is_active:
+                self.add(pin)
+        self.version += 1
+
+    @staticmethod
+    def edge_distance(latitude, longitude, pin):
+        """Return approximate distance from the position to the pin's buffer edge in meters, negative within the buffer."""
+        dx = (pin.longitude - longitude) * METERS_PER_DEGREE * cos(radians(latitude))
+        dy = (pin.latitude - latitude) * METERS_PER_DEGREE
+        return sqrt(dx * dx + dy * dy) - pin.buffer_meters
+
+    @staticmethod
+    def _trim(found, k, extra):
+        """Return found items not farther than the k-th one by more than the extra distance and their distance limit."""
+        if len(found) < k:
+            return found, None
+        limit = heapq.nsmallest(k, found)[-1][0] + extra
+        return [item for item in found if item[0] <= limit], limit
+
+    def nearest(self, latitude, longitude, k=1, extra=0):
+        """
+        Return pairs of the distance to the buffer edge and the active pin for up to k pins nearest to the position
+        and the pins farther than the k-th one by at most the extra distance, sorted by the distance.
+        """
+        if not self._cell_of or k < 1:
+            return []
+        if self._max_buffer_dirty:
+            self._max_buffer = max(
+                (pin.buffer_meters for cell in self._cells.values() for pin in cell.values()), default=0
+            )
+            self._max_buffer_dirty = False
+
+        row, column = self.cell(latitude, longitude)
+        # Shortest distance across one ring of cells
+        ring_width = self.cell_size * max(cos(radians(latitude)), .01)
+        found = []
+        scanned = 0
+        ring = 0
+        while scanned < len(self._cell_of):
+            if (2 * ring + 1) ** 2 > len(self._cells):
+                # Ring has more cells than are occupied, so the remaining occupied cells are scanned directly
+                for (cell_row, cell_column), cell in self._cells.items():
+                    if max(abs(cell_row - row), abs(cell_column - column)) < ring:
+                        continue
+                    for pin in cell.values():
+                        found.append((self.edge_distance(latitude, longitude, pin), pin.pin_id, pin))
+                found = self._trim(found, k, extra)[0]
+                break
+            # Scan cells on the border of the ring
+            for cell_row in range(row - ring, row + ring + 1):
+                step = 1 if abs(cell_row - row) == ring else 2 * ring
+                for cell_column in range(column - ring, column + ring + 1, step or 1):
+                    cell = self._cells.get((cell_row, cell_column))
+                    if not cell:
+                        continue
+                    for pin in cell.values():
+                        scanned += 1
+                        found.append((self.edge_distance(latitude, longitude, pin), pin.pin_id, pin))
+            # Pins beyond the ring are at least this far from their buffer edge
+            found, limit = self._trim(found, k, extra)
+            if limit is not None and limit <= ring * ring_width - self._max_buffer:
+                break
+            ring += 1
+        return [(distance, pin) for distance, pin_id, pin in sorted(found)]
+
+
+class NearestTracker:
+    """
+    Incremental k-nearest query following the user's position.
+
+    Full query collects the pins which can become the k nearest while the user stays within the slack
+    distance from the query's position, so the following fixes only rank these candidates.
+    """
+
+    # Distance from the position of the full query after which it is repeated in meters
+    slack = 500
+
+    def __init__(self, index, k=1):
+        self.index = index
+        self.k = k
+        self.origin = None
+        self.version = None
+        self.candidates = []
+
+    def update(self, latitude, longitude):
+        """Return pairs of the distance to the buffer edge and the active pin for up to k pins nearest to the position."""
+        if self.origin is None or self.version != self.index.version or self.moved(latitude, longitude) > self.slack:
+            # Pin beyond twice the slack cannot outrun the k-th pin before the next full query
+            result = self.index.nearest(latitude, longitude, self.k, 2 * self.slack)
+            self.candidates = [pin for distance, pin in result]
+            self.origin = (latitude, longitude)
+            self.version = self.index.version
+            return result[:self.k]
+        ranked = sorted(
+            ((self.index.edge_distance(latitude, longitude, pin), pin.pin_id, pin) for pin in self.candidates)
+        )
+        return [(distance, pin) for distance, pin_id, pin in ranked[:self.k]]
+
+    def moved(self, latitude, longitude):
+        """Return approximate distance from the position of the full query in meters."""
+        dx = (longitude - self.origin[1]) * METERS_PER_DEGREE * cos(radians(latitude))
+        dy = (latitude - self.origin[0]) * METERS_PER_DEGREE
+        return sqrt(dx * dx + dy * dy)
@@ -0,0 +1,75 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from kivy.clock import Clock
+
+# Types of pin change events
+PIN_ADDED = 'added'
+ACTIVE_CHANGED = 'active changed'
+BUFFER_CHANGED = 'buffer changed'
+PIN_MOVED = 'moved'
+PIN_DELETED = 'deleted'
+
+# Event types published when pin record's attribute changes
+ATTRIBUTE_EVENTS = {
+    'is_active': ACTIVE_CHANGED,
+    'buffer_size': BUFFER_CHANGED,
+    'buffer_unit': BUFFER_CHANGED,
+    'address': PIN_MOVED,
+    'latitude': PIN_MOVED,
+    'longitude': PIN_MOVED,
+}
+
+
+class PinEventBus:
+    """
+    Bus delivering pin change events to the subscribers once per frame.
+
+    Events published during a frame are coalesced by pin's identifier, so every subscriber
+    is called once with dictionary {pin_id: set of event types} no matter how many changes occurred.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._pending = {}
+        # Trigger flushes pending events on the next frame
+        self._flush_trigger = Clock.create_trigger(lambda dt: self.flush())
+
+    def subscribe(self, callback):
+        """Register callback receiving coalesced pin events."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Unregister callback receiving coalesced pin events."""
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def publish(self, pin_id, event_type):
+        """Publish pin event to be delivered on the next frame."""
+        event_types = self._pending.setdefault(pin_id, set())
+
+        if event_type != PIN_DELETED:
+            event_types.add(event_type)
+        else:
+            # Other changes of deleted pin are irrelevant, pin added within the same frame is deleted as well
+            # because its row has already been inserted into the database
+            self._pending[pin_id] = {PIN_DELETED}
+
+        self._flush_trigger()
+
+    def publish_changes(self, pin_id, changed_attributes):
+        """Publish events matching changed pin record's attributes."""
+        for event_type in {ATTRIBUTE_EVENTS[attribute] for attribute in changed_attributes if attribute in ATTRIBUTE_EVENTS}:
+            self.publish(pin_id, event_type)
+
+    def flush(self):
+        """Deliver pending events to all subscribers."""
+        if not self._pending:
+            return False
+        events, self._pending = self._pending, {}
+        for callback in list(self._subscribers):
+            callback(events)
+        return True
@@ -4,20 +4,21 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
+from datetime import datetime, timezone
 from kivymd.app import MDApp
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivymd.toast import toast
 from kivymd.uix.menu import MDDropdownMenu
 from kivy.properties import NumericProperty, BooleanProperty, StringProperty
 from kivymd.uix.behaviors.magic_behavior import MagicBehavior
 from kivy.lang import Builder
 
-from geocode import geocode_by_address
+from geocode import geocode_by_address, geocode_in_background
+from pinstore import UNIT_MULT
 
-# Build the widget's UI
-Builder.load_file('pinitem.kv')
 
-class PinItem(BoxLayout, MagicBehavior):
+class PinItem(RecycleDataViewBehavior, BoxLayout, MagicBehavior):
 
     # Pin's properties
     pin_id = NumericProperty()
@@ -26,7 +27,14 @@ class PinItem(BoxLayout, MagicBehavior):
     buffer_size = NumericProperty()
     buffer_unit = StringProperty()
 
+    # Flag if the widget's UI has been loaded
+    _kv_loaded = False
+
     def __init__(self, **kwargs):
+        # Build the widget's UI when the first item is created
+        if not PinItem._kv_loaded:
+            Builder.load_file('pinitem.kv')
+            PinItem._kv_loaded = True
         super().__init__(**kwargs)
 
         self.app = MDApp.get_running_app()
@@ -36,6 +44,13 @@ class PinItem(BoxLayout, MagicBehavior):
         self.buffer_unit_menu = self.build_buffer_unit_menu()
         self.three_dots_menu = self.build_three_dots_menu()
 
+    def refresh_view_attrs(self, rv, index, data):
+        """Set item attributes when it is bound to the markers list data."""
+        super().refresh_view_attrs(rv, index, data)
+        # Perform magic animation waiting for the item
+        list_screen = self.app.root.ids.screen_manager.get_screen('ListScreen')
+        list_screen.on_item_bound(self)
+
     def build_buffer_unit_menu(self):
         """Builds drop down menu for pin's buffer unit."""
         unit_items = [
@@ -60,6 +75,11 @@ class PinItem(BoxLayout, MagicBehavior):
             width_mult=2,
         )
 
+    @property
+    def record(self):
+        """Get the pin record from the app's pin store."""
+        return self.app.pins[self.pin_id]
+
     @property
     def map_marker(self):
         """Get the marker instance from the marker dictionary."""
@@ -68,16 +88,12 @@ class PinItem(BoxLayout, MagicBehavior):
     def on_checkbox_click(self, new_is_active):
         """Update is_active attribute regarding checkbox state."""
         # Check if provided value is different to previous one
-        if self.is_active == new_is_active:
+        if self.record.is_active == new_is_active:
             return False
-        # Update UI on ListScreen
+        # Update UI of the edited item
         self.is_active = new_is_active
-        # Update UI on the map_widget
-        self.map_marker.pin.is_active = new_is_active
-        self.map_marker.update_buffer()
-        self.map_marker.set_pin_icon()
-        # Update the database
-        self.database.update_is_active(self.pin_id, self.is_active)
+        # Update pin record in the pin store
+        self.app.pins.update(self.pin_id, is_active=new_is_active)
         return True
 
     def on_address_edit(self, new_address):
@@ -88,30 +104,44 @@ class PinItem(BoxLayout, MagicBehavior):
             self.ids.address_field.text = self.address
             return False
 
-        try:
-            address, latitude, longitude = geocode_by_address(new_address)
-            # Update UI on ListScreen
+        # Geocode new address in the background, the item may be bound to another pin until it is done
+        pin_id = self.pin_id
+        geocode_in_background(
+            ('pin', pin_id), geocode_by_address, (new_address,),
+            lambda location: self.on_address_geocoded(pin_id, *location),
+            lambda error: self.on_address_geocoding_failed(pin_id),
+        )
+        return True
+
+    def on_address_geocoded(self, pin_id, address, latitude, longitude):
+        """Update pin record with the geocoded address."""
+        if pin_id not in self.app.pins:
+            return False
+        # Update UI of the edited item if it still shows the pin
+        if self.pin_id == pin_id:
             self.address = address
-            # Update UI on the map_widget
-            self.map_marker.pin.address = address
-            self.map_marker.lat = latitude
-            self.map_marker.lon = longitude
-            self.map_marker.update_buffer()
-            self.map_marker.set_marker_position()
             # Set text field to the new address value
             self.ids.address_field.text = self.address
-            # Update the database
-            self.database.update_address(self.pin_id, address, latitude, longitude)
-            # Show information on the screen
-            toast(text='Pin Edited')
-            return True
-        # If geocode failed
-        except:
-            # Restore text field to previous value
+        # Update pin record in the pin store
+        self.app.pins.update(
+            pin_id,
+            address=address,
+            latitude=latitude,
+            longitude=longitude,
+            insert_datetime=datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        # Show information on the screen
+        toast(text='Pin Edited')
+        return True
+
+    def on_address_geocoding_failed(self, pin_id):
+        """Restore address of the item after failed geocoding."""
+        # Restore text field to previous value if the item still shows the pin
+        if self.pin_id == pin_id:
             self.ids.address_field.text = self.address
-            # Show information on the screen
-            toast(text='Geocoding Failed')
-            return False
+        # Show information on the screen
+        toast(text='Geocoding Failed')
+        return False
 
     def on_buffer_size_edit(self, new_buffer_size):
         """Update buffer_size attribute regarding value of text field."""
@@ -121,13 +151,10 @@ class PinItem(BoxLayout, MagicBehavior):
             # If empty restore text field to previous value
             self.ids.buffer_size_field.text = str(self.buffer_size)
             return False
-        # Update UI on ListScreen
+        # Update UI of the edited item
         self.buffer_size = float(new_buffer_size)
-        # Update UI on the map_widget
-        self.map_marker.pin.buffer_size = float(new_buffer_size)
-        self.map_marker.update_buffer()
-        # Update the database
-        self.database.update_buffer_size(self.pin_id, self.buffer_size)
+        # Update pin record in the pin store
+        self.app.pins.update(self.pin_id, buffer_size=self.buffer_size)
         return True
 
     def on_buffer_unit_edit(self, new_buffer_unit):
@@ -137,26 +164,20 @@ class PinItem(BoxLayout, MagicBehavior):
             # Close drop down menu if click on the same unit
             self.buffer_unit_menu.dismiss()
             return False
-        # Update UI on ListScreen
+        # Update UI of the edited item
         self.buffer_unit = new_buffer_unit
-        # Update UI on the map_widget
-        self.map_marker.pin.buffer_unit = new_buffer_unit
-        self.map_marker.update_buffer()
         # Close drop down menu
         self.buffer_unit_menu.dismiss()
-        # Update the database
-        self.database.update_buffer_unit(self.pin_id, self.buffer_unit)
+        # Update pin record in the pin store
+        self.app.pins.update(self.pin_id, buffer_unit=new_buffer_unit)
         return True
 
     @staticmethod
     def valid_buffer_size(buffer_size, buffer_unit):
         """Ensure buffer_size is greater then 1 meter."""
-        from markerslayer import MarkersLayer
-        # Get values to convert buffer size to meter
-        unit_mult = MarkersLayer.unit_mult
         # Convert buffer size to meters
         buffer_size = float(buffer_size)
-        buffer_size_meter = unit_mult[buffer_unit] * buffer_size
+        buffer_size_meter = UNIT_MULT[buffer_unit] * buffer_size
 
         if buffer_size_meter < 1:
             toast('Buffer size to small')
@@ -166,15 +187,8 @@ class PinItem(BoxLayout, MagicBehavior):
 
     def on_delete_pin(self):
         """Delete pin from ListScreen, map_widget and database."""
-        # Remove item from screen
-        list_screen = self.app.root.ids.screen_manager.get_screen('ListScreen')
-        list_screen.remove_marker(self.pin_id)
-        # Remove buffer and marker from map_widget
-        self.map_marker.erase_from_map_widget()
-        # Remove marker from marker dictionary
-        self.app.markers.pop(self.pin_id)
-        # Update the database
-        self.database.delete_marker_by_id(self.pin_id)
+        # Remove pin record from the pin store
+        self.app.pins.remove(self.pin_id)
         # Show information on the screen
         toast(text='Pin Deleted')
         # Close drop down menu
@@ -184,7 +198,7 @@ class PinItem(BoxLayout, MagicBehavior):
         """Center map_widget on pin's location."""
         screen_manager = self.app.root.ids.screen_manager
         # Get pin's localization
-        latitude, longitude = self.map_marker.lat, self.map_marker.lon
+        latitude, longitude = self.record.latitude, self.record.longitude
         # Change screen to the MapScreen
         screen_manager.transition.direction = 'left' if screen_manager.current == 'ListScreen' else 'right'
         screen_manager.current = 'MapScreen'
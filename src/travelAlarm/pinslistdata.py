@@ -0,0 +1,161 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+
+class PinsListData:
+    """
+    Data source of the pins list recycle view.
+
+    Items are inserted, updated and removed one by one by pin's identifier, so the recycle view
+    refreshes only the changed rows. Map of pin's identifier to the data index is maintained alongside the data.
+    """
+
+    # Number of changes within a frame above which the whole list is rebuilt
+    bulk_threshold = 64
+
+    def __init__(self, recycle_view, sort_key, reverse):
+        self.recycle_view = recycle_view
+        self.sort_key = sort_key
+        self.reverse = reverse
+        # Sort keys of the items in the order of the data
+        self.keys = []
+        # Data index by pin's identifier
+        self.index = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, pin_id):
+        return pin_id in self.index
+
+    @property
+    def data(self):
+        """Return data of the recycle view."""
+        return self.recycle_view.data
+
+    def reset(self, pins, ranked=False):
+        """Rebuild the whole data from provided pin records, keep their order if they are ranked."""
+        if not ranked:
+            pins = sorted(pins, key=self.sort_key, reverse=self.reverse)
+        self.keys = [self.sort_key(pin) for pin in pins]
+        self.index = {}
+        self.recycle_view.data = [pin.to_list_item() for pin in pins]
+        self._reindex(0)
+
+    def set_order(self, sort_key, reverse):
+        """Set sort key of the data."""
+        self.sort_key = sort_key
+        self.reverse = reverse
+
+    def insert(self, pin):
+        """Insert pin record's item at its sorted position."""
+        key = self.sort_key(pin)
+        position = self._position(key)
+        self.keys.insert(position, key)
+        self.data.insert(position, pin.to_list_item())
+        self._reindex(position)
+        return position
+
+    def update(self, pin):
+        """Update pin record's item and move it if its sorted position has changed."""
+        position = self.index[pin.pin_id]
+        key = self.sort_key(pin)
+        # Update item in place if it is still between its neighbours
+        if self._fits(position, key):
+            self.keys[position] = key
+            self.data[position] = pin.to_list_item()
+            return position
+        self.remove(pin.pin_id)
+        return self.insert(pin)
+
+    def remove(self, pin_id):
+        """Remove pin's item from the data."""
+        position = self.index.pop(pin_id, None)
+        if position is None:
+            return None
+        del self.keys[position]
+        self.data.pop(position)
+        self._reindex(position)
+        return position
+
+    def rerank(self, pins):
+        """Recompute sort keys of the items and move only the items whose rank has changed."""
+        data = self.data
+        keys = [self.sort_key(pins[item['pin_id']]) for item in data]
+        stay = self._stable_positions(keys)
+        moved = [position for position in range(len(keys)) if position not in stay]
+        if len(moved) > self.bulk_threshold:
+            self.reset([pins[item['pin_id']] for item in data])
+            return len(moved)
+
+        # Take moved items out from the end and insert them at their sorted positions
+        items = [(keys[position], data[position]) for position in moved]
+        for position in reversed(moved):
+            data.pop(position)
+        self.keys = [key for position, key in enumerate(keys) if position in stay]
+        # Items from the first removed or inserted position have shifted
+        start = moved[0] if moved else len(data)
+        for key, item in items:
+            position = self._position(key)
+            self.keys.insert(position, key)
+            data.insert(position, item)
+            start = min(start, position)
+        self._reindex(start)
+        return len(moved)
+
+    def _stable_positions(self, keys):
+        """Return positions of the longest sequence of items already in order, these items keep their place."""
+        # Position of the last item of the best sequence of every length and the item preceding each item
+        tails = []
+        previous = [None] * len(keys)
+        for position, key in enumerate(keys):
+            low, high = 0, len(tails)
+            while low < high:
+                middle = (low + high) // 2
+                if self._before(key, keys[tails[middle]]):
+                    high = middle
+                else:
+                    low = middle + 1
+            previous[position] = tails[low - 1] if low else None
+            if low == len(tails):
+                tails.append(position)
+            else:
+                tails[low] = position
+
+        stay = set()
+        position = tails[-1] if tails else None
+        while position is not None:
+            stay.add(position)
+            position = previous[position]
+        return stay
+
+    def _before(self, key, other_key):
+        """Check if item with provided key is sorted before the other one."""
+        return key > other_key if self.reverse else key < other_key
+
+    def _fits(self, position, key):
+        """Check if provided key keeps the order of the data at provided position."""
+        keys = self.keys
+        after_previous = position == 0 or not self._before(key, keys[position - 1])
+        before_next = position == len(keys) - 1 or not self._before(keys[position + 1], key)
+        return after_previous and before_next
+
+    def _position(self, key):
+        """Return position after the last item not sorted after provided key."""
+        low, high = 0, len(self.keys)
+        while low < high:
+            middle = (low + high) // 2
+            if self._before(key, self.keys[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _reindex(self, start):
+        """Update data indexes of the items from provided position to the end."""
+        data = self.data
+        for position in range(start, len(data)):
+            self.index[data[position]['pin_id']] = position
@@ -0,0 +1,100 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from kivymd.app import MDApp
+from kivy.event import EventDispatcher
+from kivy.properties import NumericProperty, BooleanProperty
+from kivy.clock import Clock
+
+from pinstore import Pin
+
+
+class PinsLoader(EventDispatcher):
+    """
+    Progressive loader of the pins from the database.
+
+    Pins are streamed from the database cursor in chunks, one chunk per frame. Active pins and pins
+    nearest to the map center are loaded first. Pin records are delivered to the pin store at once,
+    so the geofence index sees them before their widgets are created. If the startup snapshot is
+    available, all pins are read from its columns at once without waiting for the database.
+    """
+
+    # Number of pins read within a frame
+    chunk_size = 250
+    # Loading progress
+    loaded = NumericProperty(0)
+    total = NumericProperty(0)
+    is_loading = BooleanProperty(False)
+    finished = BooleanProperty(False)
+
+    def __init__(self, **kwargs):
+        self.register_event_type('on_loaded')
+        super().__init__(**kwargs)
+
+        self.app = MDApp.get_running_app()
+        self._cursor = None
+        self._event = None
+        # Startup snapshot of the pins
+        self.snapshot = None
+
+    def start(self):
+        """Start loading pins from the database."""
+        if self.is_loading:
+            return False
+        if self.snapshot is not None:
+            self.load_snapshot()
+            return True
+        self.loaded = 0
+        self.total = self.app.database.count_pins()
+        self._cursor = self.app.database.iter_pins(self.app.map_widget.lat, self.app.map_widget.lon)
+        self.is_loading = True
+        self._event = Clock.schedule_interval(self.load_chunk, 0)
+        return True
+
+    def load_snapshot(self):
+        """Load all pins from the startup snapshot."""
+        snapshot, self.snapshot = self.snapshot, None
+        self.total = snapshot.count
+        for pin in snapshot.pins():
+            self.app.pins.add(pin)
+        snapshot.close()
+        self.loaded = self.total
+        # Deliver read pins to the geofence index and other subscribers at once
+        self.app.pin_events.flush()
+        self.finished = True
+        self.dispatch('on_loaded')
+
+    def load_chunk(self, *args):
+        """Load the next chunk of pins into the pin store."""
+        rows = self._cursor.fetchmany(self.chunk_size)
+        for row in rows:
+            # Skip pins loaded before the loading was interrupted
+            if row[0] not in self.app.pins:
+                self.app.pins.add(Pin(*row))
+        self.loaded += len(rows)
+        # Deliver read pins to the geofence index and other subscribers at once
+        self.app.pin_events.flush()
+
+        if len(rows) < self.chunk_size:
+            self.stop()
+            self.finished = True
+            self.dispatch('on_loaded')
+            return False
+        return True
+
+    def stop(self):
+        """Stop loading pins."""
+        if self._event:
+            self._event.cancel()
+            self._event = None
+        if self._cursor:
+            self._cursor.close()
+            self._cursor = None
+        self.is_loading = False
+
+    def on_loaded(self):
+        """Event dispatched when all pins have been loaded."""
+        pass
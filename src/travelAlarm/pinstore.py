@@ -0,0 +1,119 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from pinevents import PIN_ADDED, PIN_DELETED
+
+# Values to convert buffer size to meter
+UNIT_MULT = {'m': 1, 'km': 1000}
+
+
+class Pin:
+    """Plain, widget independent record of the pin's state."""
+
+    __slots__ = (
+        'pin_id', 'is_active', 'address', 'latitude', 'longitude', 'buffer_size', 'buffer_unit', 'insert_datetime'
+    )
+
+    def __init__(self, pin_id, is_active, address, latitude, longitude, buffer_size, buffer_unit, insert_datetime=None):
+        self.pin_id = pin_id
+        self.is_active = bool(is_active)
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+        self.buffer_size = buffer_size
+        self.buffer_unit = buffer_unit
+        self.insert_datetime = insert_datetime
+
+    @property
+    def buffer_meters(self):
+        """Return buffer size converted to meters."""
+        return self.buffer_size * UNIT_MULT.get(self.buffer_unit, 0)
+
+    def to_list_item(self):
+        """Return pin's attributes as the item of the pins list."""
+        return {
+            'pin_id': self.pin_id,
+            'is_active': self.is_active,
+            'address': self.address,
+            'buffer_size': self.buffer_size,
+            'buffer_unit': self.buffer_unit,
+        }
+
+
+class PinStore:
+    """
+    Single source of truth of the pins state kept in memory.
+
+    Pins are stored as plain Pin records keyed by pin's identifier in the order they were loaded
+    from the database. Widgets displaying the pins are views reading the records from the store.
+    Every mutation is published on the pin event bus, so the views are updated by its subscribers.
+    """
+
+    def __init__(self, events=None):
+        self._pins = {}
+        # Pin event bus
+        self.events = events
+
+    def __len__(self):
+        return len(self._pins)
+
+    def __iter__(self):
+        return iter(self._pins)
+
+    def __contains__(self, pin_id):
+        return pin_id in self._pins
+
+    def __getitem__(self, pin_id):
+        return self._pins[pin_id]
+
+    def get(self, pin_id, default=None):
+        """Return pin record by provided identifier."""
+        return self._pins.get(pin_id, default)
+
+    def values(self):
+        """Return all pin records."""
+        return self._pins.values()
+
+    def active(self):
+        """Iterate through active pin records."""
+        return (pin for pin in self._pins.values() if pin.is_active)
+
+    def load(self, pins):
+        """Replace content of the store with provided pin records."""
+        for pin_id in list(self._pins):
+            self.remove(pin_id)
+        for pin in pins:
+            self.add(pin)
+
+    def add(self, pin):
+        """Add pin record to the store."""
+        self._pins[pin.pin_id] = pin
+        self._publish(pin.pin_id, PIN_ADDED)
+        return pin
+
+    def remove(self, pin_id):
+        """Remove pin record from the store and return it."""
+        pin = self._pins.pop(pin_id, None)
+        if pin is not None:
+            self._publish(pin_id, PIN_DELETED)
+        return pin
+
+    def update(self, pin_id, **changes):
+        """Update pin record attributes and return dictionary of the attributes which have been changed."""
+        pin = self._pins[pin_id]
+        changed = {}
+        for attribute, value in changes.items():
+            if getattr(pin, attribute) != value:
+                setattr(pin, attribute, value)
+                changed[attribute] = value
+        if changed and self.events is not None:
+            self.events.publish_changes(pin_id, changed)
+        return changed
+
+    def _publish(self, pin_id, event_type):
+        """Publish pin event if the store is connected to the event bus."""
+        if self.events is not None:
+            self.events.publish(pin_id, event_type)
@@ -0,0 +1,158 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from math import radians, cos, floor
+
+from corridors import read_gpx, segment_distance, METERS_PER_DEGREE
+from fixfilter import capped_margin
+
+
+class Polygon:
+    """
+    Area geofence, a closed ring of points.
+
+    Edges are bucketed in bands of latitude, so the point-in-polygon test crosses only the edges
+    of the band containing the position. Positions outside the bounding box are rejected at once.
+    """
+
+    __slots__ = ('polygon_id', 'name', 'is_active', 'points', 'bbox', 'radius', 'inside', '_bands', '_band_height')
+
+    # Average number of edges in the band
+    edges_per_band = 4
+
+    def __init__(self, polygon_id, name, is_active, points):
+        self.polygon_id = polygon_id
+        self.name = name
+        self.is_active = is_active
+        # Drop closing point repeating the first one
+        if len(points) > 1 and points[0] == points[-1]:
+            points = points[:-1]
+        self.points = points
+        self.bbox = (
+            min(lat for lat, lon in points), min(lon for lat, lon in points),
+            max(lat for lat, lon in points), max(lon for lat, lon in points),
+        )
+        # Half of the shorter side of the bounding box bounds the distance from the inside to the edges in meters
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        self.radius = min(
+            (lat_max - lat_min) * METERS_PER_DEGREE,
+            (lon_max - lon_min) * METERS_PER_DEGREE * cos(radians((lat_min + lat_max) / 2)),
+        ) / 2
+        # Whether the user has been within the polygon at the last check
+        self.inside = False
+        self._bands = None
+        self._band_height = None
+
+    def _build_bands(self):
+        """Bucket edges in bands of latitude they span."""
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        count = max(len(self.points) // self.edges_per_band, 1)
+        self._band_height = (lat_max - lat_min) / count or 1
+        bands = [[] for _ in range(count)]
+        for index in range(len(self.points)):
+            (lat_a, lon_a), (lat_b, lon_b) = self.points[index - 1], self.points[index]
+            first = min(floor((min(lat_a, lat_b) - lat_min) / self._band_height), count - 1)
+            last = min(floor((max(lat_a, lat_b) - lat_min) / self._band_height), count - 1)
+            for band in range(first, last + 1):
+                bands[band].append((lat_a, lon_a, lat_b, lon_b))
+        self._bands = bands
+
+    def band_index(self, latitude):
+        """Return index of the band containing the latitude."""
+        return max(min(floor((latitude - self.bbox[0]) / self._band_height), len(self._bands) - 1), 0)
+
+    def contains(self, latitude, longitude, margin=0):
+        """Check if the position is within the polygon at least the margin in meters away from its edges."""
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        if len(self.points) < 3 or not (lat_min <= latitude <= lat_max and lon_min <= longitude <= lon_max):
+            return False
+        if self._bands is None:
+            self._build_bands()
+        band = self.band_index(latitude)
+
+        # Count edges crossed by the ray cast to the east
+        inside = False
+        for lat_a, lon_a, lat_b, lon_b in self._bands[band]:
+            if (lat_a > latitude) != (lat_b > latitude):
+                crossing = lon_a + (latitude - lat_a) * (lon_b - lon_a) / (lat_b - lat_a)
+                if longitude < crossing:
+                    inside = not inside
+        margin = capped_margin(margin, self.radius)
+        if not inside or margin <= 0:
+            return inside
+
+        # Check distance to the edges of the bands within the margin
+        meters_per_degree_lon = METERS_PER_DEGREE * cos(radians(latitude))
+        margin_lat = margin / METERS_PER_DEGREE
+        for band in range(self.band_index(latitude - margin_lat), self.band_index(latitude + margin_lat) + 1):
+            for lat_a, lon_a, lat_b, lon_b in self._bands[band]:
+                distance = segment_distance(
+                    0, 0,
+                    (lon_a - longitude) * meters_per_degree_lon, (lat_a - latitude) * METERS_PER_DEGREE,
+                    (lon_b - longitude) * meters_per_degree_lon, (lat_b - latitude) * METERS_PER_DEGREE,
+                )
+                if distance < margin:
+                    return False
+        return True
+
+    @property
+    def alarm_message(self):
+        """Return alarm message of the polygon."""
+        return f'You have entered the area {self.name}'
+
+
+class PolygonIndex:
+    """Polygon geofences checked against the user's position."""
+
+    def __init__(self, database):
+        self.database = database
+        # Polygon records by polygon's identifier
+        self.polygons = {}
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def values(self):
+        """Return polygon records."""
+        return self.polygons.values()
+
+    def load(self, polygons):
+        """Replace polygons with provided records."""
+        self.polygons = {polygon.polygon_id: polygon for polygon in polygons}
+
+    def import_gpx(self, filename):
+        """Add polygon outlined by the route in the GPX file."""
+        name, points = read_gpx(filename)
+        if len(points) < 3:
+            raise ValueError('GPX file contains no area')
+        polygon = self.database.add_polygon(name or 'area', points)
+        self.polygons[polygon.polygon_id] = polygon
+        return polygon
+
+    def set_active(self, polygon_id, is_active):
+        """Switch polygon's alarm on or off."""
+        polygon = self.polygons[polygon_id]
+        polygon.is_active = is_active
+        polygon.inside = False
+        self.database.update_polygon_is_active(polygon_id, is_active)
+
+    def remove(self, polygon_id):
+        """Delete polygon."""
+        self.polygons.pop(polygon_id, None)
+        self.database.delete_polygon(polygon_id)
+
+    def check(self, latitude, longitude, margin=0):
+        """Return active polygons entered at the position extended by the margin in meters."""
+        triggered = []
+        for polygon in self.polygons.values():
+            if not polygon.is_active:
+                continue
+            inside = polygon.contains(latitude, longitude, margin)
+            # Alarm is armed again once the user has left the polygon
+            if inside and not polygon.inside:
+                triggered.append(polygon)
+            polygon.inside = inside
+        return triggered
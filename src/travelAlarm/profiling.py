@@ -0,0 +1,143 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Profiling is enabled by the environment variable, otherwise hooks are not installed at all
+ENABLED = bool(os.environ.get('TRAVELALARM_PROFILE'))
+
+
+class CallStats:
+    """Statistics of the profiled calls."""
+
+    __slots__ = ('calls', 'total', 'allocations', 'samples')
+
+    # Number of the latest call times used for the percentile
+    sample_size = 512
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.allocations = 0
+        self.samples = deque(maxlen=self.sample_size)
+
+    def add(self, elapsed, allocations):
+        """Add the call time and number of allocated memory blocks."""
+        self.calls += 1
+        self.total += elapsed
+        self.allocations += allocations
+        self.samples.append(elapsed)
+
+    def p95(self):
+        """Return 95th percentile of the latest call times."""
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(int(.95 * len(samples)), len(samples) - 1)]
+
+    def to_dict(self):
+        """Return statistics in milliseconds."""
+        return {
+            'calls': self.calls,
+            'total_ms': self.total * 1000,
+            'p95_ms': self.p95() * 1000,
+            'allocations': self.allocations,
+        }
+
+
+class Profiler:
+    """
+    Collector of the hot paths statistics.
+
+    Call counts, cumulative and 95th percentile times and allocated memory blocks are collected
+    by the name of the profiled function or block.
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed, allocations):
+        """Record the call of the profiled function or block."""
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = CallStats()
+            stats.add(elapsed, allocations)
+
+    def profiled(self, name=None):
+        """Decorator profiling calls of the function. Function is returned unchanged if profiling is disabled."""
+        def decorator(func):
+            if not self.enabled:
+                return func
+            stats_name = name or func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                blocks = sys.getallocatedblocks()
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(stats_name, time.perf_counter() - start, sys.getallocatedblocks() - blocks)
+            return wrapper
+        return decorator
+
+    def block(self, name):
+        """Context manager profiling the block of code."""
+        if not self.enabled:
+            return nullcontext()
+        return self._block(name)
+
+    @contextmanager
+    def _block(self, name):
+        """Measure the block of code."""
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, sys.getallocatedblocks() - blocks)
+
+    def snapshot(self):
+        """Return statistics by name sorted by cumulative time."""
+        with self._lock:
+            items = [(name, stats.to_dict()) for name, stats in self.stats.items()]
+        return dict(sorted(items, key=lambda item: item[1]['total_ms'], reverse=True))
+
+    def report(self):
+        """Return statistics as text lines."""
+        if not self.enabled:
+            return ['Profiling is disabled, set TRAVELALARM_PROFILE=1 to enable it']
+        return [
+            f"{name}: {stats['calls']} calls, {stats['total_ms']:.1f} ms, "
+            f"p95 {stats['p95_ms']:.2f} ms, {stats['allocations']} blocks"
+            for name, stats in self.snapshot().items()
+        ] or ['No calls profiled yet']
+
+    def dump(self, filename):
+        """Dump statistics to the JSON file."""
+        with open(filename, 'w') as profile_file:
+            json.dump(self.snapshot(), profile_file, indent=2)
+        return filename
+
+    def reset(self):
+        """Remove collected statistics."""
+        with self._lock:
+            self.stats.clear()
+
+
+# Profiler of the app's hot paths
+profiler = Profiler()
+profiled = profiler.profiled
@@ -0,0 +1,255 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import heapq
+import time
+from datetime import datetime, timedelta
+
+from kivy.clock import Clock
+
+# Names of the days of week starting from Monday
+DAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_days(text):
+    """Return bitmask of the days of week from text like 'Mon-Fri' or 'Sat, Sun'."""
+    days = 0
+    for part in text.lower().replace(' ', '').split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        first_index = DAY_NAMES.index(first[:3])
+        last_index = DAY_NAMES.index(last[:3]) if last else first_index
+        index = first_index
+        # Range may wrap around the week like 'Sat-Mon'
+        while True:
+            days |= 1 << index
+            if index == last_index:
+                break
+            index = (index + 1) % 7
+    if not days:
+        raise ValueError('No days of week provided')
+    return days
+
+
+def parse_window(text):
+    """Return start and end minute of the day from text like '07:00-09:30'."""
+    start, end = text.replace(' ', '').split('-')
+    minutes = []
+    for value in (start, end):
+        hours, _, mins = value.partition(':')
+        hours, mins = int(hours), int(mins or 0)
+        if not (0 <= hours <= 24 and 0 <= mins < 60) or hours * 60 + mins > MINUTES_PER_DAY:
+            raise ValueError(f'Invalid time {value}')
+        minutes.append(hours * 60 + mins)
+    return tuple(minutes)
+
+
+def format_days(days):
+    """Return days of week of the bitmask as text."""
+    return ', '.join(name.capitalize() for index, name in enumerate(DAY_NAMES) if days & 1 << index)
+
+
+class Schedule:
+    """Activation window of the group of pins repeated on the days of week."""
+
+    __slots__ = ('schedule_id', 'days', 'start', 'end', 'pin_ids', 'applied_at')
+
+    def __init__(self, schedule_id, days, start, end, pin_ids=(), applied_at=None):
+        self.schedule_id = schedule_id
+        # Bitmask of the days of week the window starts on, Monday is the lowest bit
+        self.days = days
+        # Start and end minute of the day, window ending before its start lasts until the next day
+        self.start = start
+        self.end = end
+        self.pin_ids = set(pin_ids)
+        # Timestamp of the last transition applied to the pins
+        self.applied_at = applied_at
+
+    @property
+    def duration(self):
+        """Return length of the window in minutes."""
+        return (self.end - self.start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+
+    def windows(self, now, days_before=1):
+        """Yield start and end datetimes of the windows from provided days before until a week after provided datetime."""
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in range(-days_before, 8):
+            day = midnight + timedelta(days=offset)
+            if self.days & 1 << day.weekday():
+                start = day + timedelta(minutes=self.start)
+                yield start, start + timedelta(minutes=self.duration)
+
+    def is_open(self, now):
+        """Check if provided datetime is within the window."""
+        return any(start <= now < end for start, end in self.windows(now))
+
+    def next_transition(self, now):
+        """Return datetime of the next opening or closing of the window after provided datetime."""
+        return min(
+            (moment for window in self.windows(now) for moment in window if moment > now),
+            default=None,
+        )
+
+    def last_transition(self, now):
+        """Return datetime of the last opening or closing of the window until provided datetime."""
+        return max(
+            (moment for window in self.windows(now, days_before=8) for moment in window if moment <= now),
+            default=None,
+        )
+
+    def __str__(self):
+        return (
+            f'{format_days(self.days)} {self.start // 60:02d}:{self.start % 60:02d}-'
+            f'{self.end // 60:02d}:{self.end % 60:02d}, {len(self.pin_ids)} pins'
+        )
+
+
+class ActivationScheduler:
+    """
+    Scheduler switching pins on and off at the transitions of their activation windows.
+
+    Schedules are kept in a heap by their next transition and a single clock event wakes the scheduler
+    exactly at the earliest one. All pins of the schedules with a transition at that instant are updated
+    together, so their changes reach the database and the geofence index in one coalesced pin event.
+    Only the transitions are applied and the instant of the last one is saved with the schedule, so restarting
+    the app does not switch on again the pins the alarm has switched off within the open window.
+    """
+
+    # Transitions closer than this are applied together in seconds
+    tolerance = 1
+
+    def __init__(self, pins, database):
+        # App's pin store
+        self.pins = pins
+        self.database = database
+        # Schedule records by schedule's identifier
+        self.schedules = {}
+        self._heap = []
+        self._event = None
+
+    def __len__(self):
+        return len(self.schedules)
+
+    def values(self):
+        """Return schedule records."""
+        return self.schedules.values()
+
+    def load(self, schedules):
+        """Replace schedules with provided records and apply transitions missed since the last applied one."""
+        self.schedules = {schedule.schedule_id: schedule for schedule in schedules}
+        now = datetime.now()
+        due = []
+        unapplied = []
+        for schedule in self.schedules.values():
+            transition = schedule.last_transition(now)
+            # Schedules saved before the applied instant was stored have had their state applied already
+            if schedule.applied_at is None:
+                unapplied.append(schedule)
+            elif transition is not None and transition.timestamp() > schedule.applied_at:
+                due.append(schedule)
+        if due:
+            self.apply(due, now)
+        if unapplied:
+            self.apply([], now, unapplied)
+        self._rebuild()
+
+    def add(self, days, start, end, pin_ids):
+        """Add schedule of provided pins and apply its current state."""
+        now = datetime.now()
+        schedule = self.database.add_schedule(days, start, end, pin_ids, now.timestamp())
+        self.schedules[schedule.schedule_id] = schedule
+        self.apply([schedule], now)
+        self._rebuild()
+        return schedule
+
+    def remove(self, schedule_id):
+        """Delete schedule, its pins keep their current state."""
+        self.schedules.pop(schedule_id, None)
+        self.database.delete_schedule(schedule_id)
+        self._rebuild()
+
+    def scheduled_pins(self):
+        """Return identifiers of the pins with any schedule."""
+        return set().union(*(schedule.pin_ids for schedule in self.schedules.values()))
+
+    def apply(self, due, now, applied=()):
+        """
+        Apply state of the due schedules to their pins and save the instant as applied.
+
+        Pins of the open due schedules are switched on. Pins of the closed ones are switched off
+        unless another window of the pin is open, then they keep their state. Pins of the other
+        schedules are not touched. Provided applied schedules are only saved with the instant.
+        """
+        changed = 0
+        switched_on = set().union(*(schedule.pin_ids for schedule in due if schedule.is_open(now)))
+        for pin_id in set().union(*(schedule.pin_ids for schedule in due)):
+            if pin_id not in self.pins:
+                continue
+            if pin_id in switched_on:
+                changed += bool(self.pins.update(pin_id, is_active=True))
+            elif not any(schedule.is_open(now) for schedule in self.schedules.values() if pin_id in schedule.pin_ids):
+                changed += bool(self.pins.update(pin_id, is_active=False))
+
+        applied_at = now.timestamp()
+        applied = [*due, *applied]
+        for schedule in applied:
+            schedule.applied_at = applied_at
+        self.database.update_schedules_applied([schedule.schedule_id for schedule in applied], applied_at)
+        return changed
+
+    def _rebuild(self):
+        """Rebuild the heap of the next transitions and wait for the earliest one."""
+        now = datetime.now()
+        self._heap = []
+        for schedule in self.schedules.values():
+            transition = schedule.next_transition(now)
+            if transition is not None:
+                self._heap.append((transition.timestamp(), schedule.schedule_id))
+        heapq.heapify(self._heap)
+        self._arm()
+
+    def _arm(self):
+        """Schedule the clock event at the earliest transition."""
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+        if self._heap:
+            self._event = Clock.schedule_once(self._wake, max(self._heap[0][0] - time.time(), 0))
+
+    def _wake(self, *args):
+        """Apply all transitions due at the current instant."""
+        self._event = None
+        now = datetime.now()
+        # Clock may wake slightly before the transition
+        moment = now.timestamp()
+        due = {}
+        while self._heap and self._heap[0][0] <= now.timestamp() + self.tolerance:
+            timestamp, schedule_id = heapq.heappop(self._heap)
+            schedule = self.schedules.get(schedule_id)
+            if schedule is None:
+                continue
+            due[schedule_id] = schedule
+            moment = max(moment, timestamp)
+            # Wait for the following transition of the schedule
+            transition = schedule.next_transition(datetime.fromtimestamp(timestamp))
+            if transition is not None:
+                heapq.heappush(self._heap, (transition.timestamp(), schedule_id))
+
+        if due:
+            self.apply(list(due.values()), datetime.fromtimestamp(moment))
+        self._arm()
+
+    def resume(self):
+        """Apply transitions missed while the app was paused and wait for the next one."""
+        self._wake()
+
+    def stop(self):
+        """Cancel waiting for the next transition."""
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
@@ -4,21 +4,35 @@
 # Licensed under the GNU General Public License v3.0.
 # Full text of the license can be found in the LICENSE and COPYING files in the repository.
 
+import sqlite3
 from kivymd.app import MDApp
 from kivy.core.window import Window
 from kivy.uix.screenmanager import Screen
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.gridlayout import GridLayout
-from kivy.properties import ObjectProperty
+from kivy.properties import ObjectProperty, StringProperty, BooleanProperty, NumericProperty
 from kivy.metrics import dp
-from kivy.core.audio import SoundLoader
+from kivy.clock import Clock, mainthread
+from kivymd.toast import toast
+
+from tracing import tracer
+from profiling import profiler
+from schedules import parse_days, parse_window
+from geocode import geocoding_report
 
 
 class SettingsScreen(Screen):
 
+    def on_pre_enter(self, *args):
+        """Start refreshing diagnostics, routes and schedules summary while entering the settings screen."""
+        self.ids.routes_list.refresh()
+        self.ids.schedules_list.refresh()
+        self.ids.diagnostics_view.start_refreshing()
+
     def on_pre_leave(self, *args):
-        """Stop alarm sound sample while leaving the settings screen."""
+        """Stop alarm sound sample and diagnostics refreshing while leaving the settings screen."""
         self.ids.alarm_sounds_list.stop_alarm_sound()
+        self.ids.diagnostics_view.stop_refreshing()
 
 
 class ThemeStyleSwitch(BoxLayout):
@@ -41,6 +55,26 @@ class ThemeStyleSwitch(BoxLayout):
         return False
 
 
+class StrictAccuracySwitch(BoxLayout):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self.app = MDApp.get_running_app()
+        self.database = self.app.database
+
+    def update_strict_accuracy(self, active):
+        """Switch between triggering with the capped accuracy margin and on the position only."""
+        if active == self.app.fix_filter.strict_accuracy:
+            return False
+        self.app.fix_filter.strict_accuracy = active
+        self.database.update_strict_accuracy(active)
+        # Warn the margin of the small geofences is limited
+        if active:
+            toast(text='Pins smaller than the GPS accuracy ring halfway in')
+        return True
+
+
 class PrimaryPaletteToolbar(GridLayout):
 
     def __init__(self, **kwargs):
@@ -79,9 +113,7 @@ class PrimaryPaletteToolbar(GridLayout):
             self.app.theme_cls.primary_palette = selected_palette
             self.database.update_app_primary_palette(selected_palette)
             # Update markers color
-            for marker in self.app.markers.values():
-                marker.set_pin_icon()
-                marker.update_buffer()
+            self.app.map_widget.marker_layer.update_palette()
             # Update GPS marker color
             if self.app.gps_marker:
                 self.app.gps_marker.update_marker()
@@ -105,18 +137,257 @@ class AlarmSoundsList(BoxLayout):
 
     def sound_alarm_sample(self):
         """Start sound alarm sample."""
-        self.alarm_sound = SoundLoader.load(self.app.alarm_file)
+        # Do not interrupt the ringing alarm
+        if self.app.alarm_dispatcher.is_ringing:
+            return False
+        # Use the alarm sound cached by the alarm dispatcher
+        self.alarm_sound = self.app.alarm_dispatcher.get_sound(self.app.alarm_file)
 
         if self.alarm_sound:
             self.alarm_sound.loop = False
             self.alarm_sound.play()
+            return True
+        return False
 
     def stop_alarm_sound(self):
         """Stop sound alarm sample."""
-        if self.alarm_sound:
+        if self.alarm_sound and not self.app.alarm_dispatcher.is_ringing:
             self.alarm_sound.stop()
 
     def on_touch_down(self, touch):
         """Stop sound alarm sample when touch the screen."""
         self.stop_alarm_sound()
         super().on_touch_down(touch)
+
+
+class RoutesList(BoxLayout):
+
+    routes_report = StringProperty()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self.app = MDApp.get_running_app()
+
+    def refresh(self):
+        """Show number of the imported routes and areas and their items."""
+        self.update_report()
+        route_items = self.ids.route_items
+        route_items.clear_widgets()
+        for corridor in self.app.corridors.values():
+            route_items.add_widget(RouteItem(
+                routes_list=self, kind='route', item_id=corridor.corridor_id, is_active=corridor.is_active,
+                text=f'{corridor.name}, alarm on {"leaving" if corridor.mode == "leave" else "reaching"}',
+            ))
+        for polygon in self.app.polygons.values():
+            route_items.add_widget(RouteItem(
+                routes_list=self, kind='area', item_id=polygon.polygon_id, is_active=polygon.is_active,
+                text=f'{polygon.name}, alarm on entering',
+            ))
+
+    def update_report(self):
+        """Show number of the imported routes and areas."""
+        active = sum(1 for corridor in self.app.corridors.values() if corridor.is_active)
+        active += sum(1 for polygon in self.app.polygons.values() if polygon.is_active)
+        self.routes_report = f'{len(self.app.corridors)} routes, {len(self.app.polygons)} areas, {active} with active alarm'
+
+    def switch_route_alarm(self, corridor_id, is_active):
+        """Switch route's alarm on or off."""
+        corridor = self.app.corridors.corridors.get(corridor_id)
+        if corridor is None or corridor.is_active == is_active:
+            return False
+        self.app.corridors.set_active(corridor_id, is_active)
+        self.app.map_widget.corridors_layer.reposition()
+        self.update_report()
+        return True
+
+    def delete_route(self, corridor_id):
+        """Delete route and its alarm."""
+        self.app.corridors.remove(corridor_id)
+        self.app.map_widget.corridors_layer.reposition()
+        self.refresh()
+        toast(text='Route Deleted')
+        return True
+
+    def switch_area_alarm(self, polygon_id, is_active):
+        """Switch area's alarm on or off."""
+        polygon = self.app.polygons.polygons.get(polygon_id)
+        if polygon is None or polygon.is_active == is_active:
+            return False
+        self.app.polygons.set_active(polygon_id, is_active)
+        self.app.map_widget.marker_layer.reposition_polygons()
+        self.update_report()
+        return True
+
+    def delete_area(self, polygon_id):
+        """Delete area and its alarm."""
+        self.app.polygons.remove(polygon_id)
+        self.app.map_widget.marker_layer.remove_polygon(polygon_id)
+        self.refresh()
+        toast(text='Area Deleted')
+        return True
+
+    def choose_gpx_file(self, mode):
+        """Open file chooser to import the GPX route or area."""
+        from plyer import filechooser
+        filechooser.open_file(
+            on_selection=lambda selection: self.import_gpx(selection, mode),
+            filters=[['GPX route', '*.gpx']],
+        )
+
+    @mainthread
+    def import_gpx(self, selection, mode):
+        """Import route or area from the selected GPX file."""
+        if not selection:
+            return False
+        try:
+            if mode == 'area':
+                self.app.polygons.import_gpx(selection[0])
+            else:
+                self.app.corridors.import_gpx(selection[0], mode)
+        except (OSError, ValueError, SyntaxError):
+            toast(text='Import Failed')
+            return False
+        if mode == 'area':
+            self.app.map_widget.marker_layer.draw_polygons()
+        else:
+            self.app.map_widget.corridors_layer.reposition()
+        self.refresh()
+        toast(text='Route Imported')
+        return True
+
+
+class RouteItem(BoxLayout):
+
+    routes_list = ObjectProperty()
+    # Item is a route or an area
+    kind = StringProperty('route')
+    item_id = NumericProperty()
+    is_active = BooleanProperty()
+    text = StringProperty()
+
+    def switch_alarm(self, active):
+        """Switch item's alarm on or off."""
+        if self.kind == 'area':
+            return self.routes_list.switch_area_alarm(self.item_id, active)
+        return self.routes_list.switch_route_alarm(self.item_id, active)
+
+    def delete(self):
+        """Delete item."""
+        if self.kind == 'area':
+            return self.routes_list.delete_area(self.item_id)
+        return self.routes_list.delete_route(self.item_id)
+
+
+class SchedulesList(BoxLayout):
+
+    schedules_report = StringProperty()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self.app = MDApp.get_running_app()
+
+    def refresh(self):
+        """Show activation schedules."""
+        schedules = [str(schedule) for schedule in self.app.scheduler.values()]
+        self.schedules_report = '\n'.join(schedules) if schedules else 'No schedules'
+
+    def schedule_active_pins(self, days_text, window_text):
+        """Add schedule activating currently active pins within the time window on the days of week."""
+        try:
+            days = parse_days(days_text)
+            start, end = parse_window(window_text)
+        except ValueError:
+            toast(text='Invalid Schedule')
+            return False
+        pin_ids = [pin.pin_id for pin in self.app.pins.active()]
+        if not pin_ids:
+            toast(text='No Active Pins')
+            return False
+        self.app.scheduler.add(days, start, end, pin_ids)
+        self.refresh()
+        toast(text='Schedule Added')
+        return True
+
+    def remove_schedules(self):
+        """Delete all schedules, pins keep their current state."""
+        for schedule_id in list(self.app.scheduler.schedules):
+            self.app.scheduler.remove(schedule_id)
+        self.refresh()
+        toast(text='Schedules Removed')
+        return True
+
+
+class DiagnosticsView(BoxLayout):
+
+    latency_report = StringProperty()
+    profile_report = StringProperty()
+    tiles_report = StringProperty()
+    trip_log_report = StringProperty()
+    fixes_report = StringProperty()
+    geocoding_report = StringProperty()
+    # Files of the exported alarm latency trace, hot paths statistics and trip log
+    trace_filename = 'alarm_latency.jsonl'
+    profile_filename = 'profile.json'
+    trip_log_filename = 'trip_log.jsonl'
+    # Interval of refreshing the diagnostics in seconds
+    refresh_interval = 1
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self.app = MDApp.get_running_app()
+        self.refresh_event = None
+
+    def start_refreshing(self):
+        """Show diagnostics live while the view is displayed."""
+        self.refresh()
+        if self.refresh_event is None:
+            self.refresh_event = Clock.schedule_interval(lambda dt: self.refresh(), self.refresh_interval)
+
+    def stop_refreshing(self):
+        """Stop refreshing the diagnostics."""
+        if self.refresh_event:
+            self.refresh_event.cancel()
+            self.refresh_event = None
+
+    def refresh(self):
+        """Show percentiles of the alarm latency and hot paths statistics."""
+        self.latency_report = '\n'.join(tracer.report())
+        self.profile_report = '\n'.join(profiler.report())
+        self.tiles_report = self.app.map_widget.tile_store.report()
+        self.fixes_report = self.app.fix_filter.report()
+        self.geocoding_report = geocoding_report()
+        trip_log = self.app.trip_log
+        self.trip_log_report = f'{trip_log.stored} events stored, {len(trip_log._pending)} pending, {trip_log.dropped} dropped'
+
+    def export_trace(self):
+        """Export alarm latency trace to the file."""
+        try:
+            tracer.export(self.trace_filename)
+        except OSError:
+            toast(text='Export Failed')
+            return False
+        toast(text=f'Trace saved to {self.trace_filename}')
+        return True
+
+    def dump_profile(self):
+        """Dump hot paths statistics to the file."""
+        try:
+            profiler.dump(self.profile_filename)
+        except OSError:
+            toast(text='Dump Failed')
+            return False
+        toast(text=f'Profile saved to {self.profile_filename}')
+        return True
+
+    def export_trip_log(self):
+        """Export events of all trips to the file."""
+        try:
+            count = self.app.trip_log.export(self.trip_log_filename)
+        except (OSError, sqlite3.Error):
+            toast(text='Export Failed')
+            return False
+        toast(text=f'{count} events saved to {self.trip_log_filename}')
+        return True
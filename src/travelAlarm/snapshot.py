@@ -0,0 +1,177 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import os
+import mmap
+import json
+import struct
+from array import array
+
+from pinstore import Pin
+
+# Snapshot file identifier and format version
+MAGIC = b'TASN'
+VERSION = 1
+# Magic, version, change counter, number of pins, settings length, strings length
+HEADER = struct.Struct('=4sHxxIIII')
+# Codes of the buffer units
+BUFFER_UNITS = ('m', 'km')
+
+
+def read_change_counter(db_filename):
+    """
+    Return the file change counter from the SQLite database header.
+
+    The counter is incremented by every committed transaction in rollback journal mode,
+    so it tells if the database has been changed since the snapshot was written.
+    """
+    try:
+        with open(db_filename, 'rb') as db_file:
+            header = db_file.read(28)
+    except OSError:
+        return None
+    if len(header) < 28 or not header.startswith(b'SQLite format 3\x00'):
+        return None
+    return int.from_bytes(header[24:28], 'big')
+
+
+def _padding(length):
+    """Return number of bytes aligning provided length to 8 bytes."""
+    return -length % 8
+
+
+def write_snapshot(filename, change_counter, settings, pins):
+    """Write the snapshot of settings and pins columns to the file."""
+    pins = list(pins)
+    settings_bytes = json.dumps(settings).encode('utf-8')
+
+    # Addresses and insert datetimes are stored as one strings blob indexed by offsets
+    strings = bytearray()
+    offsets = array('I', [0])
+    for text in [pin.address or '' for pin in pins] + [pin.insert_datetime or '' for pin in pins]:
+        strings += text.encode('utf-8')
+        offsets.append(len(strings))
+
+    # Columns ordered by item size to keep them aligned
+    columns = [
+        array('q', [pin.pin_id for pin in pins]),
+        array('d', [pin.latitude for pin in pins]),
+        array('d', [pin.longitude for pin in pins]),
+        array('d', [pin.buffer_size for pin in pins]),
+        offsets,
+        array('B', [pin.is_active for pin in pins]),
+        array('B', [BUFFER_UNITS.index(pin.buffer_unit) for pin in pins]),
+    ]
+
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, VERSION, change_counter, len(pins), len(settings_bytes), len(strings)))
+        snapshot_file.write(settings_bytes + bytes(_padding(HEADER.size + len(settings_bytes))))
+        for column in columns:
+            column_bytes = column.tobytes()
+            snapshot_file.write(column_bytes + bytes(_padding(len(column_bytes))))
+        snapshot_file.write(strings)
+    # Replace previous snapshot at once
+    os.replace(temporary_filename, filename)
+
+
+class PinSnapshot:
+    """
+    Memory-mapped snapshot of the settings and pins columns.
+
+    Columns are memoryviews over the mapped file, so they are read without copying the data.
+    """
+
+    def __init__(self, snapshot_file):
+        self._file = snapshot_file
+        self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        try:
+            self._map_columns()
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    def _map_columns(self):
+        """Read the header and settings and map columns of the pins, the file is checked to fit them."""
+        magic, version, self.change_counter, self.count, settings_length, strings_length = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Unsupported snapshot file')
+
+        position = HEADER.size
+        self.settings = json.loads(bytes(self._buffer[position:position + settings_length]).decode('utf-8'))
+        position += settings_length + _padding(HEADER.size + settings_length)
+
+        # Map columns of the pins
+        count = self.count
+        self.ids, position = self._column(position, 'q', count)
+        self.latitudes, position = self._column(position, 'd', count)
+        self.longitudes, position = self._column(position, 'd', count)
+        self.buffer_sizes, position = self._column(position, 'd', count)
+        self.offsets, position = self._column(position, 'I', 2 * count + 1)
+        self.active, position = self._column(position, 'B', count)
+        self.buffer_units, position = self._column(position, 'B', count)
+        if position + strings_length > len(self._buffer) or self.offsets[2 * count] != strings_length:
+            raise ValueError('Truncated snapshot file')
+        self.strings = self._buffer[position:position + strings_length]
+
+    def _column(self, position, typecode, length):
+        """Return memoryview of the column and position of the next one."""
+        size = struct.calcsize(typecode) * length
+        if position + size > len(self._buffer):
+            raise ValueError('Truncated snapshot file')
+        column = self._buffer[position:position + size].cast(typecode)
+        return column, position + size + _padding(size)
+
+    @classmethod
+    def open(cls, filename, db_filename):
+        """Open the snapshot if it is up to date with the database, otherwise return None."""
+        change_counter = read_change_counter(db_filename)
+        if change_counter is None:
+            return None
+        try:
+            snapshot_file = open(filename, 'rb')
+        except OSError:
+            return None
+        try:
+            snapshot = cls(snapshot_file)
+        except (OSError, ValueError, struct.error):
+            snapshot_file.close()
+            return None
+        if snapshot.change_counter != change_counter:
+            snapshot.close()
+            return None
+        return snapshot
+
+    def string(self, index):
+        """Decode string from the strings blob."""
+        return bytes(self.strings[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+    def pins(self):
+        """Iterate through pin records built from the snapshot columns."""
+        count = self.count
+        for index in range(count):
+            yield Pin(
+                self.ids[index],
+                self.active[index],
+                self.string(index),
+                self.latitudes[index],
+                self.longitudes[index],
+                self.buffer_sizes[index],
+                BUFFER_UNITS[self.buffer_units[index]],
+                self.string(count + index) or None,
+            )
+
+    def close(self):
+        """Release memory views and unmap the file."""
+        for name in ('ids', 'latitudes', 'longitudes', 'buffer_sizes', 'offsets', 'active', 'buffer_units', 'strings'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self._buffer.release()
+        self._mmap.close()
+        self._file.close()
@@ -0,0 +1,90 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import os
+import json
+import time
+import threading
+from importlib import import_module
+
+
+def seconds_since_process_start():
+    """Return time elapsed since the process start, or None if it cannot be read."""
+    try:
+        # Process start time in clock ticks since boot
+        with open('/proc/self/stat') as stat_file:
+            start_ticks = int(stat_file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf('SC_CLK_TCK'), 0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    """
+    Timings of the application startup phases.
+
+    Every phase is marked with time elapsed since the process start. If the process start time
+    is unavailable, times are measured from the import of this module.
+    """
+
+    def __init__(self):
+        elapsed = seconds_since_process_start()
+        self.origin = time.perf_counter() - (elapsed or 0)
+        self.phases = [('process start', 0.0)]
+        if elapsed is not None:
+            self.mark('interpreter ready')
+
+    def mark(self, phase):
+        """Mark the end of the startup phase."""
+        self.phases.append((phase, time.perf_counter() - self.origin))
+
+    def durations(self):
+        """Return list of phases with their duration and time since the process start in milliseconds."""
+        durations = []
+        previous = 0.0
+        for phase, elapsed in self.phases:
+            durations.append((phase, (elapsed - previous) * 1000, elapsed * 1000))
+            previous = elapsed
+        return durations
+
+    def report(self):
+        """Return startup profile as text lines."""
+        return [f'{phase}: +{duration:.1f} ms ({elapsed:.1f} ms)' for phase, duration, elapsed in self.durations()]
+
+    def save(self, filename):
+        """Save startup profile to the JSON file."""
+        with open(filename, 'w') as profile_file:
+            json.dump(
+                [{'phase': phase, 'duration_ms': duration, 'elapsed_ms': elapsed}
+                 for phase, duration, elapsed in self.durations()],
+                profile_file,
+                indent=2,
+            )
+
+
+def warm_up(modules, initializers=()):
+    """Import modules and run initializers in the background thread."""
+    def run():
+        for module in modules:
+            try:
+                import_module(module)
+            except ImportError:
+                pass
+        for initializer in initializers:
+            try:
+                initializer()
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+# Profile of the current process startup
+profile = StartupProfile()
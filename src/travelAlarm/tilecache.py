@@ -0,0 +1,62 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import io
+from random import choice
+
+from kivy.core.image import Image as CoreImage
+from kivy_garden.mapview import MapSource
+from kivy_garden.mapview.downloader import Downloader, USER_AGENT
+
+
+class CachedMapSource(MapSource):
+    """Map source loading tiles from the tile store and downloading only the missing ones."""
+
+    # Timeout of the tile download in seconds
+    timeout = 5
+
+    def __init__(self, store, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+
+    def fill_tile(self, tile):
+        """Load tile within the downloader threads."""
+        if tile.state == 'done':
+            return
+        Downloader.instance(cache_dir=self.cache_dir).submit(self._load_tile, tile)
+
+    def download(self, zoom, column, row):
+        """Download tile data from the tile server."""
+        import requests
+        url = self.url.format(z=zoom, x=column, y=self.get_row_count(zoom) - row - 1, s=choice(self.subdomains))
+        response = requests.get(url, headers={'User-agent': USER_AGENT}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def get_tile_data(self, zoom, column, row):
+        """Return tile data from the store or download and store it."""
+        data = self.store.get(zoom, column, row)
+        if data is None:
+            data = self.download(zoom, column, row)
+            self.store.put(zoom, column, row, data)
+        return data
+
+    def _load_tile(self, tile):
+        """Read tile image in the downloader thread."""
+        if tile.state == 'done':
+            return None
+        try:
+            data = self.get_tile_data(tile.zoom, tile.tile_x, tile.tile_y)
+            image = CoreImage(io.BytesIO(data), ext=self.image_ext)
+        except Exception:
+            # Tile stays empty if it is neither cached nor reachable
+            return None
+        return self._load_tile_done, (tile, image)
+
+    def _load_tile_done(self, tile, image):
+        """Display loaded tile on the main thread."""
+        tile.texture = image.texture
+        tile.state = 'need-animation'
@@ -0,0 +1,191 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import threading
+from math import radians, cos, sqrt
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from pinevents import PIN_ADDED, PIN_DELETED
+from tilestore import METERS_PER_DEGREE, tile_xy
+
+# Tile servers whose usage policy forbids bulk downloading
+NO_PREFETCH_HOSTS = ('openstreetmap.org', 'osm.org')
+
+
+def allows_prefetch(url):
+    """Check if the tile server of provided url may be used for prefetching."""
+    host = urlsplit(url or '').hostname or ''
+    return bool(host) and not any(host == name or host.endswith('.' + name) for name in NO_PREFETCH_HOSTS)
+
+
+class TilePrefetcher:
+    """
+    Bounded prefetcher of the tiles around active pins and along the path to the nearest active pin.
+
+    Tiles are downloaded by a small thread pool, so the prefetching does not compete with tiles loaded
+    for the displayed map. Number of tiles per pin, per zoom level and pending tiles is limited and already
+    cached tiles are skipped. Prefetching is disabled for the tile servers which forbid bulk downloading.
+    """
+
+    # Zoom levels prefetched around active pins
+    zoom_levels = range(10, 17)
+    # Zoom levels prefetched along the path to the nearest active pin
+    path_zoom_levels = range(10, 15)
+    # Maximal number of tiles waiting for the download
+    max_pending = 500
+    # Maximal number of tiles prefetched per zoom level around the pin's center or along the path
+    max_tiles_per_zoom = 25
+    # Maximal number of tiles prefetched per pin
+    max_tiles_per_pin = 100
+    # Distance the user has to move to prefetch the path again in meters
+    path_refresh_distance = 1000
+
+    def __init__(self, source, pins, max_workers=2):
+        self.source = source
+        # App's pin store
+        self.pins = pins
+        self.max_workers = max_workers
+        self.enabled = allows_prefetch(getattr(source, 'url', None))
+        # Pins added by the startup loading are not prefetched, only the later changes
+        self.pins_loaded = False
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        # User position of the last path prefetch
+        self._path_origin = None
+
+    def prefetch_tile(self, zoom, column, row):
+        """Queue the tile download unless it is cached, pending or the queue is full."""
+        if not self.enabled:
+            return False
+        key = (zoom, column, row)
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(key)
+            # Start download threads on first use or after stop
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tile-prefetch')
+            self._executor.submit(self._fetch, key)
+        return True
+
+    def _fetch(self, key):
+        """Download the tile in the prefetcher thread."""
+        try:
+            if not self.source.store.contains(*key):
+                self.source.store.put(*key, self.source.download(*key))
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def prefetch_area(self, south, west, north, east, zoom_levels, max_tiles=None):
+        """Prefetch tiles covering provided bounding box, the tiles nearest to its center first at each zoom level."""
+        if not self.enabled:
+            return 0
+        # Side of the square of tiles around the center prefetched at each zoom level
+        side = max(int(sqrt(self.max_tiles_per_zoom)), 1)
+        max_tiles = self.max_tiles_per_zoom * len(zoom_levels) if max_tiles is None else max_tiles
+        queued = 0
+        visited = 0
+        for zoom in zoom_levels:
+            west_column, south_row = tile_xy(zoom, south, west)
+            east_column, north_row = tile_xy(zoom, north, east)
+            center_column, center_row = tile_xy(zoom, (south + north) / 2, (west + east) / 2)
+            # Clamp the area to the square around the center, so large buffers are not walked tile by tile
+            west_column = max(west_column, center_column - side // 2)
+            east_column = min(east_column, west_column + side - 1)
+            south_row = max(south_row, center_row - side // 2)
+            north_row = min(north_row, south_row + side - 1)
+            for column in range(west_column, east_column + 1):
+                for row in range(south_row, north_row + 1):
+                    if visited >= max_tiles:
+                        return queued
+                    visited += 1
+                    queued += self.prefetch_tile(zoom, column, row)
+        return queued
+
+    def prefetch_pin(self, pin):
+        """Prefetch tiles covering pin's buffer."""
+        latitude_margin = pin.buffer_meters / METERS_PER_DEGREE
+        longitude_margin = latitude_margin / max(cos(radians(pin.latitude)), .01)
+        return self.prefetch_area(
+            pin.latitude - latitude_margin, pin.longitude - longitude_margin,
+            pin.latitude + latitude_margin, pin.longitude + longitude_margin,
+            self.zoom_levels, self.max_tiles_per_pin,
+        )
+
+    def prefetch_pins(self, pins=None):
+        """Prefetch tiles around active pins."""
+        pins = self.pins.active() if pins is None else pins
+        return sum(self.prefetch_pin(pin) for pin in pins)
+
+    def prefetch_path(self, latitude, longitude, pins=None):
+        """Prefetch tiles along the path from provided position to the nearest active pin."""
+        if not self.enabled:
+            return 0
+        if self._path_origin is not None:
+            moved = self.distance(self._path_origin, (latitude, longitude))
+            if moved < self.path_refresh_distance:
+                return 0
+        pins = self.pins.active() if pins is None else pins
+        nearest = min(pins, key=lambda pin: self.distance((latitude, longitude), (pin.latitude, pin.longitude)), default=None)
+        if nearest is None:
+            return 0
+        self._path_origin = (latitude, longitude)
+
+        queued = 0
+        for zoom in self.path_zoom_levels:
+            start = tile_xy(zoom, latitude, longitude)
+            end = tile_xy(zoom, nearest.latitude, nearest.longitude)
+            # Walk along the straight line with a step shorter than a tile, the tiles nearest to the user first
+            steps = max(abs(end[0] - start[0]), abs(end[1] - start[1])) * 2 + 1
+            tiles = set()
+            for step in range(steps + 1):
+                fraction = step / steps
+                column, row = tile_xy(
+                    zoom,
+                    latitude + (nearest.latitude - latitude) * fraction,
+                    longitude + (nearest.longitude - longitude) * fraction,
+                )
+                if (column, row) in tiles:
+                    continue
+                if len(tiles) >= self.max_tiles_per_zoom:
+                    break
+                tiles.add((column, row))
+                queued += self.prefetch_tile(zoom, column, row)
+        return queued
+
+    @staticmethod
+    def distance(position, other):
+        """Return approximate distance between positions in meters."""
+        latitude_delta = (position[0] - other[0]) * METERS_PER_DEGREE
+        longitude_delta = (position[1] - other[1]) * METERS_PER_DEGREE * cos(radians(position[0]))
+        return sqrt(latitude_delta ** 2 + longitude_delta ** 2)
+
+    def apply_pin_events(self, events):
+        """Prefetch tiles around pins which became active or changed their buffer."""
+        if not self.enabled:
+            return
+        for pin_id, event_types in events.items():
+            if PIN_DELETED in event_types:
+                continue
+            # Pins read from the database at startup are not new to the user
+            if not self.pins_loaded and event_types == {PIN_ADDED}:
+                continue
+            pin = self.pins.get(pin_id)
+            if pin is not None and pin.is_active:
+                self.prefetch_pin(pin)
+
+    def stop(self):
+        """Cancel pending downloads."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            self._pending.clear()
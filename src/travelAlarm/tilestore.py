@@ -0,0 +1,173 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import time
+import sqlite3
+import threading
+from math import radians, cos, tan, log, pi, floor
+
+# Approximate length of one degree of latitude in meters
+METERS_PER_DEGREE = 111320
+
+
+def tile_xy(zoom, latitude, longitude):
+    """Return column and row of the tile containing provided position, rows are counted from the south like in MBTiles."""
+    count = 1 << zoom
+    latitude = max(min(latitude, 85.0511), -85.0511)
+    column = int(floor((longitude + 180) / 360 * count))
+    row_from_north = int(floor((1 - log(tan(radians(latitude)) + 1 / cos(radians(latitude))) / pi) / 2 * count))
+    return min(max(column, 0), count - 1), count - 1 - min(max(row_from_north, 0), count - 1)
+
+
+class TileStore:
+    """
+    Size-bounded store of the map tiles in a single MBTiles file.
+
+    Tiles are evicted in least recently used order when the total size of the tiles exceeds the cap.
+    Uses of the cached tiles are kept in memory and written in one transaction with the next stored tile,
+    the eviction or when enough of them are collected, so serving a cached tile does not write to the disk.
+    The store is shared by the tile loading threads, so every query is guarded by the lock.
+    """
+
+    # Fraction of the size cap the store is shrunk to by the eviction
+    eviction_target = .9
+    # Number of the tile uses kept in memory before they are written
+    touch_batch_size = 256
+
+    def __init__(self, filename, max_bytes=100 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._cursor = self._connection.cursor()
+        self._cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tiles (
+                zoom_level INTEGER,
+                tile_column INTEGER,
+                tile_row INTEGER,
+                tile_data BLOB,
+                size INTEGER,
+                last_used REAL,
+                PRIMARY KEY (zoom_level, tile_column, tile_row)
+            );
+            CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used, size);
+            INSERT OR IGNORE INTO metadata (name, value) VALUES ('name', 'travelAlarm tile cache');
+            INSERT OR IGNORE INTO metadata (name, value) VALUES ('format', 'png');
+        ''')
+        self._connection.commit()
+        self._cursor.execute('SELECT COALESCE(SUM(size), 0) FROM tiles;')
+        self.size = self._cursor.fetchone()[0]
+        # Time of the last use of the cached tiles not written yet by the tile's key
+        self._touched = {}
+
+        # Statistics of the cache usage
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get(self, zoom, column, row):
+        """Return data of the cached tile or None."""
+        with self._lock:
+            self._cursor.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;',
+                (zoom, column, row)
+            )
+            result = self._cursor.fetchone()
+            if result is None:
+                self.misses += 1
+                return None
+            # Mark the tile as used in memory
+            self._touched[(zoom, column, row)] = time.time()
+            if len(self._touched) >= self.touch_batch_size:
+                self._write_touches()
+                self._connection.commit()
+            data = bytes(result[0])
+            self.hits += 1
+            self.bytes_saved += len(data)
+            return data
+
+    def contains(self, zoom, column, row):
+        """Check if the tile is cached without marking it as used."""
+        with self._lock:
+            self._cursor.execute(
+                'SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;',
+                (zoom, column, row)
+            )
+            return self._cursor.fetchone() is not None
+
+    def put(self, zoom, column, row, data, last_used=None):
+        """Save tile data and evict least recently used tiles above the size cap."""
+        with self._lock:
+            self._cursor.execute(
+                'SELECT size FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;',
+                (zoom, column, row)
+            )
+            replaced = self._cursor.fetchone()
+            self._cursor.execute(
+                'REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data, size, last_used) VALUES (?, ?, ?, ?, ?, ?);',
+                (zoom, column, row, sqlite3.Binary(data), len(data), time.time() if last_used is None else last_used)
+            )
+            self.size += len(data) - (replaced[0] if replaced else 0)
+            # Stored tile is newer than its pending use
+            self._touched.pop((zoom, column, row), None)
+            self._write_touches()
+            if self.size > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def _write_touches(self):
+        """Write last uses of the tiles kept in memory within the current transaction."""
+        if not self._touched:
+            return
+        self._cursor.executemany(
+            'UPDATE tiles SET last_used = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;',
+            [(last_used, *key) for key, last_used in self._touched.items()]
+        )
+        self._touched = {}
+
+    def flush(self):
+        """Write last uses of the tiles kept in memory."""
+        with self._lock:
+            self._write_touches()
+            self._connection.commit()
+
+    def _evict(self):
+        """Remove least recently used tiles until the store fits the eviction target, uses are written before."""
+        target = self.max_bytes * self.eviction_target
+        self._cursor.execute('SELECT rowid, size FROM tiles ORDER BY last_used;')
+        evicted = []
+        for rowid, size in self._cursor.fetchall():
+            if self.size <= target:
+                break
+            evicted.append((rowid,))
+            self.size -= size
+        self._cursor.executemany('DELETE FROM tiles WHERE rowid = ?;', evicted)
+
+    def stats(self):
+        """Return statistics of the cache usage."""
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'bytes_saved': self.bytes_saved,
+            'size': self.size,
+        }
+
+    def report(self):
+        """Return statistics of the cache usage as text."""
+        stats = self.stats()
+        return (
+            f"Tiles: hit rate {stats['hit_rate'] * 100:.0f}% ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+            f"{stats['bytes_saved'] / 1048576:.1f} MB saved, {stats['size'] / 1048576:.1f} MB cached"
+        )
+
+    def close(self):
+        """Write last uses of the tiles and close the store file."""
+        with self._lock:
+            self._write_touches()
+            self._connection.commit()
+            self._connection.close()
@@ -0,0 +1,131 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import json
+import time
+from collections import deque, OrderedDict
+from itertools import count, chain
+
+# Spans of the alarm latency trace
+FIX_RECEIVED = 'fix received'
+EVALUATION_START = 'evaluation start'
+EVALUATION_END = 'evaluation end'
+TRIGGER_DECIDED = 'trigger decided'
+DIALOG_OPENED = 'dialog opened'
+SOUND_STARTED = 'sound started'
+SPANS = (FIX_RECEIVED, EVALUATION_START, EVALUATION_END, TRIGGER_DECIDED, DIALOG_OPENED, SOUND_STARTED)
+
+
+def percentile(values, fraction):
+    """Return percentile of the sorted values using the nearest rank."""
+    if not values:
+        return None
+    index = min(int(fraction * len(values)), len(values) - 1)
+    return values[index]
+
+
+class Tracer:
+    """
+    Timestamped spans of the alarm latency traces.
+
+    Every GPS fix starts a new trace and the following spans are recorded with its identifier.
+    Spans are kept in the ring buffer, so the tracer uses constant memory however long the app runs.
+    Traces which triggered the alarm are rare, so they are copied to their own bounded buffer
+    and are not evicted by the spans of the following fixes.
+    """
+
+    def __init__(self, capacity=2048, alarm_capacity=256):
+        # Ring buffer of the recorded spans as (trace id, span, timestamp) tuples
+        self.spans = deque(maxlen=capacity)
+        # Spans of the latest traces which triggered the alarm by trace id
+        self.alarm_traces = OrderedDict()
+        self.alarm_capacity = alarm_capacity
+        self._trace_ids = count(1)
+        # Identifier of the trace started by the last fix
+        self.trace_id = None
+
+    def start_trace(self):
+        """Start a new trace with the fix received span."""
+        self.trace_id = next(self._trace_ids)
+        self.record(FIX_RECEIVED)
+        return self.trace_id
+
+    def record(self, span, trace_id=None):
+        """Record span of the provided or the current trace."""
+        trace_id = trace_id or self.trace_id
+        if trace_id is None:
+            return False
+        entry = (trace_id, span, time.perf_counter())
+        self.spans.append(entry)
+        if trace_id in self.alarm_traces:
+            self.alarm_traces[trace_id].append(entry)
+        elif span == TRIGGER_DECIDED:
+            # Keep the alarm trace apart from the ring buffer
+            self.alarm_traces[trace_id] = [item for item in self.spans if item[0] == trace_id]
+            if len(self.alarm_traces) > self.alarm_capacity:
+                self.alarm_traces.popitem(last=False)
+        return True
+
+    def recorded_spans(self):
+        """Return spans of the ring buffer and the alarm traces ordered by their timestamps."""
+        spans = dict.fromkeys(chain(list(self.spans), *list(self.alarm_traces.values())))
+        return sorted(spans, key=lambda entry: entry[2])
+
+    def traces(self):
+        """Return recorded traces as dicts of span timestamps by trace id."""
+        traces = {}
+        for trace_id, span, timestamp in self.recorded_spans():
+            # Keep the first timestamp of the repeated span
+            traces.setdefault(trace_id, {}).setdefault(span, timestamp)
+        return traces
+
+    def latencies(self):
+        """Return sorted times from the fix received to every other span in milliseconds."""
+        latencies = {span: [] for span in SPANS[1:]}
+        for spans in self.traces().values():
+            fix_time = spans.get(FIX_RECEIVED)
+            # Trace started before the oldest span in the ring buffer
+            if fix_time is None:
+                continue
+            for span, timestamp in spans.items():
+                if span in latencies:
+                    latencies[span].append((timestamp - fix_time) * 1000)
+        for values in latencies.values():
+            values.sort()
+        return latencies
+
+    def percentiles(self, fractions=(.5, .95, .99)):
+        """Return percentiles of the latencies with number of samples for every span."""
+        return {
+            span: (len(values), [percentile(values, fraction) for fraction in fractions])
+            for span, values in self.latencies().items()
+        }
+
+    def report(self):
+        """Return latency percentiles as text lines."""
+        lines = []
+        for span, (samples, (p50, p95, p99)) in self.percentiles().items():
+            if samples:
+                lines.append(f'{span}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms ({samples})')
+            else:
+                lines.append(f'{span}: no samples')
+        return lines
+
+    def export(self, filename):
+        """Export recorded spans to the JSON lines file."""
+        with open(filename, 'w') as trace_file:
+            for trace_id, span, timestamp in self.recorded_spans():
+                trace_file.write(json.dumps({'trace': trace_id, 'span': span, 'time': timestamp}) + '\n')
+        return filename
+
+    def clear(self):
+        """Remove recorded spans."""
+        self.spans.clear()
+        self.alarm_traces.clear()
+
+
+# Tracer of the alarm latency
+tracer = Tracer()
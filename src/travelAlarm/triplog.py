@@ -0,0 +1,273 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import json
+import time
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.logger import Logger
+
+from pinstore import Pin
+from pinevents import PIN_ADDED, ACTIVE_CHANGED, BUFFER_CHANGED, PIN_MOVED, PIN_DELETED
+from geofence import GeofenceIndex
+
+# Types of the trip events
+FIX = 'fix'
+ARMED = 'armed'
+DISARMED = 'disarmed'
+ENTER = 'enter'
+EXIT = 'exit'
+ALARM_FIRED = 'alarm fired'
+ALARM_DISMISSED = 'alarm dismissed'
+EVENT_TYPES = (FIX, ARMED, DISARMED, ENTER, EXIT, ALARM_FIRED, ALARM_DISMISSED)
+# Pin events changing the armed pins once all pins are loaded
+ARMING_EVENTS = {PIN_ADDED, ACTIVE_CHANGED, BUFFER_CHANGED, PIN_MOVED, PIN_DELETED}
+# Columns of the trip event in the order they are stored
+EVENT_FIELDS = ('trip_id', 'time', 'type', 'target', 'target_id', 'latitude', 'longitude', 'distance', 'detail')
+
+
+class TripLog:
+    """
+    Append-only log of the trip events.
+
+    Events are appended to an in-memory ring buffer and written to the trip_events table by a single
+    background thread in batched transactions, so logging an event never waits for the disk.
+    The oldest events are deleted when the log exceeds the retention limits.
+    """
+
+    # Maximal number of events waiting for the flush, the oldest ones are dropped above it
+    capacity = 4096
+    # Number of events stored in one transaction
+    batch_size = 500
+    # Retention limits of the stored events
+    max_events = 100000
+    max_age = 30 * 24 * 3600
+    # Number of rows read at once by the export
+    export_chunk = 1000
+
+    def __init__(self, db_filename, pins=None):
+        self.db_filename = db_filename
+        # App's pin store
+        self.pins = pins
+        # Trip is the app's session
+        self.trip_id = int(time.time() * 1000)
+        self._pending = deque(maxlen=self.capacity)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._connection = None
+        # Armed pins are recorded once per trip when all pins are loaded, later only their changes
+        self.armed_recorded = False
+        # Number of events dropped by the ring buffer and stored
+        self.dropped = 0
+        self.stored = 0
+
+    def record(self, event_type, target=None, target_id=None, latitude=None, longitude=None, distance=None, detail=None):
+        """Append the event to the ring buffer."""
+        with self._lock:
+            if len(self._pending) == self.capacity:
+                self.dropped += 1
+            self._pending.append(
+                (self.trip_id, time.time(), event_type, target, target_id, latitude, longitude, distance, detail)
+            )
+
+    def record_pin(self, event_type, pin, distance=None):
+        """Append the event of the pin to the ring buffer."""
+        self.record(
+            event_type, 'pin', pin.pin_id, pin.latitude, pin.longitude, distance,
+            json.dumps({'buffer_meters': pin.buffer_meters}),
+        )
+
+    def record_armed(self):
+        """Append one event with all active pins, the armed set the trip starts with."""
+        self.record(ARMED, 'pins', detail=json.dumps([
+            (pin.pin_id, pin.latitude, pin.longitude, pin.buffer_meters) for pin in self.pins.values() if pin.is_active
+        ]))
+        self.armed_recorded = True
+
+    def apply_pin_events(self, events):
+        """Log arming and disarming of the pins regarding coalesced pin events."""
+        # Pins loaded at startup are recorded at once as the armed set
+        if not self.armed_recorded:
+            return
+        for pin_id, event_types in events.items():
+            if not event_types & ARMING_EVENTS:
+                continue
+            pin = self.pins.get(pin_id)
+            if pin is not None and pin.is_active and PIN_DELETED not in event_types:
+                self.record_pin(ARMED, pin)
+            # Changes of inactive pins other than switching them off do not disarm anything
+            elif pin is None or ACTIVE_CHANGED in event_types or PIN_DELETED in event_types:
+                self.record(DISARMED, 'pin', pin_id)
+
+    def _connect(self):
+        """Open the log's own connection and create its table."""
+        connection = sqlite3.connect(self.db_filename, check_same_thread=False)
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS trip_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                trip_id INTEGER,
+                time REAL,
+                type TEXT,
+                target TEXT,
+                target_id INTEGER,
+                latitude REAL,
+                longitude REAL,
+                distance REAL,
+                detail TEXT
+            );
+            CREATE INDEX IF NOT EXISTS trip_events_time ON trip_events (time);
+        ''')
+        connection.commit()
+        self._connection = connection
+
+    def flush(self):
+        """Write pending events in batched transactions and apply the retention limits."""
+        with self._lock:
+            events = list(self._pending)
+            self._pending.clear()
+        if not events:
+            return 0
+        try:
+            if self._connection is None:
+                self._connect()
+            with self._connection:
+                for start in range(0, len(events), self.batch_size):
+                    self._connection.executemany(
+                        f'INSERT INTO trip_events ({", ".join(EVENT_FIELDS)}) VALUES ({", ".join("?" * len(EVENT_FIELDS))});',
+                        events[start:start + self.batch_size]
+                    )
+                self._apply_retention()
+        except sqlite3.Error as error:
+            # Batch is written by the next flush, e.g. when the database is no longer locked
+            Logger.warning(f'TripLog: {len(events)} events not written: {error}')
+            self._requeue(events)
+            return 0
+        self.stored += len(events)
+        return len(events)
+
+    def _requeue(self, events):
+        """Put events which were not written back before the pending ones, the oldest are dropped above the capacity."""
+        with self._lock:
+            events = events + list(self._pending)
+            overflow = max(len(events) - self.capacity, 0)
+            self.dropped += overflow
+            self._pending = deque(events[overflow:], maxlen=self.capacity)
+
+    def _apply_retention(self):
+        """Delete events older than the maximal age or above the maximal number of events."""
+        self._connection.execute('DELETE FROM trip_events WHERE time < ?;', (time.time() - self.max_age,))
+        self._connection.execute(
+            'DELETE FROM trip_events WHERE id <= (SELECT MAX(id) FROM trip_events) - ?;', (self.max_events,)
+        )
+
+    def _submit_flush(self):
+        """Submit writing of pending events to the log's background thread and return its future."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trip-log')
+        return self._executor.submit(self.flush)
+
+    def flush_async(self, *args):
+        """Write pending events in the log's background thread."""
+        if not self._pending:
+            return False
+        self._submit_flush()
+        return True
+
+    def flush_sync(self):
+        """Write pending events in the log's background thread and wait until they are stored."""
+        return self._submit_flush().result()
+
+    def close(self):
+        """Write remaining events and close the log's connection."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.flush()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def events(self, trip_id=None):
+        """Yield stored events as dictionaries, rows are read in chunks."""
+        # Pending events and the flushes in progress are stored before reading
+        self.flush_sync()
+        connection = sqlite3.connect(self.db_filename)
+        try:
+            cursor = connection.cursor()
+            query = f'SELECT {", ".join(EVENT_FIELDS)} FROM trip_events'
+            try:
+                if trip_id is None:
+                    cursor.execute(query + ' ORDER BY id;')
+                else:
+                    cursor.execute(query + ' WHERE trip_id = ? ORDER BY id;', (trip_id,))
+            except sqlite3.OperationalError:
+                # Table is created by the first flush
+                return
+            while True:
+                rows = cursor.fetchmany(self.export_chunk)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(EVENT_FIELDS, row))
+        finally:
+            connection.close()
+
+    def export(self, filename, trip_id=None):
+        """Stream stored events into the file as JSON lines."""
+        count = 0
+        with open(filename, 'w') as file:
+            for event in self.events(trip_id):
+                file.write(json.dumps(event) + '\n')
+                count += 1
+        return count
+
+
+def read_events(filename):
+    """Yield events exported as JSON lines."""
+    with open(filename) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def logged_entries(events):
+    """Return pin identifiers of the logged buffer entries in order."""
+    return [event['target_id'] for event in events if event['type'] == ENTER and event['target'] == 'pin']
+
+
+def replay(events):
+    """
+    Feed logged fixes and pin changes into a new geofence index and return pin identifiers
+    of the buffer entries it detects in order, to be compared with logged_entries of the same events.
+    Distance of the logged fix is the accuracy margin it was evaluated with.
+    """
+    pins = {}
+    index = GeofenceIndex(pins)
+    entries = []
+    for event in events:
+        if event['target'] == 'pins' and event['type'] == ARMED:
+            armed = json.loads(event['detail'])
+            for pin_id, latitude, longitude, buffer_meters in armed:
+                pins[pin_id] = Pin(pin_id, True, None, latitude, longitude, buffer_meters, 'm')
+            index.apply_pin_events([pin_id for pin_id, latitude, longitude, buffer_meters in armed])
+        elif event['target'] == 'pin' and event['type'] in (ARMED, DISARMED):
+            pin_id = event['target_id']
+            if event['type'] == ARMED:
+                buffer_meters = json.loads(event['detail'])['buffer_meters']
+                pins[pin_id] = Pin(pin_id, True, None, event['latitude'], event['longitude'], buffer_meters, 'm')
+            else:
+                pins.pop(pin_id, None)
+            index.apply_pin_events([pin_id])
+        elif event['type'] == FIX:
+            for pin in index.pins_within_buffer(event['latitude'], event['longitude'], event['distance'] or 0):
+                entries.append(pin.pin_id)
+                # Triggered pin is deactivated like by the alarm dispatcher
+                pin.is_active = False
+                index.apply_pin_events([pin.pin_id])
+    return entries
@@ -0,0 +1,64 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from corridors import Corridor, CorridorIndex, read_gpx, simplify
+
+GPX = '''<?xml version="1.0"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1">
+  <metadata><name>Commute</name></metadata>
+  <trk>
+    <trkseg><trkpt lat="50.0" lon="19.9"/><trkpt lat="50.1" lon="19.9"/></trkseg>
+    <trkseg><trkpt lat="51.0" lon="21.0"/><trkpt lat="51.1" lon="21.0"/></trkseg>
+  </trk>
+  <rte><rtept lat="52.0" lon="21.0"/><rtept lat="52.1" lon="21.0"/></rte>
+</gpx>
+'''
+
+
+def test_read_gpx_stops_at_end_of_first_segment(tmp_path):
+    filename = tmp_path / 'commute.gpx'
+    filename.write_text(GPX)
+    assert read_gpx(str(filename)) == ('Commute', [(50.0, 19.9), (50.1, 19.9)])
+
+
+def check_route(mode, longitudes):
+    """Return numbers of the positions at which the corridor's alarm is triggered."""
+    corridors = CorridorIndex(None)
+    corridors.load([Corridor(1, 'commute', True, mode, 100, [(50.0, 19.9), (50.1, 19.9)])])
+    return [
+        number for number, longitude in enumerate(longitudes)
+        if corridors.check(50.05, longitude)
+    ]
+
+
+def test_leave_alarm_is_armed_again_on_reentry():
+    # On the route, off, off, back on and off again
+    assert check_route('leave', [19.9, 19.91, 19.92, 19.9, 19.91]) == [1, 4]
+
+
+def test_reach_alarm_is_armed_again_after_leaving():
+    assert check_route('reach', [19.91, 19.9, 19.9, 19.91, 19.9]) == [1, 4]
+
+
+def test_simplified_route_is_picked_by_the_pixel_length():
+    # Zigzag with 20 m wide teeth along 11 km
+    points = [(50.0 + index * .001, 19.9 + (index % 2) * .0003) for index in range(100)]
+    corridor = Corridor(1, 'zigzag', True, 'leave', 100, points)
+    # Route is drawn as it is until the levels are built
+    assert corridor.simplified(50) == points
+    corridor.build_levels()
+    assert corridor.simplified(.5) == points
+    assert corridor.simplified(50) == simplify(points, 32) == [points[0], points[-1]]
+    assert corridor.simplified(10) == simplify(points, 8)
+    assert len(corridor.simplified(10 ** 6)) == 2
+
+
+def test_corridor_levels_are_built_in_the_background():
+    corridors = CorridorIndex(None)
+    corridor = Corridor(1, 'commute', True, 'leave', 100, [(50.0, 19.9), (50.05, 19.91), (50.1, 19.9)])
+    corridors.load([corridor])
+    corridors._executor.shutdown(wait=True)
+    assert corridor.simplified(1) == corridor.points
@@ -0,0 +1,60 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from fixfilter import FixFilter, METERS_PER_DEGREE
+
+
+def test_coarse_fixes_update_the_position():
+    fix_filter = FixFilter()
+    assert fix_filter.process(50.0, 19.9, 150, 0) == (50.0, 19.9, 150)
+    # Fixes on a train or indoors are kept, only counted as coarse
+    for second in range(1, 6):
+        fix = fix_filter.process(50.0 + second * 10 / METERS_PER_DEGREE, 19.9, 200, second)
+        assert fix is not None
+    assert fix[0] > 50.0
+    assert fix_filter.stats()['coarse'] == 6
+    assert fix_filter.stats()['accepted'] == 6
+
+
+def test_high_speed_rail_fixes_are_not_jumps():
+    fix_filter = FixFilter()
+    # Train at 88 m/s with 5 m of alternating noise, one fix per second
+    for second in range(60):
+        noise = 5 if second % 2 else -5
+        fix = fix_filter.process(50.0 + (second * 88 + noise) / METERS_PER_DEGREE, 19.9, 10, second)
+        assert fix is not None
+    assert fix_filter.dropped_jumps == 0
+    # Filtered velocity follows the train
+    assert abs(fix_filter.vy - 88) < 5
+
+
+def test_single_jump_is_dropped_and_repeated_jump_is_accepted():
+    fix_filter = FixFilter()
+    for second in range(5):
+        fix_filter.process(50.0, 19.9, 10, second)
+    far = 50.0 + 3000 / METERS_PER_DEGREE
+    assert fix_filter.process(far, 19.9, 10, 5) is None
+    assert fix_filter.process(far, 19.9, 10, 6) is None
+    # Third consecutive fix far away is the new position
+    assert fix_filter.process(far, 19.9, 10, 7) == (far, 19.9, 10)
+    assert fix_filter.stats()['dropped_jumps'] == 2
+
+
+def test_gap_between_fixes_restarts_the_filter():
+    fix_filter = FixFilter()
+    fix_filter.process(50.0, 19.9, 10, 0)
+    far = 50.0 + 3000 / METERS_PER_DEGREE
+    assert fix_filter.process(far, 19.9, 10, fix_filter.max_fix_gap + 1) == (far, 19.9, 10)
+
+
+def test_noise_of_a_standing_user_is_smoothed():
+    fix_filter = FixFilter()
+    fix_filter.process(50.0, 19.9, 10, 0)
+    for second in range(1, 20):
+        noise = 10 if second % 2 else -10
+        latitude = fix_filter.process(50.0 + noise / METERS_PER_DEGREE, 19.9, 10, second)[0]
+    assert abs(latitude - 50.0) * METERS_PER_DEGREE < 10
+    assert fix_filter.adjusted > 0
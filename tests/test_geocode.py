@@ -0,0 +1,65 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import time
+import threading
+
+from kivy.clock import Clock
+
+from geocode import geocode_in_background
+
+
+def wait_for_callbacks(results, count, timeout=5):
+    """Run the main thread's clock until the callbacks are called."""
+    end = time.monotonic() + timeout
+    while len(results) < count and time.monotonic() < end:
+        Clock.tick()
+        time.sleep(.01)
+
+
+def test_results_are_delivered_in_main_thread():
+    results = []
+    geocode_in_background(
+        'test delivery', lambda text: text.upper(), ('rynek',),
+        lambda result: results.append((result, threading.current_thread() is threading.main_thread())),
+        results.append,
+    )
+    wait_for_callbacks(results, 1)
+    assert results == [('RYNEK', True)]
+
+
+def test_failure_is_delivered():
+    def fail(text):
+        raise ValueError('Geocoding failed')
+    errors = []
+    geocode_in_background('test failure', fail, ('rynek',), lambda result: None, errors.append)
+    wait_for_callbacks(errors, 1)
+    assert [str(error) for error in errors] == ['Geocoding failed']
+
+
+def test_superseded_request_is_skipped():
+    started = threading.Event()
+    release = threading.Event()
+    calls, results = [], []
+
+    def blocking(text):
+        started.set()
+        release.wait(5)
+        return text
+
+    def geocode(text):
+        calls.append(text)
+        return text
+
+    # Worker is busy, so the queued queries are superseded by the last one before they start
+    geocode_in_background('test blocking', blocking, ('first',), lambda result: None, lambda error: None)
+    started.wait(5)
+    for text in ('r', 'ry', 'rynek'):
+        geocode_in_background('test autocomplete', geocode, (text,), results.append, results.append)
+    release.set()
+    wait_for_callbacks(results, 1)
+    assert calls == ['rynek']
+    assert results == ['rynek']
@@ -0,0 +1,81 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import random
+
+from geopy.distance import geodesic
+
+from pinstore import Pin
+from geofence import GeofenceIndex
+
+
+def brute_force(pins, latitude, longitude, margin=0):
+    """Return identifiers of the active pins whose buffer contains the position, checking every pin."""
+    return {
+        pin.pin_id for pin in pins.values()
+        # Degree of latitude is longer than 110 km, so farther pins are skipped without the geodesic distance
+        if pin.is_active and abs(pin.latitude - latitude) * 110000 <= pin.buffer_meters
+        and geodesic((latitude, longitude), (pin.latitude, pin.longitude)).meters
+        - pin.buffer_meters + min(margin, pin.buffer_meters / 2) <= 0
+    }
+
+
+def test_index_matches_brute_force_on_random_walk():
+    random.seed(41)
+    pins = {
+        pin_id: Pin(
+            pin_id, random.random() < .5, None,
+            50 + random.uniform(-.05, .05), 19.9 + random.uniform(-.08, .08),
+            random.choice((50, 100, 300, 1)), random.choice(('m', 'm', 'km')),
+        )
+        for pin_id in range(2000)
+    }
+    index = GeofenceIndex(pins)
+    index.apply_pin_events(list(pins))
+
+    latitude, longitude = 50, 19.9
+    evaluated = 0
+    for step in range(400):
+        # Walk with occasional jumps
+        if random.random() < .02:
+            latitude, longitude = 50 + random.uniform(-.05, .05), 19.9 + random.uniform(-.08, .08)
+        else:
+            latitude += random.uniform(-.0004, .0004)
+            longitude += random.uniform(-.0006, .0006)
+
+        # Edit, switch, add and delete pins between the checks
+        changed = []
+        for _ in range(random.randint(0, 5)):
+            pin_id = random.randrange(2100)
+            action = random.random()
+            if pin_id not in pins or action < .1:
+                if pin_id in pins:
+                    del pins[pin_id]
+                else:
+                    pins[pin_id] = Pin(pin_id, True, None, latitude + random.uniform(-.01, .01), longitude, 200, 'm')
+            elif action < .5:
+                pins[pin_id].is_active = not pins[pin_id].is_active
+            elif action < .75:
+                pins[pin_id].latitude = latitude + random.uniform(-.01, .01)
+            else:
+                pins[pin_id].buffer_size = random.choice((50, 300, 1000))
+                pins[pin_id].buffer_unit = 'm'
+            changed.append(pin_id)
+        index.apply_pin_events(changed)
+
+        margin = random.choice((0, 0, 20))
+        expected = brute_force(pins, latitude, longitude, margin)
+        triggered = index.pins_within_buffer(latitude, longitude, margin)
+        evaluated += index.evaluated
+        assert {pin.pin_id for pin in triggered} == expected
+
+        # Triggered pins are switched off like by the alarm dispatcher
+        for pin in triggered:
+            pin.is_active = False
+        index.apply_pin_events([pin.pin_id for pin in triggered])
+
+    # Slack skips most of the distance computations
+    assert evaluated < 400 * len(pins) / 4
@@ -0,0 +1,114 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from geopy.adapters import AdapterHTTPError
+
+from geotransport import PooledAdapter
+
+# Nominatim search response of the stand-in service
+SEARCH_RESULT = [{'lat': '50.0614', 'lon': '19.9366', 'display_name': 'Rynek Główny, Kraków, Polska'}]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Local stand-in of the geocoding service answering with queued status codes and then with a result."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        server.times.append(time.monotonic())
+        status, headers = server.responses.pop(0) if server.responses else (200, {})
+        body = json.dumps(SEARCH_RESULT if status == 200 else {'error': status}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.connections = set()
+    server.times = []
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}/search?q=Rynek&format=json'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def adapter():
+    adapter = PooledAdapter()
+    # Keep the tests fast, the rate limit is tested with its own interval
+    adapter.min_interval = 0
+    adapter.backoff_base = .01
+    return adapter
+
+
+def test_requests_reuse_one_connection(stand_in, adapter):
+    server, url = stand_in
+    for _ in range(5):
+        assert adapter.get_json(url, timeout=5, headers={}) == SEARCH_RESULT
+    assert len(server.connections) == 1
+    assert adapter.stats()['requests'] == 5
+    assert adapter.stats()['retries'] == 0
+
+
+def test_transient_failures_are_retried(stand_in, adapter):
+    server, url = stand_in
+    server.responses = [(503, {}), (502, {})]
+    assert adapter.get_json(url, timeout=5, headers={}) == SEARCH_RESULT
+    stats = adapter.stats()
+    assert stats['retries'] == 2
+    assert stats['errors'] == {'HTTP 503': 1, 'HTTP 502': 1}
+
+
+def test_retry_after_is_respected(stand_in, adapter):
+    server, url = stand_in
+    server.responses = [(429, {'Retry-After': '1'})]
+    assert adapter.get_json(url, timeout=5, headers={}) == SEARCH_RESULT
+    assert server.times[1] - server.times[0] >= .9
+
+
+def test_permanent_failure_is_not_retried(stand_in, adapter):
+    server, url = stand_in
+    server.responses = [(400, {})]
+    with pytest.raises(AdapterHTTPError):
+        adapter.get_json(url, timeout=5, headers={})
+    assert len(server.times) == 1
+
+
+def test_retry_after_beyond_deadline_fails_at_once(stand_in, adapter):
+    server, url = stand_in
+    server.responses = [(503, {'Retry-After': '30'})]
+    start = time.monotonic()
+    with pytest.raises(AdapterHTTPError):
+        adapter.get_json(url, timeout=5, headers={})
+    assert time.monotonic() - start < 1
+
+
+def test_requests_are_spaced_by_rate_limit(stand_in, adapter):
+    server, url = stand_in
+    adapter.min_interval = .2
+    for _ in range(3):
+        adapter.get_json(url, timeout=5, headers={})
+    assert all(later - earlier >= .18 for earlier, later in zip(server.times, server.times[1:]))
@@ -0,0 +1,28 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from pinevents import PinEventBus, PIN_ADDED, ACTIVE_CHANGED, PIN_MOVED, PIN_DELETED
+
+
+def publish_and_flush(*published):
+    bus = PinEventBus()
+    delivered = []
+    bus.subscribe(delivered.append)
+    for pin_id, event_type in published:
+        bus.publish(pin_id, event_type)
+    bus.flush()
+    return delivered
+
+
+def test_events_are_coalesced_by_pin():
+    assert publish_and_flush((1, ACTIVE_CHANGED), (1, PIN_MOVED), (2, PIN_ADDED)) == [
+        {1: {ACTIVE_CHANGED, PIN_MOVED}, 2: {PIN_ADDED}}
+    ]
+
+
+def test_pin_added_and_deleted_within_frame_is_delivered_as_deleted():
+    # Database subscriber deletes the row inserted when the pin was added
+    assert publish_and_flush((1, PIN_ADDED), (1, ACTIVE_CHANGED), (1, PIN_DELETED)) == [{1: {PIN_DELETED}}]
@@ -0,0 +1,99 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import random
+
+from pinslistdata import PinsListData
+
+
+class RecycleView:
+    """Recycle view holding only its data."""
+
+    def __init__(self):
+        self.data = []
+
+
+class Pin:
+    """Pin record with a distance to sort by."""
+
+    def __init__(self, pin_id, distance):
+        self.pin_id = pin_id
+        self.distance = distance
+
+    def to_list_item(self):
+        return {'pin_id': self.pin_id}
+
+
+def sort_key(pin):
+    return pin.distance, pin.pin_id
+
+
+def assert_consistent(pins_list_data, pins):
+    """Check the data is sorted and every data index points at its pin's item."""
+    data = pins_list_data.data
+    assert [item['pin_id'] for item in data] == [pin.pin_id for pin in sorted(pins.values(), key=sort_key)]
+    assert len(pins_list_data.index) == len(data)
+    for pin_id, position in pins_list_data.index.items():
+        assert data[position]['pin_id'] == pin_id
+
+
+def test_rerank_moves_pin_to_front():
+    pins = {pin_id: Pin(pin_id, pin_id * 10) for pin_id in range(10)}
+    pins_list_data = PinsListData(RecycleView(), sort_key, False)
+    pins_list_data.reset(pins.values())
+
+    pins[7].distance = -1
+    assert pins_list_data.rerank(pins) == 1
+    assert_consistent(pins_list_data, pins)
+
+
+def test_rerank_random_moves_then_update_and_remove():
+    random.seed(0)
+    pins = {pin_id: Pin(pin_id, random.random()) for pin_id in range(200)}
+    pins_list_data = PinsListData(RecycleView(), sort_key, False)
+    pins_list_data.reset(pins.values())
+
+    for _ in range(50):
+        for pin in random.sample(list(pins.values()), random.randint(1, 20)):
+            pin.distance = random.random()
+        pins_list_data.rerank(pins)
+        assert_consistent(pins_list_data, pins)
+
+        # Data indexes stay valid for the following incremental changes
+        pin = random.choice(list(pins.values()))
+        pin.distance = random.random()
+        pins_list_data.update(pin)
+        removed = random.choice(list(pins))
+        pins_list_data.remove(removed)
+        del pins[removed]
+        assert_consistent(pins_list_data, pins)
+
+
+def test_incremental_changes_keep_other_items():
+    random.seed(28)
+    pins = {pin_id: Pin(pin_id, random.random()) for pin_id in range(100)}
+    pins_list_data = PinsListData(RecycleView(), sort_key, False)
+    pins_list_data.reset(pins.values())
+
+    for pin_id in range(100, 150):
+        items = {id(item) for item in pins_list_data.data}
+        action = random.choice(('insert', 'update', 'remove'))
+        if action == 'insert':
+            pins[pin_id] = Pin(pin_id, random.random())
+            position = pins_list_data.insert(pins[pin_id])
+        elif action == 'update':
+            pin = random.choice(list(pins.values()))
+            pin.distance = random.random()
+            position = pins_list_data.update(pin)
+        else:
+            removed = random.choice(list(pins))
+            del pins[removed]
+            position = pins_list_data.remove(removed)
+            assert removed not in pins_list_data
+        assert_consistent(pins_list_data, pins)
+        # Only the changed item is replaced in the data
+        assert len({id(item) for item in pins_list_data.data} - items) <= 1
+        assert position is not None
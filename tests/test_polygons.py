@@ -0,0 +1,25 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from polygons import Polygon, PolygonIndex
+
+# Square of about 1.1 by 0.7 km
+SQUARE = [(50.0, 19.9), (50.0, 19.91), (50.01, 19.91), (50.01, 19.9)]
+
+
+def test_area_alarm_is_armed_again_after_leaving():
+    polygons = PolygonIndex(None)
+    polygons.load([Polygon(1, 'office', True, SQUARE)])
+    # Outside, in, in, out and in again
+    positions = [(49.99, 19.905), (50.005, 19.905), (50.006, 19.905), (50.02, 19.905), (50.005, 19.905)]
+    assert [number for number, position in enumerate(positions) if polygons.check(*position)] == [1, 4]
+
+
+def test_margin_is_capped_by_area_size():
+    polygon = Polygon(1, 'office', True, SQUARE)
+    # Accuracy larger than the area still lets its center trigger
+    assert polygon.contains(50.005, 19.905, 2000)
+    assert not polygon.contains(50.0001, 19.905, 200)
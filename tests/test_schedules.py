@@ -0,0 +1,111 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from pinstore import Pin, PinStore
+from schedules import Schedule, ActivationScheduler, parse_days, parse_window, MINUTES_PER_DAY
+
+
+class ScheduleDatabase:
+    """Schedules table kept in memory."""
+
+    def __init__(self):
+        self.applied = {}
+
+    def add_schedule(self, days, start, end, pin_ids, applied_at=None):
+        schedule_id = len(self.applied) + 1
+        self.applied[schedule_id] = applied_at
+        return Schedule(schedule_id, days, start, end, pin_ids, applied_at)
+
+    def update_schedules_applied(self, schedule_ids, applied_at):
+        for schedule_id in schedule_ids:
+            self.applied[schedule_id] = applied_at
+
+
+def open_window(now):
+    """Return start and end minute of the window opened a minute before provided datetime."""
+    minute = now.hour * 60 + now.minute
+    return (minute - 1) % MINUTES_PER_DAY, (minute + 60) % MINUTES_PER_DAY
+
+
+def scheduler(is_active=False):
+    pins = PinStore()
+    pins.add(Pin(1, is_active, None, 50.0, 19.9, 300, 'm'))
+    return ActivationScheduler(pins, ScheduleDatabase()), pins
+
+
+def test_days_are_parsed_with_ranges_wrapping_the_week():
+    assert parse_days('Mon-Fri') == 0b0011111
+    assert parse_days('Sat, Sun') == 0b1100000
+    assert parse_days('sat-mon') == 0b1100001
+    with pytest.raises(ValueError):
+        parse_days('')
+    with pytest.raises(ValueError):
+        parse_days('Someday')
+
+
+def test_window_is_parsed_in_minutes():
+    assert parse_window('07:00-09:30') == (420, 570)
+    assert parse_window('22 - 6') == (1320, 360)
+    with pytest.raises(ValueError):
+        parse_window('25:00-26:00')
+    with pytest.raises(ValueError):
+        parse_window('07:00')
+
+
+def test_next_transition_follows_the_days_and_the_overnight_window():
+    # Window on Mondays from 22:00 until 06:00 of Tuesday
+    schedule = Schedule(1, parse_days('Mon'), 22 * 60, 6 * 60)
+    monday = datetime(2024, 1, 1, 12)
+    assert schedule.next_transition(monday) == datetime(2024, 1, 1, 22)
+    assert schedule.is_open(datetime(2024, 1, 2, 3))
+    assert schedule.next_transition(datetime(2024, 1, 2, 3)) == datetime(2024, 1, 2, 6)
+    assert schedule.next_transition(datetime(2024, 1, 2, 7)) == datetime(2024, 1, 8, 22)
+    assert schedule.last_transition(datetime(2024, 1, 5)) == datetime(2024, 1, 2, 6)
+
+
+def test_wake_applies_due_transitions():
+    scheduler_, pins = scheduler()
+    now = datetime.now()
+    schedule = Schedule(1, 0b1111111, *open_window(now), {1}, (now - timedelta(days=1)).timestamp())
+    scheduler_.schedules = {1: schedule}
+    scheduler_._heap = [((now - timedelta(seconds=5)).timestamp(), 1)]
+    scheduler_._wake()
+    assert pins.get(1).is_active
+    assert scheduler_.database.applied[1] >= now.timestamp() - 5
+    # Next transition of the schedule is waited for
+    assert scheduler_._heap[0][0] > now.timestamp()
+    scheduler_.stop()
+
+
+def test_restart_does_not_switch_on_pins_switched_off_within_the_window():
+    now = datetime.now()
+    start, end = open_window(now)
+    # Window has opened before the last applied transition and the alarm has switched the pin off since
+    scheduler_, pins = scheduler(is_active=False)
+    scheduler_.load([Schedule(1, 0b1111111, start, end, {1}, now.timestamp())])
+    assert not pins.get(1).is_active
+    scheduler_.stop()
+
+    # Opening of the window missed while the app was closed is applied
+    scheduler_, pins = scheduler(is_active=False)
+    scheduler_.load([Schedule(1, 0b1111111, start, end, {1}, (now - timedelta(minutes=5)).timestamp())])
+    assert pins.get(1).is_active
+    scheduler_.stop()
+
+
+def test_closing_window_keeps_pins_of_other_open_windows():
+    now = datetime.now()
+    scheduler_, pins = scheduler(is_active=False)
+    opened = Schedule(1, 0b1111111, *open_window(now), {1}, now.timestamp())
+    closed = Schedule(2, 0b1111111, *open_window(now - timedelta(hours=3)), {1}, now.timestamp())
+    scheduler_.schedules = {1: opened, 2: closed}
+    # Pin switched off by the alarm in the open window stays off when the other window closes
+    scheduler_.apply([closed], now)
+    assert not pins.get(1).is_active
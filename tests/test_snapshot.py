@@ -0,0 +1,43 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import sqlite3
+
+from pinstore import Pin
+from snapshot import PinSnapshot, write_snapshot, read_change_counter
+
+
+def write_files(tmp_path):
+    db_filename = str(tmp_path / 'pins.db')
+    connection = sqlite3.connect(db_filename)
+    connection.execute('CREATE TABLE pins (id INTEGER PRIMARY KEY);')
+    connection.commit()
+    connection.close()
+    snapshot_filename = str(tmp_path / 'pins.snapshot')
+    pins = [Pin(pin_id, pin_id % 2, f'Street {pin_id}', 50.0 + pin_id, 19.9, 300, 'm') for pin_id in range(1, 6)]
+    write_snapshot(snapshot_filename, read_change_counter(db_filename), {'theme_style': 'Dark'}, pins)
+    return snapshot_filename, db_filename
+
+
+def test_snapshot_is_read_back(tmp_path):
+    snapshot_filename, db_filename = write_files(tmp_path)
+    snapshot = PinSnapshot.open(snapshot_filename, db_filename)
+    assert snapshot.settings == {'theme_style': 'Dark'}
+    assert [(pin.pin_id, pin.is_active, pin.address) for pin in snapshot.pins()][:2] == [
+        (1, True, 'Street 1'), (2, False, 'Street 2')
+    ]
+    snapshot.close()
+
+
+def test_truncated_snapshot_falls_back_to_the_database(tmp_path):
+    snapshot_filename, db_filename = write_files(tmp_path)
+    with open(snapshot_filename, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    # Every truncation, including the ones not aligned to the column's item size, is rejected
+    for length in range(len(data)):
+        with open(snapshot_filename, 'wb') as snapshot_file:
+            snapshot_file.write(data[:length])
+        assert PinSnapshot.open(snapshot_filename, db_filename) is None
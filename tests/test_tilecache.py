@@ -0,0 +1,55 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from tilestore import TileStore
+
+tilecache = pytest.importorskip('tilecache', exc_type=ImportError)
+
+
+class TileServerHandler(BaseHTTPRequestHandler):
+    """Local tile server answering every tile with its path as the data."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TileServerHandler)
+    server.daemon_threads = True
+    server.paths = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}/{{z}}/{{x}}/{{y}}.png'
+    server.shutdown()
+    server.server_close()
+
+
+def test_cached_tiles_are_not_downloaded_again(tmp_path, tile_server):
+    server, url = tile_server
+    store = TileStore(str(tmp_path / 'tiles.mbtiles'))
+    source = tilecache.CachedMapSource(store, url=url, min_zoom=3)
+    first = source.get_tile_data(12, 2270, 2684)
+    assert source.get_tile_data(12, 2270, 2684) == first
+    # Rows of the tile server are counted from the north
+    assert server.paths == ['/12/2270/1411.png']
+    assert store.stats()['hits'] == 1
+    store.close()
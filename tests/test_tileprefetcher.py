@@ -0,0 +1,70 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+from pinstore import Pin, PinStore
+from pinevents import PIN_ADDED, BUFFER_CHANGED
+from tileprefetcher import TilePrefetcher, allows_prefetch
+
+
+class TileSource:
+    """Tile source downloading nothing and storing nothing."""
+
+    def __init__(self, url):
+        self.url = url
+        self.store = self
+        self.downloaded = []
+
+    def contains(self, zoom, column, row):
+        return True
+
+    def put(self, zoom, column, row, data):
+        pass
+
+    def download(self, zoom, column, row):
+        self.downloaded.append((zoom, column, row))
+        return b''
+
+
+def prefetcher(url='https://tiles.example.com/{z}/{x}/{y}.png'):
+    pins = PinStore()
+    pins.add(Pin(1, True, None, 52.2297, 21.0122, 20, 'km'))
+    return TilePrefetcher(TileSource(url), pins)
+
+
+def test_openstreetmap_servers_are_never_prefetched():
+    assert not allows_prefetch('http://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png')
+    assert not allows_prefetch('https://tile.osm.org/{z}/{x}/{y}.png')
+    assert allows_prefetch('https://tiles.example.com/{z}/{x}/{y}.png')
+
+    osm = prefetcher('http://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png')
+    osm.pins_loaded = True
+    assert osm.prefetch_pins() == 0
+    assert osm.prefetch_path(52.0, 20.0) == 0
+    osm.apply_pin_events({1: {BUFFER_CHANGED}})
+    assert osm._executor is None
+
+
+def test_tiles_are_capped_per_pin_and_zoom():
+    prefetch = prefetcher()
+    # Buffer of 20 km covers thousands of tiles at the highest zoom levels
+    assert prefetch.prefetch_pins() == prefetch.max_tiles_per_pin
+    prefetch.stop()
+
+    prefetch = prefetcher()
+    prefetch.max_tiles_per_pin = 1000
+    assert prefetch.prefetch_pins() <= prefetch.max_tiles_per_zoom * len(prefetch.zoom_levels)
+    prefetch.stop()
+
+
+def test_pins_loaded_at_startup_are_not_prefetched():
+    prefetch = prefetcher()
+    prefetch.apply_pin_events({1: {PIN_ADDED}})
+    assert prefetch._executor is None
+
+    prefetch.pins_loaded = True
+    prefetch.apply_pin_events({1: {PIN_ADDED}})
+    assert prefetch._executor is not None
+    prefetch.stop()
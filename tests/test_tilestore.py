@@ -0,0 +1,51 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import sqlite3
+
+from tilestore import TileStore, tile_xy
+
+
+def last_used(filename, zoom, column, row):
+    connection = sqlite3.connect(filename)
+    try:
+        return connection.execute(
+            'SELECT last_used FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;', (zoom, column, row)
+        ).fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_tile_uses_are_written_in_batches(tmp_path):
+    filename = str(tmp_path / 'tiles.mbtiles')
+    store = TileStore(filename)
+    store.put(10, 1, 1, b'tile', last_used=1)
+    # Serving the tile only marks it as used in memory
+    assert store.get(10, 1, 1) == b'tile'
+    assert last_used(filename, 10, 1, 1) == 1
+    store.flush()
+    assert last_used(filename, 10, 1, 1) > 1
+    store.close()
+
+
+def test_least_recently_used_tiles_are_evicted(tmp_path):
+    store = TileStore(str(tmp_path / 'tiles.mbtiles'), max_bytes=1000)
+    for column in range(4):
+        store.put(10, column, 0, bytes(200), last_used=column)
+    # Use of the oldest tile kept in memory is written before the eviction
+    store.get(10, 0, 0)
+    store.put(10, 4, 0, bytes(200))
+    store.put(10, 5, 0, bytes(200))
+    assert store.contains(10, 0, 0)
+    assert not store.contains(10, 1, 0)
+    store.close()
+
+
+def test_tile_rows_are_counted_from_the_south():
+    assert tile_xy(0, 52.2, 21.0) == (0, 0)
+    # Northern hemisphere is in the upper half of the rows
+    column, row = tile_xy(12, 52.2, 21.0)
+    assert column == 2286 and row >= 1 << 11
@@ -0,0 +1,83 @@
+# Coding: UTF-8
+
+# Copyright (C) 2024 Michał Prędki
+# Licensed under the GNU General Public License v3.0.
+# Full text of the license can be found in the LICENSE and COPYING files in the repository.
+
+import os
+
+from pinstore import Pin
+from pinevents import PIN_ADDED, ACTIVE_CHANGED, PIN_MOVED
+from triplog import TripLog, FIX, ENTER, ARMED, DISARMED, logged_entries, replay
+
+
+def make_log(tmp_path, count=1000):
+    pins = {pin_id: Pin(pin_id, pin_id % 2 == 0, None, 50 + pin_id * .01, 19.9, 100, 'm') for pin_id in range(count)}
+    return TripLog(os.path.join(tmp_path, 'pins.db'), pins), pins
+
+
+def test_loaded_pins_are_recorded_once_as_armed_set(tmp_path):
+    trip_log, pins = make_log(tmp_path)
+    # Pins loaded at startup are published as added before the armed set is recorded
+    trip_log.apply_pin_events({pin_id: {PIN_ADDED} for pin_id in pins})
+    trip_log.record_armed()
+    trip_log.apply_pin_events({0: {PIN_ADDED}})
+    events = list(trip_log.events())
+    trip_log.close()
+    assert [(event['type'], event['target']) for event in events] == [(ARMED, 'pins'), (ARMED, 'pin')]
+
+
+def test_only_arming_changes_are_logged(tmp_path):
+    trip_log, pins = make_log(tmp_path, 4)
+    trip_log.record_armed()
+    pins[1].latitude += .1
+    pins[2].is_active = False
+    trip_log.apply_pin_events({1: {PIN_MOVED}, 2: {ACTIVE_CHANGED}})
+    events = list(trip_log.events())[1:]
+    trip_log.close()
+    # Moved inactive pin is not armed, so only switching the pin off is logged
+    assert [(event['type'], event['target_id']) for event in events] == [(DISARMED, 2)]
+
+
+def test_events_include_pending_events(tmp_path):
+    trip_log, pins = make_log(tmp_path, 2)
+    trip_log.flush_async()
+    for index in range(trip_log.batch_size * 3):
+        trip_log.record(FIX, latitude=50, longitude=19.9, distance=0)
+    assert len(list(trip_log.events())) == trip_log.batch_size * 3
+    trip_log.close()
+
+
+def test_replay_matches_logged_entries(tmp_path):
+    trip_log, pins = make_log(tmp_path, 10)
+    trip_log.record_armed()
+    # Pass along the pins and log the entries like the GPS marker does
+    for step in range(100):
+        latitude = 49.99 + step * .001
+        trip_log.record(FIX, latitude=latitude, longitude=19.9, distance=0)
+        for pin in pins.values():
+            if pin.is_active and abs(pin.latitude - latitude) * 111320 <= pin.buffer_meters:
+                trip_log.record_pin(ENTER, pin)
+                pin.is_active = False
+                trip_log.apply_pin_events({pin.pin_id: {ACTIVE_CHANGED}})
+    events = list(trip_log.events())
+    trip_log.close()
+    assert logged_entries(events) == [0, 2, 4, 6, 8]
+    assert replay(events) == logged_entries(events)
+
+
+def test_failed_flush_keeps_the_events(tmp_path):
+    trip_log, pins = make_log(tmp_path, 4)
+    db_filename = trip_log.db_filename
+    # Directory cannot be opened as the database
+    trip_log.db_filename = str(tmp_path)
+    trip_log.record(FIX, latitude=50.0, longitude=19.9)
+    trip_log.flush_async()
+    assert trip_log.flush_sync() == 0
+    assert trip_log.stored == 0 and trip_log.dropped == 0
+
+    trip_log.db_filename = db_filename
+    trip_log.record(FIX, latitude=50.1, longitude=19.9)
+    assert [event['latitude'] for event in trip_log.events()] == [50.0, 50.1]
+    trip_log.close()
+